@@ -0,0 +1,90 @@
+import json
+import math
+
+import numpy as np
+from bson import ObjectId, json_util
+
+# BSON documents straight to JSON bytes, in the same relaxed Extended JSON that
+# json.loads(json_util.dumps(doc)) + JSONResponse produced: {"$oid": ...}, {"$date": ...},
+# {"$binary": ...}, {"$numberDouble": "NaN"}. Plain values and NumPy arrays go to the C json
+# encoder as they are; only BSON types are converted, in a single walk.
+
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_LIST_SLICE = 8192  # list/array elements encoded per piece when streaming
+
+_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+_PLAIN = (str, int, bool, type(None))
+
+
+def _float(x):
+    if math.isfinite(x):
+        return x
+    return {"$numberDouble": "NaN" if x != x else ("Infinity" if x > 0 else "-Infinity")}
+
+
+def _array(arr):
+    # NumPy fast path: numeric arrays only need a look at their non-finite values
+    if arr.dtype.kind in "iub":
+        return arr.tolist()
+    if arr.dtype.kind == "f" and np.isfinite(arr).all():
+        return arr.tolist()
+    return to_json_compatible(arr.tolist())
+
+
+def to_json_compatible(value):
+    # Replaces BSON/NumPy values with their Extended JSON form; plain values are returned as they are
+    if isinstance(value, _PLAIN):
+        return value
+    if isinstance(value, float):
+        return _float(value)
+    if isinstance(value, dict):
+        return {k: to_json_compatible(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if all(isinstance(v, _PLAIN) or (isinstance(v, float) and math.isfinite(v)) for v in value):
+            return value
+        return [to_json_compatible(v) for v in value]
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, np.ndarray):
+        return _array(value)
+    if isinstance(value, np.generic):
+        return to_json_compatible(value.item())
+    # datetime, Binary/bytes, Decimal128, ... exactly as json_util writes them
+    return to_json_compatible(json_util.default(value))
+
+
+def dumps(doc):
+    """Encode a document (possibly holding NumPy arrays) to UTF-8 JSON bytes in one pass."""
+    return _encoder.encode(to_json_compatible(doc)).encode("utf-8")
+
+
+def _pieces(value):
+    if isinstance(value, dict):
+        yield "{"
+        for i, (k, v) in enumerate(value.items()):
+            yield ("," if i else "") + _encoder.encode(k) + ":"
+            yield from _pieces(v)
+        yield "}"
+    elif isinstance(value, (list, tuple, np.ndarray)) and len(value) > STREAM_LIST_SLICE:
+        yield "["
+        for start in range(0, len(value), STREAM_LIST_SLICE):
+            part = value[start:start + STREAM_LIST_SLICE]
+            part = _array(part) if isinstance(part, np.ndarray) else to_json_compatible(list(part))
+            yield ("," if start else "") + _encoder.encode(part)[1:-1]
+        yield "]"
+    else:
+        yield _encoder.encode(to_json_compatible(value))
+
+
+def iter_dumps(doc, chunk_size=STREAM_CHUNK_SIZE):
+    """Same bytes as dumps(doc), yielded in chunks of about chunk_size for a StreamingResponse."""
+    buffer = []
+    size = 0
+    for piece in _pieces(doc):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
@@ -1,13 +1,21 @@
-import requests
 import json
+import sys
+
+from api.restapi.session_client import SessionClient
 
 BASE_URL = "http://localhost:8000"
 SESSION_ID = "68fc08cd35cf3183635f4598"
 
-r = requests.get(f"{BASE_URL}/get_session/{SESSION_ID}", timeout=30)
-r.raise_for_status() # check for HTTP errors
-
-data = r.json()
+# One session to session_data.json, or with a file of session ids (one per line):
+# PYTHONPATH=(...) python3 api/restapi/client_restapi.py [ids.txt] [out.ndjson]
 
-with open("session_data.json", "w", encoding="utf-8") as f:
-    json.dump(data, f, ensure_ascii=False, indent=4)
+with SessionClient(BASE_URL) as client:
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            ids = [line.strip() for line in f if line.strip()]
+        out = sys.argv[2] if len(sys.argv) > 2 else "sessions.ndjson"
+        print(f"{client.download_sessions(ids, out)} sessions written to {out}")
+    else:
+        data = client.get_session(SESSION_ID)
+        with open("session_data.json", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
@@ -1,18 +1,209 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
-from bson import ObjectId, json_util
-from database.serverHelper import get_session_with_embedded_info
-import json
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from database.serverHelper import (
+    PHASH_MAX_DISTANCE, PHASH_MAX_SEARCH_DISTANCE, SESSION_MAX_PAGE_SIZE, SESSION_PAGE_SIZE, UPLOAD_CHUNK_SIZE, abort_upload, ensure_indexes,
+    finish_upload, get_upload, iter_files_zip, start_upload, write_upload_chunk,
+)
+from database.asyncServerHelper import (
+    find_similar_images, get_gcode_layer, get_image_preview, get_session_file_ids, get_session_with_embedded_info, get_sessions_with_embedded_info,
+    list_sessions, read_timeseries_range,
+)
+from api.restapi.bson_json import dumps, iter_dumps
 
 app = FastAPI()
+ensure_indexes()
+
+MAX_SESSION_BATCH = 500  # session ids per /get_sessions request
+SESSION_STREAM_CHUNK = 25  # sessions resolved at a time while /get_sessions streams
 
 # to run it, open a new terminal in this folder and run:
 # PYTHONPATH=(PATH TO THE PROJECT FOLDER) uvicorn server_restapi:app --reload --port 8000
+# Endpoints are async and read through database/asyncServerHelper.py, so waiting on MongoDB
+# doesn't hold a thread; large responses are JSON-encoded in the thread pool.
+
+def _oid(value):
+    # Path, query and body ids: a malformed one is a 400, not a 500
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _split_fields(values):
+    # Accepts repeated params and comma-separated lists: ?include=a&include=b or ?include=a,b
+    return [v.strip() for value in values or [] for v in value.split(",") if v.strip()]
+
+@app.get("/sessions")
+async def sessions_page(after: str = None, limit: int = Query(SESSION_PAGE_SIZE, ge=1, le=SESSION_MAX_PAGE_SIZE),
+                        sort: str = "_id", descending: bool = True):
+    # Session summaries, newest first; pass the returned "next" as ?after= for the following page
+    try:
+        result = await list_sessions(after and _oid(after), limit, sort, descending)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return Response(content=dumps(result), media_type="application/json")
 
 @app.get("/get_session/{session_id}")
-def get_session(session_id: str):
-    oid = ObjectId(session_id)
-    result = get_session_with_embedded_info(oid)
+async def get_session(session_id: str, summary: bool = False, include: list[str] = Query(None), image_fields: list[str] = Query(None), stream: bool = False):
+    # e.g. ?summary=true for the structure only, ?include=timeseries.data, ?image_fields=name,metadata.width
+    # ?stream=true sends the JSON in chunks instead of building it whole
+    oid = _oid(session_id)
+    try:
+        result = await get_session_with_embedded_info(oid, summary, _split_fields(include), _split_fields(image_fields), as_arrays=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if stream:
+        return StreamingResponse(iter_dumps(result), media_type="application/json")
+    return Response(content=await run_in_threadpool(dumps, result), media_type="application/json")
+
+class SessionBatch(BaseModel):
+    session_ids: list[str]
+    summary: bool = False
+    include: list[str] = []
+    image_fields: list[str] = []
+
+@app.post("/get_sessions")
+async def get_sessions(batch: SessionBatch):
+    # Many sessions in one call, as NDJSON: one line per requested id, in request order, shaped like
+    # /get_session. Ids that don't exist get {"_id": ..., "error": "not found"} lines instead.
+    if len(batch.session_ids) > MAX_SESSION_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SESSION_BATCH} session ids per request.")
+    # Resolved SESSION_STREAM_CHUNK ids at a time as the lines are sent, so only one chunk of
+    # sessions (with their timeseries) is in memory at once
+    oids = [_oid(s) for s in batch.session_ids]
+    try:
+        fields = _split_fields(batch.include), _split_fields(batch.image_fields)
+        # The first chunk is read here so bad fields still get a 400 before the response starts
+        first = await get_sessions_with_embedded_info(oids[:SESSION_STREAM_CHUNK], batch.summary, *fields, as_arrays=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def lines():
+        sessions = first
+        for start in range(0, len(oids), SESSION_STREAM_CHUNK):
+            chunk = oids[start:start + SESSION_STREAM_CHUNK]
+            if start:
+                sessions = await get_sessions_with_embedded_info(chunk, batch.summary, *fields, as_arrays=True)
+            for oid in chunk:
+                session = sessions.get(oid, {"_id": oid, "error": "not found"})
+                yield await run_in_threadpool(dumps, session) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/session_files_zip/{session_id}")
+async def session_files_zip(session_id: str):
+    # The session's raw files as a ZIP built while it is sent. The generator reads GridFS with the
+    # sync client; StreamingResponse runs it in the thread pool, off the event loop.
+    file_ids = await get_session_file_ids(_oid(session_id))
+    if file_ids is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+
+    headers = {"Content-Disposition": f'attachment; filename="session_{session_id}.zip"'}
+    return StreamingResponse(iter_files_zip(file_ids), media_type="application/zip", headers=headers)
+
+@app.get("/gcode_layer/{file_id}/{layer}")
+async def gcode_layer(file_id: str, layer: int):
+    data = await get_gcode_layer(_oid(file_id), layer)
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Layer {layer} not found for file {file_id}")
+
+    return Response(content=data, media_type="text/plain")
+
+
+@app.get("/image_preview/{image_id}")
+async def image_preview(image_id: str, size: int = Query(160, ge=1)):
+    # Closest stored preview for a display of `size` px (longest side)
+    result = await get_image_preview(_oid(image_id), size)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Image {image_id} not found")
+
+    data, media_type = result
+    return Response(content=data, media_type=media_type)
+
+@app.get("/similar_images/{image_id}")
+async def similar_images(image_id: str, max_distance: int = Query(PHASH_MAX_DISTANCE, ge=0, le=PHASH_MAX_SEARCH_DISTANCE)):
+    # Near duplicates by perceptual hash (hamming distance in bits), closest first
+    result = await find_similar_images(_oid(image_id), max_distance)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Image {image_id} not found or not hashed yet")
+
+    return [{"image_id": str(img_id), "distance": distance} for img_id, distance in result]
+
+@app.get("/timeseries/{timeseries_id}")
+async def timeseries_range(timeseries_id: str, start: float = None, stop: float = None,
+                     resolution: int = Query(None, ge=1), unit: str = "sample"):
+    # e.g. /timeseries/<id>?start=0&stop=60&unit=time&resolution=1000 for a plot-sized overview
+    try:
+        result = await read_timeseries_range(_oid(timeseries_id), start, stop, resolution, unit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Timeseries {timeseries_id} not found")
+
+    return Response(content=await run_in_threadpool(dumps, result), media_type="application/json")
+
+# Chunked uploads straight into GridFS (see start_upload in database/serverHelper.py):
+# POST /uploads {"filename", "length"} -> the upload with its "_id", "chunk_size" and "missing" chunk numbers,
+# PUT /uploads/<id>/chunks/<n> with the raw bytes of chunk n (several at once is fine),
+# GET /uploads/<id> to see what is still missing after a dropped connection, and
+# POST /uploads/<id>/finish for the stored (or already existing) GridFS "file_id".
+# The writes use the sync client in the thread pool, like the ZIP download.
+
+class UploadStart(BaseModel):
+    filename: str
+    length: int
+    metadata: dict = {}
+
+def _upload_response(upload, upload_id):
+    if upload is None:
+        raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
+    return Response(content=dumps(upload), media_type="application/json")
+
+@app.post("/uploads")
+async def create_upload(body: UploadStart):
+    try:
+        upload = await run_in_threadpool(start_upload, body.filename, body.length, body.metadata)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _upload_response(upload, None)
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    return _upload_response(await run_in_threadpool(get_upload, _oid(upload_id)), upload_id)
+
+@app.put("/uploads/{upload_id}/chunks/{n}")
+async def upload_chunk(upload_id: str, n: int, request: Request):
+    oid = _oid(upload_id)
+    # Read with a cap, so a wrong client can't make the server buffer more than one chunk
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        if len(data) > UPLOAD_CHUNK_SIZE:
+            raise HTTPException(status_code=413, detail=f"Chunks are at most {UPLOAD_CHUNK_SIZE} bytes")
+    try:
+        result = await run_in_threadpool(write_upload_chunk, oid, n, bytes(data))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
+    return {"n": n}
+
+@app.post("/uploads/{upload_id}/finish")
+async def upload_finish(upload_id: str):
+    oid = _oid(upload_id)
+    try:
+        upload = await run_in_threadpool(finish_upload, oid)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _upload_response(upload, upload_id)
 
-    payload = json.loads(json_util.dumps(result))
-    return JSONResponse(content=payload)
+@app.delete("/uploads/{upload_id}")
+async def upload_abort(upload_id: str):
+    if not await run_in_threadpool(abort_upload, _oid(upload_id)):
+        raise HTTPException(status_code=404, detail=f"No unfinished upload {upload_id}")
+    return {"aborted": upload_id}
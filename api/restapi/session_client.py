@@ -0,0 +1,111 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Client for api/restapi/server_restapi.py. One requests.Session is shared by all calls, so
+# connections are kept alive and reused; bulk downloads split the ids into pages for
+# /get_sessions, fetch several pages at once and write the NDJSON lines to disk as they arrive.
+# Uploads go the other way through /uploads, several chunks at once, read from disk one at a time.
+
+BASE_URL = "http://localhost:8000"
+PAGE_SIZE = 50  # session ids per /get_sessions request (the server allows up to 500)
+WORKERS = 4  # pages fetched concurrently
+TIMEOUT = 60
+CONNECT_RETRIES = 3
+UPLOAD_ROUNDS = 3  # passes over the missing chunks before an upload gives up
+
+
+class SessionClient:
+    def __init__(self, base_url=BASE_URL, workers=WORKERS, page_size=PAGE_SIZE, timeout=TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers
+        self.page_size = page_size
+        self.timeout = timeout
+        self.http = requests.Session()
+        # One pooled connection per worker; retries only cover failing to connect
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=CONNECT_RETRIES)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.http.close()
+
+    def get_session(self, session_id, summary=False, include=None, image_fields=None):
+        # One session as a dict (ObjectIds etc. in Extended JSON form), None if it doesn't exist
+        params = {"summary": summary, "include": include or [], "image_fields": image_fields or []}
+        r = self.http.get(f"{self.base_url}/get_session/{session_id}", params=params, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def _fetch_page(self, session_ids, options, write):
+        body = {"session_ids": [str(s) for s in session_ids], **options}
+        with self.http.post(f"{self.base_url}/get_sessions", json=body, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            count = 0
+            for line in r.iter_lines(chunk_size=64 * 1024):
+                if line:
+                    write(line)
+                    count += 1
+        return count
+
+    def download_sessions(self, session_ids, path, summary=False, include=None, image_fields=None):
+        # Writes one JSON line per id to `path` (NDJSON) and returns the number of lines written.
+        # Pages are fetched concurrently, so lines come in page completion order, not id order;
+        # ids that don't exist come back as {"_id": ..., "error": "not found"}.
+        session_ids = list(session_ids)
+        options = {"summary": summary, "include": include or [], "image_fields": image_fields or []}
+        pages = [session_ids[i:i + self.page_size] for i in range(0, len(session_ids), self.page_size)]
+        lock = threading.Lock()
+
+        with open(path, "wb") as out:
+            def write(line):
+                with lock:
+                    out.write(line)
+                    out.write(b"\n")
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                return sum(pool.map(lambda page: self._fetch_page(page, options, write), pages))
+
+    def _upload_request(self, method, path, **kwargs):
+        r = self.http.request(method, f"{self.base_url}/uploads{path}", timeout=self.timeout, **kwargs)
+        r.raise_for_status()
+        return r.json()
+
+    def _send_chunk(self, path, upload_id, chunk_size, n):
+        with open(path, "rb") as f:
+            f.seek(n * chunk_size)
+            data = f.read(chunk_size)
+        try:
+            self._upload_request("PUT", f"/{upload_id}/chunks/{n}", data=data)
+        except requests.RequestException:
+            return False  # sent again in the next round
+        return True
+
+    def upload_file(self, path, metadata=None, upload_id=None):
+        # Uploads a file in chunks into GridFS and returns its file id (an existing one if the same
+        # content is already stored). Pass the upload_id of an interrupted upload to resume it.
+        path = Path(path)
+        if upload_id is None:
+            upload = self._upload_request("POST", "", json={"filename": path.name, "length": path.stat().st_size, "metadata": metadata or {}})
+            upload_id = upload["_id"]["$oid"]
+        else:
+            upload = self._upload_request("GET", f"/{upload_id}")
+
+        for _ in range(UPLOAD_ROUNDS):
+            if not upload["missing"]:
+                break
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                list(pool.map(lambda n: self._send_chunk(path, upload_id, upload["chunk_size"], n), upload["missing"]))
+            upload = self._upload_request("GET", f"/{upload_id}")
+
+        upload = self._upload_request("POST", f"/{upload_id}/finish")
+        return upload["file_id"]["$oid"]
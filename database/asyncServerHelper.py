@@ -0,0 +1,204 @@
+from bson import ObjectId
+from gridfs import AsyncGridFS
+from pymongo import AsyncMongoClient
+from pymongo.errors import OperationFailure
+from database.serverHelper import (
+    DB_NAME, DOCUMENT_TOO_LARGE_CODES, MONGODB_URI, PHASH_MAX_DISTANCE, SESSION_PAGE_SIZE,
+    _attach_image_collections, _attach_print_job, _attach_sessions_timeseries, _attach_timeseries, _check_session_page,
+    _collection_image_ids, _phash_candidates_query, _phash_matches, _preview_file, _print_job_ref_ids, _range_from_buckets,
+    _range_plan, _range_query, _session_page, _session_page_after, _session_page_pipeline, _session_pipeline,
+    _session_projections, _shape_session, _timeseries_arrays, _timeseries_buckets_query,
+)
+from scripts.imageprocessing import PREVIEW_SIZES
+
+# The read side of serverHelper on pymongo's AsyncMongoClient, for the async endpoints of
+# api/restapi/server_restapi.py: same arguments, same results, awaited instead of blocking a
+# thread per request. Only the queries are made here: building them and decoding the results
+# is done by the same helpers as in serverHelper. Writes (ingestion, index creation) stay there.
+
+client = AsyncMongoClient(MONGODB_URI)
+db = client[DB_NAME]
+fs = AsyncGridFS(db)
+
+
+####### SESSIONS #######
+
+async def get_all_sessions():
+    return await db["print_sessions"].find({}).to_list()
+
+async def list_sessions(after=None, limit=SESSION_PAGE_SIZE, sort="_id", descending=True):
+    # See serverHelper.list_sessions
+    _check_session_page(limit, sort)
+    collection = db["print_sessions"]
+    last = None
+    if after is not None:
+        last = _session_page_after(after, await collection.find_one({"_id": ObjectId(after)}, {"inserted_at": 1}))
+
+    cursor = await collection.aggregate(_session_page_pipeline(last, limit, sort, descending))
+    sessions = await cursor.to_list()
+    return _session_page(sessions, limit, await collection.estimated_document_count())
+
+async def get_session_file_ids(session_id):
+    session = await db["print_sessions"].find_one({"_id": ObjectId(session_id)}, {"raw_files.file_ids": 1})
+    if session is None:
+        return None
+    return session.get("raw_files", {}).get("file_ids", [])
+
+async def _embed_timeseries(session, ts_docs, with_data, as_arrays=False):
+    arrays = await read_timeseries_many(list(ts_docs.values())) if with_data else None
+    _attach_timeseries(session, ts_docs, arrays, as_arrays)
+
+async def get_session_with_embedded_info(session_id, summary=False, include=None, image_fields=None, as_arrays=False):
+    # See serverHelper.get_session_with_embedded_info
+    projections, with_data = _session_projections(summary, include, image_fields)
+    try:
+        cursor = await db["print_sessions"].aggregate(_session_pipeline([session_id], projections))
+        sessions = await cursor.to_list(1)
+    except OperationFailure as e:
+        if e.code not in DOCUMENT_TOO_LARGE_CODES:
+            raise
+        return await get_session_with_embedded_info_sequential(session_id, summary, include, image_fields, as_arrays)
+    if not sessions:
+        return None
+
+    session = sessions[0]
+    await _embed_timeseries(session, _shape_session(session), with_data, as_arrays)
+    return session
+
+async def get_sessions_with_embedded_info(session_ids: list, summary=False, include=None, image_fields=None, as_arrays=False):
+    # See serverHelper.get_sessions_with_embedded_info
+    projections, with_data = _session_projections(summary, include, image_fields)
+    try:
+        cursor = await db["print_sessions"].aggregate(_session_pipeline(session_ids, projections))
+        sessions = await cursor.to_list()
+    except OperationFailure as e:
+        if e.code not in DOCUMENT_TOO_LARGE_CODES:
+            raise
+        found = {ObjectId(s): await get_session_with_embedded_info(s, summary, include, image_fields, as_arrays) for s in session_ids}
+        return {oid: session for oid, session in found.items() if session is not None}
+
+    ts_docs = [_shape_session(session) for session in sessions]
+    arrays = await read_timeseries_many([ts for docs in ts_docs for ts in docs.values()]) if with_data else None
+    return _attach_sessions_timeseries(sessions, ts_docs, arrays, as_arrays)
+
+async def get_session_with_embedded_info_sequential(session_id, summary=False, include=None, image_fields=None, as_arrays=False):
+    # See serverHelper.get_session_with_embedded_info_sequential
+    projections, with_data = _session_projections(summary, include, image_fields)
+    session = await db["print_sessions"].find_one({"_id": ObjectId(session_id)})
+    if session is None:
+        return None
+
+    pj = await db["print_jobs"].find_one({"_id": session.get("print_job_id")}, projections.get("print_jobs"))
+    if pj:
+        ids_to_fetch = _print_job_ref_ids(pj)
+        docs = []
+        if ids_to_fetch:
+            docs = await db["printers"].find({"_id": {"$in": ids_to_fetch}}).to_list() + \
+                    await db["objects"].find({"_id": {"$in": ids_to_fetch}}, projections.get("objects")).to_list()
+        _attach_print_job(session, pj, docs)
+
+    collections = await db["image_collections"].find({"_id": {"$in": session.get("image_collections", [])}}).to_list()
+    img_ids = _collection_image_ids(collections)
+    imgs = None
+    if img_ids:
+        imgs = {img["_id"]: img async for img in db["images"].find({"_id": {"$in": img_ids}}, projections.get("images"))}
+    _attach_image_collections(session, collections, imgs)
+
+    ts_ids = list(session.get("timeseries", {}).values())
+    ts_docs = {ts["_id"]: ts async for ts in db["timeseries"].find({"_id": {"$in": ts_ids}}, projections.get("timeseries"))}
+    await _embed_timeseries(session, ts_docs, with_data, as_arrays)
+    return session
+
+
+###### RAW FILES #######
+
+async def get_gcode_layer(file_id, layer: int):
+    # Seeks into the GridFS file, so only the chunks that hold this layer are read
+    f = await fs.find_one({"_id": ObjectId(file_id)})
+    if f is None:
+        return None
+
+    layer_index = (f.metadata or {}).get("layer_index") or []
+    if not 0 <= layer < len(layer_index):
+        return None
+
+    start, end = layer_index[layer]
+    await f.seek(start)
+    return await f.read(end - start)
+
+
+####### PRINT JOBS #######
+
+async def get_layer_statistics(print_job_id):
+    pj = await db["print_jobs"].find_one({"_id": ObjectId(print_job_id)}, {"metadata.layer_statistics": 1})
+    if pj is None:
+        return None
+    return pj.get("metadata", {}).get("layer_statistics", [])
+
+
+##### TIMESERIES #####
+
+async def read_timeseries_many(ts_docs: list):
+    # {timeseries _id: np.ndarray}, fetching the buckets of all documents in one query
+    query = _timeseries_buckets_query(ts_docs)
+    buckets = [] if query is None else await db["timeseries_buckets"].find(**query).to_list()
+    return _timeseries_arrays(ts_docs, buckets)
+
+async def read_timeseries(ts_doc):
+    return (await read_timeseries_many([ts_doc]))[ts_doc["_id"]]
+
+async def get_timeseries(timeseries_id):
+    ts = await db["timeseries"].find_one({"_id": ObjectId(timeseries_id)})
+    if ts is None:
+        return None
+    return await read_timeseries(ts)
+
+async def read_timeseries_range(timeseries_id, start=None, stop=None, resolution=None, unit="sample"):
+    # See serverHelper.read_timeseries_range
+    ts = await db["timeseries"].find_one({"_id": ObjectId(timeseries_id)}, {"data": 0})
+    if ts is None:
+        return None
+    if "encoding" not in ts:
+        ts = await db["timeseries"].find_one({"_id": ts["_id"]})
+
+    plan = _range_plan(ts, start, stop, resolution, unit)
+    query = _range_query(ts, plan)
+    buckets = [] if query is None else await db[query[0]].find(**query[1]).to_list()
+    return _range_from_buckets(ts, plan, buckets)
+
+async def get_toolpath(print_job_id):
+    pj = await db["print_jobs"].find_one({"_id": ObjectId(print_job_id)}, {"toolpath": 1})
+    if pj is None:
+        return None
+
+    ts_map = pj.get("toolpath", {})
+    arrays = await read_timeseries_many(await db["timeseries"].find({"_id": {"$in": list(ts_map.values())}}).to_list())
+    return {
+        name: arrays[ts_id] for name, ts_id in ts_map.items() if ts_id in arrays
+    }
+
+
+####### IMAGE_COLLECTIONS #######
+
+async def find_similar_images_by_hash(phash: str, max_distance=PHASH_MAX_DISTANCE):
+    query = _phash_candidates_query(phash, max_distance)
+    return _phash_matches(phash, max_distance, await db["images"].find(**query).to_list())
+
+async def find_similar_images(image_id, max_distance=PHASH_MAX_DISTANCE):
+    img = await db["images"].find_one({"_id": ObjectId(image_id)}, {"phash": 1})
+    if img is None or "phash" not in img:
+        return None
+    return [(img_id, d) for img_id, d in await find_similar_images_by_hash(img["phash"], max_distance) if img_id != img["_id"]]
+
+async def get_image_collection_image_ids(image_collection_ids: list):
+    colls = {c["_id"]: c["image_file_ids"] async for c in db["image_collections"].find({"_id": {"$in": list(image_collection_ids)}}, {"image_file_ids": 1})}
+    return [img_id for coll_id in image_collection_ids for img_id in colls.get(coll_id, [])]
+
+async def get_image_preview(image_id, size=PREVIEW_SIZES[0]):
+    # See serverHelper.get_image_preview
+    img = await db["images"].find_one({"_id": ObjectId(image_id)}, {"file_id": 1, "previews": 1})
+    if img is None:
+        return None
+
+    file_id, media_type = _preview_file(img, size)
+    return await (await fs.get(file_id)).read(), media_type
@@ -1,34 +1,165 @@
-import io
 import mimetypes
 import os
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta, timezone
 import uuid
 import zipfile
-from bson import ObjectId
-from pymongo import MongoClient
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import combinations
+from bson import Binary, ObjectId
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import gridfs
 import hashlib, json
 import numpy as np
 from scripts.classes.dataclass import DataClass
-from scripts.imageprocessing import convert_to_png, extract_image_data
+from scripts.imageprocessing import PNG_COMPRESS_LEVEL, PNG_OPTIMIZE, PREVIEW_MIME, PREVIEW_SIZES, file_perceptual_hash, prepare_image
 
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME = "official_db"
+# Server error codes when a resolved document exceeds 16 MB: BSONObjectTooLarge, and the
+# one $lookup raises when the joined documents of one input don't fit
+DOCUMENT_TOO_LARGE_CODES = (10334, 4568)
 
 client = MongoClient(MONGODB_URI)
 db = client[DB_NAME]
 fs = gridfs.GridFS(db)
+staging_fs = gridfs.GridFS(db, collection="staging")  # uploads waiting for an ingest worker, see INGESTION QUEUE
+
+###### INDEXES #######
+
+SAMPLE_HASH = "0" * 64
+
+# (collection, keys, options). Unique where dedup relies on the field; partial filters keep
+# documents without a real hash (e.g. objects created without files, hash_id 0) out of it.
+INDEXES = [
+    ("fs.files", [("metadata.hash_id", 1)], {"unique": True, "partialFilterExpression": {"metadata.hash_id": {"$exists": True}}}),
+    ("fs.chunks", [("files_id", 1), ("n", 1)], {"unique": True}),  # GridFS's own; chunked uploads write fs.chunks directly
+    ("images", [("hash_id", 1)], {"unique": True}),
+    ("images", [("source_hash_ids", 1)], {}),
+    ("images", [("phash_bands", 1)], {}),
+    ("objects", [("hash_id", 1)], {"unique": True, "partialFilterExpression": {"hash_id": {"$gt": ""}}}),
+    ("printers", [("printer_id", 1)], {"unique": True}),
+    ("dictionaries", [("printer", 1), ("slicer", 1)], {"unique": True}),
+    ("print_jobs", [("printer_id", 1), ("object_id", 1), ("artifacts.hash_id", 1)], {}),
+    ("print_jobs", [("printer_id", 1), ("object_id", 1), ("artifacts.content_hash", 1)], {}),
+    ("timeseries_buckets", [("timeseries_id", 1), ("i", 1)], {"unique": True}),
+    ("timeseries_pyramid", [("timeseries_id", 1), ("level", 1), ("i", 1)], {"unique": True}),
+    ("print_sessions", [("inserted_at", -1), ("_id", -1)], {}),
+    *[(coll_name, [("status", 1), ("inserted_at", 1)], {"partialFilterExpression": {"staged": {"$exists": True}}})
+      for coll_name in ["print_sessions", "objects", "print_jobs", "image_collections"]],
+]
+
+# Lookups that run on every ingest; verify_query_plans() checks none of them scans a collection
+HOT_QUERIES = [
+    ("put_files", "fs.files", {"metadata.hash_id": {"$in": [SAMPLE_HASH]}}),
+    ("find_existing_images", "images", {"$or": [{"hash_id": {"$in": [SAMPLE_HASH]}}, {"source_hash_ids": {"$in": [SAMPLE_HASH]}}]}),
+    ("check_existing_image", "images", {"hash_id": SAMPLE_HASH}),
+    ("find_similar_images", "images", {"phash_bands": {"$in": [0, 65536]}}),
+    ("create_object", "objects", {"hash_id": SAMPLE_HASH}),
+    ("create_printer", "printers", {"printer_id": ""}),
+    ("get_dictionary", "dictionaries", {"printer": "", "slicer": ""}),
+    ("check_print_job_exists", "print_jobs", {"printer_id": None, "object_id": None, "$or": [{"artifacts.hash_id": SAMPLE_HASH}, {"artifacts.content_hash": SAMPLE_HASH}]}),
+    ("read_timeseries_many", "timeseries_buckets", {"timeseries_id": {"$in": [ObjectId("0" * 24)]}}),
+    ("read_timeseries_range", "timeseries_pyramid", {"timeseries_id": ObjectId("0" * 24), "level": 1, "i": {"$gte": 0, "$lte": 1}}),
+    ("claim_ingest_job", "print_jobs", {"staged": {"$exists": True}, "$or": [{"status": "queued"}, {"status": "ingesting", "ingest.heartbeat_at": {"$lt": datetime(2000, 1, 1)}}]}),
+    ("write_upload_chunk", "fs.chunks", {"files_id": ObjectId("0" * 24), "n": 0}),
+    ("list_sessions", "print_sessions", {"$or": [{"inserted_at": {"$lt": datetime(2000, 1, 1)}}, {"inserted_at": datetime(2000, 1, 1), "_id": {"$lt": ObjectId("0" * 24)}}]}),
+]
+
+_indexes_ready = False
+
+def _duplicate_keys(coll_name, keys, options, limit=5):
+    # A few of the key values a unique index can't be built over: [{"key": {...}, "ids": [...]}]
+    fields = [k for k, _ in keys]
+    pipeline = [
+        {"$match": options.get("partialFilterExpression", {})},
+        {"$group": {"_id": {f.replace(".", "_"): f"${f}" for f in fields}, "n": {"$sum": 1}, "ids": {"$push": "$_id"}}},
+        {"$match": {"n": {"$gt": 1}}},
+        {"$limit": limit},
+    ]
+    return [{"key": d["_id"], "ids": d["ids"]} for d in db[coll_name].aggregate(pipeline)]
+
+def ensure_indexes(force=False):
+    # Idempotent (create_index is a no-op for an existing index); runs once per process.
+    # An index that can't be built (e.g. a unique one over documents written before it existed)
+    # is reported instead of stopping the app; the queries using it just don't get the index.
+    # Returns {(collection, keys): error} of those.
+    global _indexes_ready
+    if _indexes_ready and not force:
+        return {}
+    failed = {}
+    for coll_name, keys, options in INDEXES:
+        try:
+            db[coll_name].create_index(keys, **options)
+        except OperationFailure as e:
+            error = str(e)
+            if e.code == 11000:
+                error = f"duplicate keys, e.g. {_duplicate_keys(coll_name, keys, options)}"
+            failed[(coll_name, tuple(k for k, _ in keys))] = error
+            print(f"Index on {coll_name} {keys} not created ({error}). Remove the duplicates and run scripts/check_query_plans.py.")
+    _indexes_ready = True
+    return failed
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        stages = [plan["stage"]] if "stage" in plan else []
+        for v in plan.values():
+            stages += _plan_stages(v)
+        return stages
+    if isinstance(plan, list):
+        return [stage for p in plan for stage in _plan_stages(p)]
+    return []
+
+def verify_query_plans():
+    plans = {}
+    for name, coll_name, query in HOT_QUERIES:
+        explain = db[coll_name].find(query).explain()
+        plans[name] = _plan_stages(explain["queryPlanner"]["winningPlan"])
+
+    scans = {name: stages for name, stages in plans.items() if "COLLSCAN" in stages}
+    if scans:
+        raise RuntimeError(f"Queries falling back to COLLSCAN: {scans}")
+    return plans
 
 def put_file(data: DataClass, metadata={}):
-    existing = fs.find_one({"metadata.hash_id": data.hash_id})
-    if existing:
-        return existing._id
-
-    return fs.put(
-        data.bytes,
-        filename=data.name,
-        metadata={**metadata, "hash_id": data.hash_id}
-    )
+    return put_files([data], metadata)[0]
+
+def put_files(datas: list[DataClass], metadata: dict | list[dict] = {}):
+    # One $in query resolves every hash already stored; only missing blobs are uploaded.
+    # metadata is shared by all files, or given per file as a list. Ids come back in input order.
+    metadatas = metadata if isinstance(metadata, list) else [metadata] * len(datas)
+
+    hashes = list({data.hash_id for data in datas})
+    known = {
+        f["metadata"]["hash_id"]: f["_id"]
+        for f in db["fs.files"].find({"metadata.hash_id": {"$in": hashes}}, {"metadata.hash_id": 1})
+    }
+
+    file_ids = []
+    for data, md in zip(datas, metadatas):
+        if data.hash_id not in known:
+            file_id = ObjectId()
+            try:
+                with data.open() as f:
+                    known[data.hash_id] = fs.put(
+                        f,
+                        _id=file_id,
+                        filename=data.name,
+                        metadata={**md, "hash_id": data.hash_id}
+                    )
+            except gridfs.errors.FileExists:
+                # The unique metadata.hash_id index refused the files document (GridFS reports it as
+                # FileExists): another writer stored it meanwhile. Our chunks are already written.
+                db["fs.chunks"].delete_many({"files_id": file_id})
+                existing = db["fs.files"].find_one({"metadata.hash_id": data.hash_id}, {"_id": 1})
+                if existing is None:
+                    raise
+                known[data.hash_id] = existing["_id"]
+        file_ids.append(known[data.hash_id])
+    return file_ids
 
 # Create functions:
 # collection = db[]
@@ -48,7 +179,7 @@ def create_session(file_datas: list[DataClass], metadata={}, print_job_id=None,
         "image_collections": image_collections_ids,
     }).inserted_id
 
-    file_ids = [put_file(data, metadata={"session_id": session_id}) for data in file_datas]
+    file_ids = put_files(file_datas, metadata={"session_id": session_id})
 
     collection.update_one(
         {"_id": session_id},
@@ -62,61 +193,303 @@ def get_all_sessions():
     sessions = list(collection.find({}))
     return sessions
 
-def get_session_with_embedded_info(session_id):
+# Session listing: keyset pages (newest first by default) of small summary documents
+SESSION_PAGE_SIZE = 50
+SESSION_MAX_PAGE_SIZE = 500
+SESSION_SORT_FIELDS = ("_id", "inserted_at")
+SESSION_SUMMARY_PROJECTION = {
+    "inserted_at": 1,
+    "status": 1,
+    "print_job_id": 1,
+    "image_collections": 1,
+    "timeseries": 1,
+    "ingest": 1,
+    "n_files": {"$size": {"$ifNull": ["$raw_files.file_ids", []]}},
+}
+
+def _session_page_pipeline(after, limit, sort, descending):
+    # after is the (_id, inserted_at) of the last session of the previous page, or None.
+    # inserted_at ties are broken by _id, so the order is total and no session is skipped.
+    direction = -1 if descending else 1
+    beyond = "$lt" if descending else "$gt"
+    if after is None:
+        match = {}
+    elif sort == "_id":
+        match = {"_id": {beyond: after[0]}}
+    else:
+        match = {"$or": [{"inserted_at": {beyond: after[1]}}, {"inserted_at": after[1], "_id": {beyond: after[0]}}]}
+    order = {"_id": direction} if sort == "_id" else {"inserted_at": direction, "_id": direction}
+    # One more than asked for, to tell whether there is a next page
+    return [{"$match": match}, {"$sort": order}, {"$limit": limit + 1}, {"$project": SESSION_SUMMARY_PROJECTION}]
+
+def _check_session_page(limit, sort):
+    if sort not in SESSION_SORT_FIELDS:
+        raise ValueError(f"sort must be one of {SESSION_SORT_FIELDS}.")
+    if not 1 <= limit <= SESSION_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {SESSION_MAX_PAGE_SIZE}.")
+
+def _session_page_after(after, last):
+    # (_id, inserted_at) for _session_page_pipeline from the session document of `after`
+    if last is None:
+        raise ValueError(f"Session {after} not found.")
+    return last["_id"], last.get("inserted_at")
+
+def _session_page(sessions, limit, total):
+    # sessions: the output of _session_page_pipeline, one more than the page if there is a next one
+    return {
+        "sessions": sessions[:limit],
+        "next": sessions[limit - 1]["_id"] if len(sessions) > limit else None,
+        "total": total,
+    }
+
+def list_sessions(after=None, limit=SESSION_PAGE_SIZE, sort="_id", descending=True):
+    # One page of session summaries (SESSION_SUMMARY_PROJECTION) after the session id `after`:
+    # {"sessions": [...], "next": id to pass as after for the next page or None, "total": n}.
+    # Pages are read through the _id / (inserted_at, _id) indexes, so every page costs the same.
+    _check_session_page(limit, sort)
     collection = db["print_sessions"]
+    last = None
+    if after is not None:
+        last = _session_page_after(after, collection.find_one({"_id": ObjectId(after)}, {"inserted_at": 1}))
+
+    sessions = list(collection.aggregate(_session_page_pipeline(last, limit, sort, descending)))
+    # total from collection metadata, without counting documents
+    return _session_page(sessions, limit, collection.estimated_document_count())
+
+def get_session_file_ids(session_id):
+    # GridFS ids of the raw files uploaded with a session, None if the session doesn't exist
+    session = db["print_sessions"].find_one({"_id": ObjectId(session_id)}, {"raw_files.file_ids": 1})
+    if session is None:
+        return None
+    return session.get("raw_files", {}).get("file_ids", [])
+
+# Fields left out of summary fetches unless named in include=, by part of the resolved session
+SESSION_HEAVY_FIELDS = {
+    "print_job": ["metadata"],  # full slicer config
+    "object": ["extracted_data"],
+    "images": ["metadata"],  # EXIF and image header data
+    "timeseries": ["data"],
+}
+SESSION_PART_COLLECTIONS = {"print_job": "print_jobs", "object": "objects", "images": "images", "timeseries": "timeseries"}
+
+def _session_projections(summary=False, include=None, image_fields=None):
+    # Mongo projection per referenced collection (None = whole document) and whether timeseries data is wanted.
+    # summary=True, or any include=, drops SESSION_HEAVY_FIELDS except the "part.field" names in include;
+    # image_fields lists the image document fields to keep (e.g. ["name", "metadata.width"]).
+    include = set(include or [])
+    unknown = include - {f"{part}.{field}" for part, fields in SESSION_HEAVY_FIELDS.items() for field in fields}
+    if unknown:
+        raise ValueError(f"Unknown include fields: {sorted(unknown)}")
+
+    projections = {}
+    if summary or include:
+        for part, fields in SESSION_HEAVY_FIELDS.items():
+            excluded = {field: 0 for field in fields if f"{part}.{field}" not in include}
+            if excluded:
+                projections[SESSION_PART_COLLECTIONS[part]] = excluded
+    if image_fields:
+        projections["images"] = {field: 1 for field in image_fields}
+    with_data = "timeseries" not in projections
+    return projections, with_data
+
+def _session_pipeline(session_ids: list, projections={}):
+    # Resolves sessions and everything they reference in one aggregation. Projections run
+    # inside the $lookup sub-pipelines (MongoDB 5.0+), so excluded fields never leave the server.
+    def lookup(coll_name, local_field, as_field):
+        stage = {"from": coll_name, "localField": local_field, "foreignField": "_id", "as": as_field}
+        if coll_name in projections:
+            stage["pipeline"] = [{"$project": projections[coll_name]}]
+        return {"$lookup": stage}
+
+    return [
+        {"$match": {"_id": {"$in": [ObjectId(s) for s in session_ids]}}},
+        lookup("print_jobs", "print_job_id", "print_job_info"),
+        lookup("printers", "print_job_info.printer_id", "printer_info"),
+        lookup("objects", "print_job_info.object_id", "object_info"),
+        lookup("image_collections", "image_collections", "image_collections_info"),
+        # localField expands arrays at every step of the path, so this matches the images of all collections
+        lookup("images", "image_collections_info.image_file_ids", "_images"),
+        {"$set": {"_timeseries_ids": {"$map": {"input": {"$objectToArray": {"$ifNull": ["$timeseries", {}]}}, "in": "$$this.v"}}}},
+        lookup("timeseries", "_timeseries_ids", "_timeseries"),
+        {"$project": {"_timeseries_ids": 0}},
+    ]
+
+def _attach_timeseries(session, ts_docs, arrays=None, as_arrays=False):
+    # arrays: {timeseries _id: np.ndarray} from read_timeseries_many, None to leave the data out
+    if arrays is not None:
+        for ts_id, ts in ts_docs.items():
+            ts["data"] = arrays[ts_id] if as_arrays else arrays[ts_id].tolist()
+    session["timeseries_info"] = {
+        name: ts_docs[ts_id] for name, ts_id in session.get("timeseries", {}).items() if ts_id in ts_docs
+    }
+
+def _embed_timeseries(session, ts_docs, with_data, as_arrays=False):
+    arrays = read_timeseries_many(list(ts_docs.values())) if with_data else None
+    _attach_timeseries(session, ts_docs, arrays, as_arrays)
+
+def _attach_sessions_timeseries(sessions, ts_docs, arrays, as_arrays=False):
+    # The get_sessions_with_embedded_info result from the shaped sessions and their timeseries documents
+    for session, docs in zip(sessions, ts_docs):
+        _attach_timeseries(session, docs, arrays, as_arrays)
+    return {session["_id"]: session for session in sessions}
+
+def _shape_session(session):
+    # Turns the output of _session_pipeline into the shape of get_session_with_embedded_info_sequential:
+    # single references become plain fields and are left out when missing. Returns the timeseries
+    # documents by _id, still to be embedded.
+    for field in ["print_job_info", "printer_info", "object_info"]:
+        docs = session.pop(field)
+        if docs and (field == "print_job_info" or "print_job_info" in session):
+            session[field] = docs[0]
+
+    imgs = {img["_id"]: img for img in session.pop("_images")}
+    if any(coll.get("image_file_ids") for coll in session["image_collections_info"]):
+        for coll in session["image_collections_info"]:
+            coll["images_info"] = [imgs[i] for i in coll.get("image_file_ids", []) if i in imgs]
+    return {ts["_id"]: ts for ts in session.pop("_timeseries")}
+
+def get_session_with_embedded_info(session_id, summary=False, include=None, image_fields=None, as_arrays=False):
+    # One aggregation for the session and its references (plus one query for timeseries buckets).
+    # Falls back to one query per collection if the resolved document exceeds the 16 MB limit.
+    # summary / include / image_fields select fields, see _session_projections. as_arrays=True
+    # leaves timeseries data as NumPy arrays instead of lists (for api/restapi/bson_json.py).
+    projections, with_data = _session_projections(summary, include, image_fields)
+    try:
+        session = next(db["print_sessions"].aggregate(_session_pipeline([session_id], projections)), None)
+    except OperationFailure as e:
+        if e.code not in DOCUMENT_TOO_LARGE_CODES:
+            raise
+        return get_session_with_embedded_info_sequential(session_id, summary, include, image_fields, as_arrays)
+    if session is None:
+        return None
+
+    _embed_timeseries(session, _shape_session(session), with_data, as_arrays)
+    return session
+
+def get_sessions_with_embedded_info(session_ids: list, summary=False, include=None, image_fields=None, as_arrays=False):
+    # {session _id: session} for many sessions at once: one aggregation for all of them plus one
+    # query for the buckets of all their timeseries. Ids that don't exist are left out. Falls back
+    # to get_session_with_embedded_info per id if a resolved session exceeds the 16 MB limit.
+    projections, with_data = _session_projections(summary, include, image_fields)
+    try:
+        sessions = list(db["print_sessions"].aggregate(_session_pipeline(session_ids, projections)))
+    except OperationFailure as e:
+        if e.code not in DOCUMENT_TOO_LARGE_CODES:
+            raise
+        found = {ObjectId(s): get_session_with_embedded_info(s, summary, include, image_fields, as_arrays) for s in session_ids}
+        return {oid: session for oid, session in found.items() if session is not None}
+
+    ts_docs = [_shape_session(session) for session in sessions]
+    arrays = read_timeseries_many([ts for docs in ts_docs for ts in docs.values()]) if with_data else None
+    return _attach_sessions_timeseries(sessions, ts_docs, arrays, as_arrays)
+
+# Steps of get_session_with_embedded_info_sequential between its queries, shared with asyncServerHelper
+
+def _print_job_ref_ids(pj):
+    return [pid for pid in [pj.get("printer_id"), pj.get("object_id")] if pid]
+
+def _attach_print_job(session, pj, docs):
+    # docs: the printer and object documents of _print_job_ref_ids(pj)
+    session["print_job_info"] = pj
+    for doc in docs:
+        if doc["_id"] == pj.get("printer_id"):
+            session["printer_info"] = doc
+        elif doc["_id"] == pj.get("object_id"):
+            session["object_info"] = doc
+
+def _collection_image_ids(collections):
+    return [img_id for coll in collections for img_id in coll.get("image_file_ids", [])]
+
+def _attach_image_collections(session, collections, imgs=None):
+    # imgs: {image _id: image document}, None if the collections hold no images
+    if imgs is not None:
+        for coll in collections:
+            coll["images_info"] = [imgs[i] for i in coll.get("image_file_ids", []) if i in imgs]
+    session["image_collections_info"] = collections
+
+def get_session_with_embedded_info_sequential(session_id, summary=False, include=None, image_fields=None, as_arrays=False):
+    # One query per referenced collection; kept as the fallback and as the benchmark baseline
+    projections, with_data = _session_projections(summary, include, image_fields)
     session = db["print_sessions"].find_one({"_id": ObjectId(session_id)})
     if session is None:
         return None
 
     # get print_job info
     pj_id = session.get("print_job_id")
-    pj = db["print_jobs"].find_one({"_id": pj_id})
+    pj = db["print_jobs"].find_one({"_id": pj_id}, projections.get("print_jobs"))
     if pj:
-        session["print_job_info"] = pj
-
-        ids_to_fetch = [pid for pid in [pj.get("printer_id"), pj.get("object_id")] if pid]
+        ids_to_fetch = _print_job_ref_ids(pj)
+        docs = []
         if ids_to_fetch:
             docs = list(db["printers"].find({"_id": {"$in": ids_to_fetch}})) + \
-                    list(db["objects"].find({"_id": {"$in": ids_to_fetch}}))
-            for doc in docs:
-                if doc["_id"] == pj.get("printer_id"):
-                    session["printer_info"] = doc
-                elif doc["_id"] == pj.get("object_id"):
-                    session["object_info"] = doc
+                    list(db["objects"].find({"_id": {"$in": ids_to_fetch}}, projections.get("objects")))
+        _attach_print_job(session, pj, docs)
 
     # get image_collections info
     coll_ids = session.get("image_collections", [])
     collections = list(db["image_collections"].find({"_id": {"$in": coll_ids}}))
-    img_ids = [img_id for coll in collections for img_id in coll.get("image_file_ids", [])]
+    img_ids = _collection_image_ids(collections)
+    imgs = None
     if img_ids:
-        imgs = {img["_id"]: img for img in db["images"].find({"_id": {"$in": img_ids}})}
-        for coll in collections:
-            coll["images_info"] = [imgs[i] for i in coll.get("image_file_ids", []) if i in imgs]
-    session["image_collections_info"] = collections
+        imgs = {img["_id"]: img for img in db["images"].find({"_id": {"$in": img_ids}}, projections.get("images"))}
+    _attach_image_collections(session, collections, imgs)
 
     # get timeseries info
-    ts_map = session.get("timeseries", {})
-    ts_ids = list(ts_map.values())
-    ts_docs = {ts["_id"]: ts for ts in db["timeseries"].find({"_id": {"$in": ts_ids}})}
-    session["timeseries_info"] = {
-        name: ts_docs[ts_id] for name, ts_id in ts_map.items() if ts_id in ts_docs
-    }
+    ts_ids = list(session.get("timeseries", {}).values())
+    ts_docs = {ts["_id"]: ts for ts in db["timeseries"].find({"_id": {"$in": ts_ids}}, projections.get("timeseries"))}
+    _embed_timeseries(session, ts_docs, with_data, as_arrays)
 
     return session
 
 ###### RAW FILES #######
 
 
-def download_files_zip(file_ids: list):
-    b = io.BytesIO()
-    with zipfile.ZipFile(b, "w", zipfile.ZIP_DEFLATED) as z:
+# Already compressed formats go into ZIPs stored as they are; deflating them again costs CPU for nothing
+ZIP_STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".3mf", ".zip", ".gz"}
+
+class _ZipStream:
+    # Unseekable write target for a ZipFile: written bytes are handed back by drain() instead of kept
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def iter_files_zip(file_ids: list):
+    # ZIP of GridFS files built on the fly: yields the archive piece by piece as each GridFS chunk
+    # is read and compressed, so neither the files nor the archive are ever held in memory.
+    # Entries carry data descriptors (sizes and CRC after the data), as the output can't be seeked.
+    # Files that no longer exist are left out.
+    out = _ZipStream()
+    with zipfile.ZipFile(out, "w") as z:
         for s in file_ids:
             oid = ObjectId(s)
-            f = fs.get(oid)
+            f = fs.find_one({"_id": oid})
+            if f is None:
+                continue
             name = f.filename or str(oid)
-            z.writestr(name, f.read())
-    b.seek(0)
-    return b.getvalue()
+            info = zipfile.ZipInfo(name, date_time=(f.upload_date or datetime.now()).timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED if os.path.splitext(name)[1].lower() in ZIP_STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            info.file_size = f.length  # lets zipfile pick ZIP64 for files over 2 GB
+            with z.open(info, "w") as entry:
+                while chunk := f.readchunk():
+                    entry.write(chunk)
+                    data = out.drain()
+                    if data:
+                        yield data
+    yield out.drain()
+
+def download_files_zip(file_ids: list):
+    return b"".join(iter_files_zip(file_ids))
 
 def download_file_as_dataclass(file_id):
     oid = ObjectId(file_id)
@@ -124,6 +497,248 @@ def download_file_as_dataclass(file_id):
 
     return DataClass(data=f.read(), mime_type=mimetypes.guess_type(f.filename or str(oid))[0] or "application/octet-stream", name=f.filename or str(oid))
 
+def set_gcode_layer_index(file_id, layer_index: list):
+    # [start, end) byte offsets per layer (scripts.toolpath.layer_byte_index), kept next to the blob
+    db["fs.files"].update_one(
+        {"_id": ObjectId(file_id)},
+        {"$set": {"metadata.layer_index": layer_index}}
+    )
+
+def get_gcode_layer(file_id, layer: int):
+    # Seeks into the GridFS file, so only the chunks that hold this layer are read
+    f = fs.find_one({"_id": ObjectId(file_id)})
+    if f is None:
+        return None
+
+    layer_index = (f.metadata or {}).get("layer_index") or []
+    if not 0 <= layer < len(layer_index):
+        return None
+
+    start, end = layer_index[layer]
+    f.seek(start)
+    return f.read(end - start)
+
+# Chunked uploads (the /uploads endpoints of api/restapi/server_restapi.py). The file is sent in
+# UPLOAD_CHUNK_SIZE pieces, in any order and several at once, and each piece is written as the
+# fs.chunks document of the same number, so nothing is buffered whole. The fs.files document is only
+# inserted by finish_upload, which makes the file visible and dedups it by hash like put_files.
+# Resuming is sending the chunks get_upload still lists as missing.
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_HASH_MEMORY = 128 * 1024 * 1024  # bytes of chunks kept ahead of the hashes, for all uploads of a process together
+UPLOAD_HASH_STATES = 8  # uploads hashed in memory at once per process; the least recently used is dropped beyond that
+UPLOAD_EXPIRY = timedelta(days=2)  # unfinished uploads untouched this long are removed by delete_stale_uploads
+UPLOAD_FINISH_LEASE = timedelta(minutes=10)  # a finish_upload that hasn't completed in this long (crashed) can be redone
+
+class _UploadHash:
+    # sha256 of an upload fed with chunks in whatever order they arrive: chunks ahead of the hash
+    # wait in memory up to its share of UPLOAD_HASH_MEMORY, the others are read back from GridFS
+    # (once each) when the hash gets to them
+    def __init__(self, upload_id):
+        self.upload_id = upload_id
+        self.lock = threading.Lock()
+        self.sha = hashlib.sha256()
+        self.hashed = 0  # chunks 0..hashed-1 are in sha
+        self.ahead = {}
+        self.ahead_bytes = 0
+        self.spilled = -1  # highest chunk number not kept in memory
+
+    def feed(self, n, data):
+        with self.lock:
+            if n < self.hashed:
+                return
+            if n == self.hashed:
+                self._update(data)
+            elif self.ahead_bytes + len(data) <= UPLOAD_HASH_MEMORY // UPLOAD_HASH_STATES:
+                self.ahead[n] = data
+                self.ahead_bytes += len(data)
+            else:
+                self.spilled = max(self.spilled, n)
+            self._advance()
+
+    def _advance(self):
+        # Hashes on from self.hashed until the next chunk that hasn't arrived. Chunks not kept in memory
+        # are read back with one indexed lookup each, so a missing chunk costs a miss and not a scan.
+        while True:
+            if self.hashed in self.ahead:
+                data = self.ahead.pop(self.hashed)
+                self.ahead_bytes -= len(data)
+            elif self.hashed <= self.spilled:
+                c = db["fs.chunks"].find_one({"files_id": self.upload_id, "n": self.hashed}, {"data": 1})
+                if c is None:
+                    return
+                data = c["data"]
+            else:
+                return
+            self._update(data)
+
+    def _update(self, data):
+        self.sha.update(data)
+        self.hashed += 1
+
+    def hexdigest(self):
+        # Once every chunk is stored
+        with self.lock:
+            self.spilled = float("inf")
+            self._advance()
+            return self.sha.hexdigest()
+
+# upload id -> _UploadHash, least recently used first. Per process: an upload whose chunks went to
+# another server process, that outlived a restart or whose state was dropped is hashed from GridFS
+# where this one left off when it is finished.
+_upload_hashes = {}
+_upload_hashes_lock = threading.Lock()
+
+def start_upload(filename, length: int, metadata={}, chunk_size=UPLOAD_CHUNK_SIZE):
+    if length < 0:
+        raise ValueError("Upload length must not be negative.")
+    now = datetime.now()
+    upload_id = db["uploads"].insert_one({
+        "filename": filename,
+        "length": length,
+        "chunk_size": chunk_size,
+        "n_chunks": -(-length // chunk_size),
+        "metadata": metadata,
+        "status": "uploading",
+        "created_at": now,
+        "updated_at": now,
+    }).inserted_id
+    return get_upload(upload_id)
+
+def get_upload(upload_id):
+    # The upload with the chunk numbers still missing, None if it doesn't exist
+    upload = db["uploads"].find_one({"_id": ObjectId(upload_id)})
+    if upload is None:
+        return None
+    missing = []
+    if upload["status"] == "uploading":
+        received = {c["n"] for c in db["fs.chunks"].find({"files_id": upload["_id"]}, {"n": 1, "_id": 0})}
+        missing = [n for n in range(upload["n_chunks"]) if n not in received]
+    upload["missing"] = missing
+    return upload
+
+def _upload_hash(upload_id, pop=False):
+    with _upload_hashes_lock:
+        state = _upload_hashes.pop(upload_id, None) or _UploadHash(upload_id)
+        if not pop:
+            _upload_hashes[upload_id] = state
+            # Bounds the memory of uploads finished or aborted by another process, or abandoned
+            while len(_upload_hashes) > UPLOAD_HASH_STATES:
+                _upload_hashes.pop(next(iter(_upload_hashes)))
+        return state
+
+def write_upload_chunk(upload_id, n: int, data: bytes):
+    # Stores chunk n. Sending a chunk again (a retry after a dropped connection) is a no-op.
+    upload = db["uploads"].find_one({"_id": ObjectId(upload_id)})
+    if upload is None:
+        return None
+    if upload["status"] != "uploading":
+        raise ValueError(f"Upload {upload_id} is already finished.")
+    if not 0 <= n < upload["n_chunks"]:
+        raise ValueError(f"Chunk {n} out of range: the upload has {upload['n_chunks']} chunks.")
+    expected = min(upload["chunk_size"], upload["length"] - n * upload["chunk_size"])
+    if len(data) != expected:
+        raise ValueError(f"Chunk {n} must be {expected} bytes, got {len(data)}.")
+
+    try:
+        result = db["fs.chunks"].update_one(
+            {"files_id": upload["_id"], "n": n},
+            {"$setOnInsert": {"data": Binary(data)}},
+            upsert=True,
+        )
+        stored = result.upserted_id is not None
+    except DuplicateKeyError:
+        stored = False  # the same chunk arriving twice at once
+    if stored:
+        _upload_hash(upload["_id"]).feed(n, data)
+    db["uploads"].update_one({"_id": upload["_id"]}, {"$set": {"updated_at": datetime.now()}})
+    return n
+
+def finish_upload(upload_id):
+    # Makes the uploaded file a GridFS file and returns the upload with its "file_id". If a file with
+    # the same hash is already stored, the chunks are dropped and file_id is that file (as put_files).
+    # Finishing again returns the same result, so a lost response can simply be retried.
+    upload = get_upload(upload_id)
+    if upload is None:
+        return None
+    if upload["status"] == "done":
+        return upload
+    if upload["missing"]:
+        raise ValueError(f"Upload {upload_id} is missing {len(upload['missing'])} chunks, e.g. {upload['missing'][:10]}.")
+
+    # Only one call finishes an upload; it stops taking chunks from here on
+    upload_id = upload["_id"]
+    now = datetime.now()
+    claimed = db["uploads"].find_one_and_update(
+        {"_id": upload_id, "$or": [
+            {"status": "uploading"},
+            {"status": "finishing", "updated_at": {"$lt": now - UPLOAD_FINISH_LEASE}},
+        ]},
+        {"$set": {"status": "finishing", "updated_at": now}},
+    )
+    if claimed is None:
+        upload = get_upload(upload_id)
+        if upload is None or upload["status"] == "done":
+            return upload
+        raise ValueError(f"Upload {upload_id} is being finished by another request.")
+
+    # Each step is saved before the next one, so a finish that crashed is redone from where it stopped:
+    # the hash before any chunk is dropped (it can't be recomputed afterwards), the file before the
+    # duplicate's chunks are dropped
+    hash_id, file_id = claimed.get("hash_id"), claimed.get("file_id")
+    state = _upload_hash(upload_id, pop=True)
+    if hash_id is None:
+        hash_id = state.hexdigest()
+        db["uploads"].update_one({"_id": upload_id}, {"$set": {"hash_id": hash_id}})
+
+    if file_id is None:
+        existing = db["fs.files"].find_one({"metadata.hash_id": hash_id}, {"_id": 1})
+        if existing is None:
+            try:
+                db["fs.files"].insert_one({
+                    "_id": upload_id,
+                    "filename": upload["filename"],
+                    "length": upload["length"],
+                    "chunkSize": upload["chunk_size"],
+                    "uploadDate": datetime.now(timezone.utc),
+                    "metadata": {**upload["metadata"], "hash_id": hash_id},
+                })
+            except DuplicateKeyError:
+                # Stored meanwhile by another writer (or by an earlier, interrupted finish of this upload)
+                existing = db["fs.files"].find_one({"metadata.hash_id": hash_id}, {"_id": 1})
+        file_id = upload_id if existing is None else existing["_id"]
+        db["uploads"].update_one({"_id": upload_id}, {"$set": {"file_id": file_id}})
+
+    if file_id != upload_id:
+        db["fs.chunks"].delete_many({"files_id": upload_id})
+
+    db["uploads"].update_one(
+        {"_id": upload_id},
+        {"$set": {"status": "done", "file_id": file_id, "hash_id": hash_id, "updated_at": datetime.now()}}
+    )
+    return get_upload(upload_id)
+
+def abort_upload(upload_id):
+    # Drops an unfinished upload and its chunks; False if there was none
+    upload_id = ObjectId(upload_id)
+    deleted = db["uploads"].delete_one({"_id": upload_id, "status": "uploading"}).deleted_count
+    if deleted:
+        db["fs.chunks"].delete_many({"files_id": upload_id})
+        _upload_hash(upload_id, pop=True)
+    return deleted == 1
+
+def delete_stale_uploads(max_age=UPLOAD_EXPIRY):
+    # Aborts uploads nobody has sent a chunk to for max_age; returns how many. Also drops this
+    # process's hash state of uploads that aren't taking chunks anymore.
+    stale = db["uploads"].find({"status": "uploading", "updated_at": {"$lt": datetime.now() - max_age}}, {"_id": 1})
+    aborted = sum(abort_upload(u["_id"]) for u in list(stale))
+
+    with _upload_hashes_lock:
+        hashed = list(_upload_hashes)
+    active = {u["_id"] for u in db["uploads"].find({"_id": {"$in": hashed}, "status": "uploading"}, {"_id": 1})}
+    for upload_id in set(hashed) - active:
+        _upload_hash(upload_id, pop=True)
+    return aborted
+
 
 ##### SCRIPTS #######
 
@@ -171,7 +786,7 @@ def handle_file_array(file_datas: list[DataClass]):
 def generate_hash(file_datas: list[DataClass]):
     if file_datas is None:
         return 0
-    file_hashes = [hashlib.sha256(f.bytes).hexdigest() for f in file_datas]
+    file_hashes = [f.hash_id for f in file_datas]
     return hashlib.sha256(json.dumps(sorted(file_hashes)).encode()).hexdigest()
 
 
@@ -185,15 +800,20 @@ def create_object(file_datas: list[DataClass], extracted_data: dict):
     if file_datas is not None and existing is not None:
         return existing["_id"], existing.get("artifacts", {}).get("file_ids", [])
     else:    
-        object_id = collection.insert_one({
-            "status": "queued",
-            "hash_id": hash_id,
-            "inserted_at": datetime.now(),
-            "artifacts": {"file_ids": []},
-            "extracted_data": extracted_data
-        }).inserted_id
-
-        file_ids = [put_file(file_data, metadata={"object_id": object_id}) for file_data in file_datas]
+        try:
+            object_id = collection.insert_one({
+                "status": "queued",
+                "hash_id": hash_id,
+                "inserted_at": datetime.now(),
+                "artifacts": {"file_ids": []},
+                "extracted_data": extracted_data
+            }).inserted_id
+        except DuplicateKeyError:
+            # Created concurrently by another upload of the same files
+            existing = collection.find_one({"hash_id": hash_id})
+            return existing["_id"], existing.get("artifacts", {}).get("file_ids", [])
+
+        file_ids = put_files(file_datas, metadata={"object_id": object_id})
 
         collection.update_one(
             {"_id": object_id},
@@ -204,30 +824,39 @@ def create_object(file_datas: list[DataClass], extracted_data: dict):
 def create_printer(printer_id, printer_info={}):
     collection = db["printers"]
 
-    exisiting = collection.find_one({"printer_id": printer_id})
-    if exisiting is not None:
-        return exisiting["_id"]
-    else:
-        printer_id = collection.insert_one({
-            "printer_id": printer_id,
-            "info": printer_info,
-            "inserted_at": datetime.now(),
-            "status": "active",
-        }).inserted_id
-        return printer_id
+    # Upsert, so two uploads naming a new printer at once get the same document
+    return collection.find_one_and_update(
+        {"printer_id": printer_id},
+        {"$setOnInsert": {"info": printer_info, "inserted_at": datetime.now(), "status": "active"}},
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )["_id"]
 
 def check_print_job_exists(printer_id, object_id, file_datas: list[DataClass]):
     collection = db["print_jobs"]
 
     handle_file_array(file_datas)
+    hash_id = generate_hash(file_datas)
+    # content_hash: the G-code alone, known before the metadata is extracted (staged jobs have only that)
     existing = collection.find_one({
         "printer_id": printer_id,
         "object_id": object_id,
-        "artifacts.hash_id": generate_hash(file_datas)
+        "$or": [{"artifacts.hash_id": hash_id}, {"artifacts.content_hash": hash_id}],
     })
     return existing
 
-def create_print_job(file_datas: list[DataClass], printer_id=None, object_id=None, metadata={}):
+def print_job_hash(file_datas: list[DataClass], metadata: dict):
+    hash = generate_hash(file_datas)
+    # combining this hash with generated hash from metadata
+    metadata_hash = json.dumps(metadata, sort_keys=True)
+    metadata_hash = hashlib.sha256(metadata_hash.encode()).hexdigest()
+    combined_hash = hashlib.sha256()
+    combined_hash.update(hash.encode())
+    combined_hash.update(metadata_hash.encode())
+    return combined_hash.hexdigest()
+
+def create_print_job(file_datas: list[DataClass], printer_id=None, object_id=None, metadata={}, toolpath={}):
     collection = db["print_jobs"]
 
     existing = check_print_job_exists(printer_id, object_id, file_datas)
@@ -235,25 +864,19 @@ def create_print_job(file_datas: list[DataClass], printer_id=None, object_id=Non
     if file_datas is not None and existing is not None:
         return existing["_id"], existing.get("artifacts", {}).get("file_ids", [])
     else:
-        hash = generate_hash(file_datas)
-        # combining this hash with generated hash from metadata
-        metadata_hash = json.dumps(metadata, sort_keys=True)
-        metadata_hash = hashlib.sha256(metadata_hash.encode()).hexdigest()
-        combined_hash = hashlib.sha256()
-        combined_hash.update(hash.encode())
-        combined_hash.update(metadata_hash.encode())
-        final_hash = combined_hash.hexdigest()
+        final_hash = print_job_hash(file_datas, metadata)
 
         job_id = collection.insert_one({
             "printer_id": printer_id,
             "object_id": object_id,
             "inserted_at": datetime.now(),
             "status": "queued",
-            "artifacts": {"file_ids": [], "hash_id": final_hash},
-            "metadata": metadata
+            "artifacts": {"file_ids": [], "hash_id": final_hash, "content_hash": generate_hash(file_datas)},
+            "metadata": metadata,
+            "toolpath": toolpath,
         }).inserted_id
 
-        file_ids = [put_file(data, metadata={"job_id": job_id}) for data in file_datas]
+        file_ids = put_files(file_datas, metadata={"job_id": job_id})
 
         collection.update_one(
             {"_id": job_id},
@@ -261,13 +884,62 @@ def create_print_job(file_datas: list[DataClass], printer_id=None, object_id=Non
         )
         
         return job_id, file_ids
+
+def get_layer_statistics(print_job_id):
+    # Per-layer features computed at ingest (scripts.toolpath.layer_statistics), without the G-code blob
+    pj = db["print_jobs"].find_one({"_id": ObjectId(print_job_id)}, {"metadata.layer_statistics": 1})
+    if pj is None:
+        return None
+    return pj.get("metadata", {}).get("layer_statistics", [])
     
 
 ##### TIMESERIES #####
 
-def create_timeseries(name, dataset):
+# Arrays are stored as raw bytes split along the first axis into documents of
+# timeseries_buckets, tagged with dtype and shape so they can be rebuilt with
+# np.frombuffer. Documents written before this still carry a "data" list.
+TIMESERIES_BUCKET_SIZE = 65536  # samples (first-axis rows) per bucket
+TIMESERIES_MAX_BUCKET_BYTES = 8 * 1024 * 1024  # keeps buckets well under the 16 MB document limit
+# Numeric series also get a min/max/mean pyramid in timeseries_pyramid: level k
+# summarizes blocks of FACTOR**k samples, so long ranges can be read coarsely.
+TIMESERIES_PYRAMID_FACTOR = 16
+
+def _rows_per_bucket(row_bytes, bucket_size):
+    return max(1, min(bucket_size, TIMESERIES_MAX_BUCKET_BYTES // max(row_bytes, 1)))
+
+def _aggregate(values, block):
+    # NaN-aware min/max/mean over consecutive blocks of `block` rows
+    x = np.asarray(values, dtype=np.float64)
+    idx = np.arange(0, len(x), block)
+    valid = ~np.isnan(x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.add.reduceat(np.where(valid, x, 0.0), idx, axis=0) / np.add.reduceat(valid, idx, axis=0)
+    return {"min": np.fmin.reduceat(x, idx, axis=0), "max": np.fmax.reduceat(x, idx, axis=0), "mean": mean}
+
+def _create_pyramid(timeseries_id, rows, bucket_size):
+    levels = []
+    block = TIMESERIES_PYRAMID_FACTOR
+    row_bytes = 3 * 8 * int(np.prod(rows.shape[1:]))
+    while block < len(rows):
+        stats = _aggregate(rows, block)
+        points = len(stats["mean"])
+        bucket_points = _rows_per_bucket(row_bytes, bucket_size)
+        level = len(levels) + 1
+        db["timeseries_pyramid"].insert_many([{
+            "timeseries_id": timeseries_id,
+            "level": level,
+            "i": i,
+            "start": start,
+            "count": len(stats["mean"][start:start + bucket_points]),
+            **{k: Binary(v[start:start + bucket_points].tobytes()) for k, v in stats.items()},
+        } for i, start in enumerate(range(0, points, bucket_points))])
+        levels.append({"level": level, "block": block, "points": points, "bucket_size": bucket_points})
+        block *= TIMESERIES_PYRAMID_FACTOR
+    return levels
+
+def create_timeseries(name, dataset, bucket_size=TIMESERIES_BUCKET_SIZE, sample_rate=None, start_time=0.0, timeseries_id=None):
+    # timeseries_id: use this _id, so a caller can record it before anything is written (see reserve_ingest_output)
     collection = db["timeseries"]
-    array_size = len(dataset)
     arr = np.asarray(dataset)
     flat = arr.ravel()
     array_size = int(flat.size)
@@ -282,64 +954,516 @@ def create_timeseries(name, dataset):
     h.update(flat.tobytes())
     hash_id = h.hexdigest()
 
-    timeseries_id = collection.insert_one({
+    doc = {
+        "_id": timeseries_id or ObjectId(),
         "name": name,
-        "data": arr.tolist(),
         "created_at": datetime.now(),
         "array_size": array_size,
         "array_span": array_span,
         "hash_id": hash_id
-    }).inserted_id
+    }
+
+    if arr.dtype.hasobject:
+        # Python objects (e.g. variable-length strings from h5) have no binary layout
+        doc["data"] = arr.tolist()
+        return collection.insert_one(doc).inserted_id
+
+    rows = np.ascontiguousarray(arr.reshape(1) if arr.ndim == 0 else arr)
+    bucket_rows = _rows_per_bucket(rows.itemsize * int(np.prod(rows.shape[1:])), bucket_size)
+    starts = range(0, len(rows), bucket_rows)
+
+    doc.update({
+        "encoding": "buckets",
+        "dtype": arr.dtype.str,
+        "shape": list(arr.shape),
+        "bucket_size": bucket_rows,
+        "n_buckets": len(starts),
+    })
+    if sample_rate is not None:
+        # Lets readers address the series by time (seconds) instead of sample index
+        doc.update({"sample_rate": float(sample_rate), "start_time": float(start_time)})
+    timeseries_id = collection.insert_one(doc).inserted_id
+
+    buckets = [{
+        "timeseries_id": timeseries_id,
+        "i": i,
+        "start": start,
+        "count": len(rows[start:start + bucket_rows]),
+        "data": Binary(rows[start:start + bucket_rows].tobytes()),
+    } for i, start in enumerate(starts)]
+    if buckets:
+        db["timeseries_buckets"].insert_many(buckets)
+
+    if arr.ndim > 0 and (np.issubdtype(arr.dtype, np.number) or arr.dtype == bool):
+        collection.update_one(
+            {"_id": timeseries_id},
+            {"$set": {"pyramid": {"factor": TIMESERIES_PYRAMID_FACTOR, "levels": _create_pyramid(timeseries_id, rows, bucket_size)}}}
+        )
     return timeseries_id
 
+def _from_buckets(ts_doc, chunks):
+    # A single bucket is wrapped without copying; the result is then read-only
+    raw = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+    return np.frombuffer(raw, dtype=np.dtype(ts_doc["dtype"])).reshape(ts_doc["shape"])
+
+def _timeseries_buckets_query(ts_docs):
+    # find() arguments for the buckets of all bucket-encoded documents, None if there are none
+    bucketed = [ts["_id"] for ts in ts_docs if ts.get("encoding") == "buckets"]
+    if not bucketed:
+        return None
+    return {
+        "filter": {"timeseries_id": {"$in": bucketed}},
+        "projection": {"timeseries_id": 1, "data": 1},
+        "sort": [("timeseries_id", 1), ("i", 1)],
+    }
+
+def _timeseries_arrays(ts_docs, buckets):
+    # {timeseries _id: np.ndarray} from the documents and the buckets found with _timeseries_buckets_query
+    arrays = {ts["_id"]: np.asarray(ts["data"]) for ts in ts_docs if "data" in ts}
+    bucketed = {ts["_id"]: ts for ts in ts_docs if ts.get("encoding") == "buckets"}
+    chunks = {ts_id: [] for ts_id in bucketed}
+    for bucket in buckets:
+        chunks[bucket["timeseries_id"]].append(bucket["data"])
+
+    for ts_id, ts in bucketed.items():
+        arrays[ts_id] = _from_buckets(ts, chunks[ts_id])
+    return arrays
+
+def read_timeseries_many(ts_docs: list):
+    # {timeseries _id: np.ndarray}, fetching the buckets of all documents in one query
+    query = _timeseries_buckets_query(ts_docs)
+    buckets = [] if query is None else db["timeseries_buckets"].find(**query)
+    return _timeseries_arrays(ts_docs, buckets)
+
+def read_timeseries(ts_doc):
+    return read_timeseries_many([ts_doc])[ts_doc["_id"]]
+
+def get_timeseries(timeseries_id):
+    ts = db["timeseries"].find_one({"_id": ObjectId(timeseries_id)})
+    if ts is None:
+        return None
+    return read_timeseries(ts)
+
+def _range_bounds(ts, n, start, stop, unit):
+    # Sample indices [start, stop) of a read_timeseries_range request, clipped to the n samples.
+    # Fractional bounds widen the range to the samples they touch.
+    if any(b is not None and not np.isfinite(b) for b in (start, stop)):
+        raise ValueError("start and stop must be finite numbers.")
+    if unit == "time":
+        rate = ts.get("sample_rate")
+        if rate is None:
+            raise ValueError("This timeseries has no sample_rate, use unit='sample'.")
+        t0 = ts.get("start_time", 0.0)
+        start = None if start is None else int(np.floor((start - t0) * rate))
+        stop = None if stop is None else int(np.ceil((stop - t0) * rate))
+    elif unit == "sample":
+        start = None if start is None else int(np.floor(start))
+        stop = None if stop is None else int(np.ceil(stop))
+    else:
+        raise ValueError("unit must be 'sample' or 'time'.")
+    start = min(max(start or 0, 0), n)
+    stop = min(max(n if stop is None else stop, start), n)
+    return start, stop
+
+def _range_level(ts, start, stop, resolution):
+    # (stored pyramid level, block) giving at most `resolution` points for samples start..stop-1.
+    # Blocks are aligned to multiples of `block`, so an unaligned range can touch one more block
+    # than its length needs; that is counted. The level is None when no stored level is coarse
+    # enough (or there is no pyramid at all), the range then has to be aggregated with _aggregate
+    # in blocks of `block` samples.
+    def points(block):
+        return -(-stop // block) - start // block
+
+    levels = ts.get("pyramid", {}).get("levels", [])
+    level = next((lv for lv in levels if points(lv["block"]) <= resolution), None)
+    if level is not None:
+        return level, level["block"]
+    block = TIMESERIES_PYRAMID_FACTOR
+    while points(block) > resolution:
+        block *= TIMESERIES_PYRAMID_FACTOR
+    return None, block
+
+def _bucket_span(a, b, bucket_size):
+    # First and last bucket holding rows a..b-1, and the position of row a in the first one
+    first = a // bucket_size
+    return first, (b - 1) // bucket_size, a - first * bucket_size
+
+def _range_result(ts, start, stop, level, block, index, **values):
+    result = {"start": start, "stop": stop, "level": level, "block": block, "index": index, **values}
+    if ts.get("sample_rate") is not None:
+        result["time"] = ts.get("start_time", 0.0) + index / ts["sample_rate"]
+    return result
+
+def _range_plan(ts, start, stop, resolution, unit):
+    # What read_timeseries_range reads for a request: the clipped start/stop, the level of the
+    # result (0 for raw rows, None for raw rows aggregated here, else a stored pyramid level), its
+    # block and index, and the rows a..b-1 to read (samples, or entries of the pyramid level)
+    if resolution is not None and resolution < 1:
+        raise ValueError("resolution must be at least 1.")
+    n = len(ts["data"]) if "encoding" not in ts else (ts["shape"][0] if ts["shape"] else 1)
+    start, stop = _range_bounds(ts, n, start, stop, unit)
+    if resolution is None or stop - start <= resolution:
+        return {"start": start, "stop": stop, "level": 0, "block": 1, "index": np.arange(start, stop), "rows": (start, stop)}
+
+    level, block = _range_level(ts, start, stop, resolution)
+    p0, p1 = start // block, -(-stop // block)
+    rows = (p0 * block, min(p1 * block, n)) if level is None else (p0, p1)
+    return {"start": start, "stop": stop, "level": level, "block": block, "index": np.arange(p0, p1) * block, "rows": rows}
+
+def _range_buckets(ts, plan):
+    # (collection, fields, bucket size) holding the rows of the plan
+    level = plan["level"]
+    if isinstance(level, dict):
+        return "timeseries_pyramid", ["min", "max", "mean"], level["bucket_size"]
+    return "timeseries_buckets", ["data"], ts["bucket_size"]
+
+def _range_query(ts, plan):
+    # (collection, find() arguments) for the buckets holding the rows of the plan, None if nothing has to be read
+    a, b = plan["rows"]
+    if "encoding" not in ts or a >= b:
+        return None
+    coll_name, fields, bucket_size = _range_buckets(ts, plan)
+    first, last, _ = _bucket_span(a, b, bucket_size)
+    query = {"timeseries_id": ts["_id"], "i": {"$gte": first, "$lte": last}}
+    if isinstance(plan["level"], dict):
+        query["level"] = plan["level"]["level"]
+    return coll_name, {"filter": query, "projection": {f: 1 for f in fields}, "sort": [("i", 1)]}
+
+def _range_from_buckets(ts, plan, buckets: list):
+    # The read_timeseries_range result from the buckets found with _range_query
+    a, b = plan["rows"]
+    level, block = plan["level"], plan["block"]
+    if "encoding" not in ts:
+        # List-encoded document: the rows come from its data
+        values = {"data": np.asarray(ts["data"])[a:b]}
+    else:
+        _, fields, bucket_size = _range_buckets(ts, plan)
+        # Pyramid levels are stored as float64
+        dtype = np.float64 if isinstance(level, dict) else np.dtype(ts["dtype"])
+        offset = _bucket_span(a, b, bucket_size)[2] if a < b else 0
+        values = {
+            f: np.frombuffer(b"".join(bucket[f] for bucket in buckets), dtype=dtype).reshape([-1] + ts["shape"][1:])[offset:offset + b - a]
+            for f in fields
+        }
+
+    if level is None:
+        return _range_result(ts, plan["start"], plan["stop"], None, block, plan["index"], **_aggregate(values["data"], block))
+    if isinstance(level, dict):
+        level = level["level"]
+    return _range_result(ts, plan["start"], plan["stop"], level, block, plan["index"], **values)
+
+def read_timeseries_range(timeseries_id, start=None, stop=None, resolution=None, unit="sample"):
+    # start/stop are sample indices, or seconds with unit="time" (needs the sample_rate
+    # given to create_timeseries). Without resolution, or when the range has at most that
+    # many samples, the raw rows come back as "data". Otherwise the finest pyramid level with
+    # at most `resolution` points over the range comes back as "min"/"max"/"mean" per block.
+    # Only the buckets covering the range are read.
+    ts = db["timeseries"].find_one({"_id": ObjectId(timeseries_id)}, {"data": 0})
+    if ts is None:
+        return None
+    if "encoding" not in ts:
+        # List-encoded document: no buckets to seek into
+        ts = db["timeseries"].find_one({"_id": ts["_id"]})
+
+    plan = _range_plan(ts, start, stop, resolution, unit)
+    query = _range_query(ts, plan)
+    buckets = [] if query is None else list(db[query[0]].find(**query[1]))
+    return _range_from_buckets(ts, plan, buckets)
+
+def create_toolpath(toolpath: dict, new_id=None):
+    # One timeseries per column (x, y, z, e, f, g, layer, line) of scripts.toolpath.parse_toolpath.
+    # new_id: called for the _id of each timeseries (see create_timeseries)
+    return {name: create_timeseries(f"toolpath/{name}", column, timeseries_id=new_id and new_id()) for name, column in toolpath.items()}
+
+def get_toolpath(print_job_id):
+    pj = db["print_jobs"].find_one({"_id": ObjectId(print_job_id)}, {"toolpath": 1})
+    if pj is None:
+        return None
+
+    ts_map = pj.get("toolpath", {})
+    arrays = read_timeseries_many(list(db["timeseries"].find({"_id": {"$in": list(ts_map.values())}})))
+    return {
+        name: arrays[ts_id] for name, ts_id in ts_map.items() if ts_id in arrays
+    }
+
 
 ####### IMAGE_COLLECTIONS #######
 
+# Perceptual hashes are split into PHASH_BANDS 16-bit bands stored as "band * 2**16 + value" in
+# phash_bands (multi-index hashing): two hashes within distance d share a band that differs in at
+# most d // PHASH_BANDS bits, so a lookup only enumerates those few variants of each band.
+PHASH_BITS = 64
+PHASH_BANDS = 4
+PHASH_MAX_DISTANCE = 8  # default near-duplicate radius
+PHASH_MAX_BAND_FLIPS = 3  # bounds a lookup to sum(C(16, k), k <= 3) = 697 keys per band
+PHASH_MAX_SEARCH_DISTANCE = PHASH_BANDS * (PHASH_MAX_BAND_FLIPS + 1) - 1
+
+PARALLEL_IMAGE_MIN_BATCH = 16  # create_image_collection switches to create_images_parallel from this size
+IMAGE_UPLOAD_THREADS = 4
+
 def check_existing_image(image: DataClass):
     collection = db["images"]
 
     existing = collection.find_one({"hash_id": image.hash_id})
     return existing
 
-def create_image(image: DataClass, metadata={}):
-    existing = check_existing_image(image)
-    if existing is not None:
-        return existing["_id"]
-
+def find_existing_images(hash_ids: list):
+    # Matches the stored PNG hash or any original (e.g. JPEG) hash the image was ingested from
     collection = db["images"]
 
-    if image.type not in ["image/png", "image/jpeg"]:
-        raise ValueError("Only PNG and JPEG images are supported.")
-    if image.type == "image/jpeg":
-        image = convert_to_png(image)
-        existing = check_existing_image(image)
-        if existing is not None:
-            return existing["_id"]
-
+    hash_ids = list(set(hash_ids))
+    known = {}
+    for img in collection.find(
+        {"$or": [{"hash_id": {"$in": hash_ids}}, {"source_hash_ids": {"$in": hash_ids}}]},
+        {"hash_id": 1, "source_hash_ids": 1}
+    ):
+        for h in [img["hash_id"], *img.get("source_hash_ids", [])]:
+            known[h] = img["_id"]
+    return known
+
+def _record_source_hashes(pairs):
+    # Remember which originals produced an already stored image, so the next upload of
+    # the same JPEG is resolved before it is decoded again. One update per image.
+    sources = {}
+    for img_id, source_hash in pairs:
+        sources.setdefault(img_id, []).append(source_hash)
+    for img_id, hashes in sources.items():
+        db["images"].update_one({"_id": img_id}, {"$addToSet": {"source_hash_ids": {"$each": hashes}}})
+
+def _phash_band_keys(phash: str, max_flips=0):
+    h = int(phash, 16)
+    band_bits = PHASH_BITS // PHASH_BANDS
+    keys = []
+    for band in range(PHASH_BANDS):
+        value = (h >> (band_bits * (PHASH_BANDS - 1 - band))) & ((1 << band_bits) - 1)
+        for flips in range(max_flips + 1):
+            for bits in combinations(range(band_bits), flips):
+                v = value
+                for b in bits:
+                    v ^= 1 << b
+                keys.append((band << band_bits) + v)
+    return keys
+
+def _phash_fields(phash):
+    return {"phash": phash, "phash_bands": _phash_band_keys(phash)}
+
+def _phash_candidates_query(phash, max_distance):
+    # find() arguments for the images sharing a band (up to max_distance // PHASH_BANDS flipped bits) with phash
+    if not 0 <= max_distance <= PHASH_MAX_SEARCH_DISTANCE:
+        raise ValueError(f"max_distance must be between 0 and {PHASH_MAX_SEARCH_DISTANCE}.")
+    return {"filter": {"phash_bands": {"$in": _phash_band_keys(phash, max_distance // PHASH_BANDS)}}, "projection": {"phash": 1}}
+
+def _phash_matches(phash, max_distance, candidates):
+    # [(image_id, distance)] of the candidates within max_distance bits of phash, closest first
+    h = int(phash, 16)
+    found = []
+    for img in candidates:
+        distance = (int(img["phash"], 16) ^ h).bit_count()
+        if distance <= max_distance:
+            found.append((img["_id"], distance))
+    return sorted(found, key=lambda x: x[1])
+
+def find_similar_images_by_hash(phash: str, max_distance=PHASH_MAX_DISTANCE):
+    # [(image_id, distance)] of every stored image whose perceptual hash is within max_distance
+    # bits of phash, closest first. Candidates come from the phash_bands index, not a scan.
+    query = _phash_candidates_query(phash, max_distance)
+    return _phash_matches(phash, max_distance, db["images"].find(**query))
+
+def find_similar_images(image_id, max_distance=PHASH_MAX_DISTANCE):
+    # Near duplicates of a stored image (itself excluded); None if it doesn't exist or has no hash yet
+    img = db["images"].find_one({"_id": ObjectId(image_id)}, {"phash": 1})
+    if img is None or "phash" not in img:
+        return None
+    return [(img_id, d) for img_id, d in find_similar_images_by_hash(img["phash"], max_distance) if img_id != img["_id"]]
 
-    image_id = put_file(image, metadata={"image_name": image.name})
+def backfill_perceptual_hashes(batch_size=100):
+    # Hash images stored before perceptual hashes existed; returns how many were updated
+    collection = db["images"]
+    updated = 0
+    while True:
+        batch = list(collection.find({"phash": {"$exists": False}}, {"file_id": 1}).limit(batch_size))
+        if not batch:
+            return updated
+        for img in batch:
+            with fs.get(img["file_id"]) as f:
+                phash = file_perceptual_hash(f)
+            collection.update_one({"_id": img["_id"]}, {"$set": _phash_fields(phash)})
+            updated += 1
 
-    additional_metadata = extract_image_data(image)
-    metadata.update(additional_metadata)
+def create_image(image: DataClass, metadata={}):
+    return create_images([image], metadata)[0]
+
+def _put_previews(items):
+    # items: [(png hash, {size: DataClass})] -> [{"<size>": file_id}], all blobs in one put_files call
+    flat = [(size, preview, png_hash) for png_hash, previews in items for size, preview in previews.items()]
+    file_ids = iter(put_files(
+        [preview for _, preview, _ in flat],
+        metadata=[{"preview_of": png_hash, "preview_size": size} for size, _, png_hash in flat]
+    ))
+    return [{str(size): next(file_ids) for size in previews} for _, previews in items]
+
+def create_images(images: list[DataClass], metadata={}, compress_level=PNG_COMPRESS_LEVEL, optimize=PNG_OPTIMIZE):
+    # Batched create_image. Images are deduplicated on their original hash first (one $in
+    # lookup), so known JPEGs are never decoded. The rest are decoded once by prepare_image,
+    # checked again on the PNG hash, and new blobs (with their previews) go through put_files.
+    collection = db["images"]
 
-    img_doc_id = collection.insert_one({
-        "name": image.name,
+    for image in images:
+        if image.type not in ["image/png", "image/jpeg"]:
+            raise ValueError("Only PNG and JPEG images are supported.")
+
+    known = find_existing_images([image.hash_id for image in images])
+
+    prepared = {}
+    seen = set()
+    for i, image in enumerate(images):
+        if image.hash_id in known or image.hash_id in seen:
+            continue
+        seen.add(image.hash_id)
+        prepared[i] = prepare_image(image, compress_level, optimize)
+    known.update(find_existing_images([png.hash_id for png, *_ in prepared.values()]))
+
+    new_images = {}
+    for i, (png, image_metadata, previews, phash) in prepared.items():
+        if png.hash_id in known:
+            continue
+        if png.hash_id not in new_images:
+            new_images[png.hash_id] = (png, image_metadata, set(), previews, phash)
+        if images[i].hash_id != png.hash_id:
+            new_images[png.hash_id][2].add(images[i].hash_id)
+    new_images = list(new_images.values())
+
+    file_ids = put_files([png for png, *_ in new_images], metadata=[{"image_name": png.name} for png, *_ in new_images])
+    preview_ids = _put_previews([(png.hash_id, previews) for png, _, _, previews, _ in new_images])
+
+    docs = [{
+        "name": png.name,
         "inserted_at": datetime.now(),
-        "file_id": image_id,
-        "hash_id": image.hash_id,
-        "metadata": metadata
-    }).inserted_id
-    return img_doc_id
+        "file_id": file_id,
+        "hash_id": png.hash_id,
+        "source_hash_ids": sorted(sources),
+        "previews": previews,
+        **_phash_fields(phash),
+        "metadata": {**metadata, **image_metadata}
+    } for (png, image_metadata, sources, _, phash), file_id, previews in zip(new_images, file_ids, preview_ids)]
+    if docs:
+        try:
+            inserted = collection.insert_many(docs, ordered=False).inserted_ids
+        except BulkWriteError as e:
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+            # Some were inserted concurrently by another ingestion: use the stored ones
+            failed = {err["index"] for err in e.details["writeErrors"]}
+            stored = find_existing_images([docs[i]["hash_id"] for i in failed])
+            _record_source_hashes([(stored[docs[i]["hash_id"]], source) for i in failed for source in docs[i]["source_hash_ids"]])
+            inserted = [stored[doc["hash_id"]] if i in failed else doc["_id"] for i, doc in enumerate(docs)]
+        for doc, img_id in zip(docs, inserted):
+            known.update(dict.fromkeys([doc["hash_id"], *doc["source_hash_ids"]], img_id))
+
+    # JPEGs whose conversion matched an image stored before source hashes were recorded
+    _record_source_hashes([
+        (known[png.hash_id], images[i].hash_id)
+        for i, (png, *_) in prepared.items()
+        if images[i].hash_id != png.hash_id and images[i].hash_id not in known
+    ])
+    for i, (png, *_) in prepared.items():
+        known.setdefault(images[i].hash_id, known[png.hash_id])
+
+    return [known[image.hash_id] for image in images]
+
+def _insert_prepared_image(source_hash, image: DataClass, image_metadata: dict, previews: dict, phash: str):
+    # Upload half of create_images_parallel, run on the thread pool
+    collection = db["images"]
 
-def create_image_collection(name, images: list[DataClass], metadata: dict = {}):
+    existing = check_existing_image(image)
+    if existing is None:
+        file_id = put_file(image, metadata={"image_name": image.name})
+        preview_ids = _put_previews([(image.hash_id, previews)])[0]
+        try:
+            return collection.insert_one({
+                "name": image.name,
+                "inserted_at": datetime.now(),
+                "file_id": file_id,
+                "hash_id": image.hash_id,
+                "source_hash_ids": [source_hash] if source_hash != image.hash_id else [],
+                "previews": preview_ids,
+                **_phash_fields(phash),
+                "metadata": image_metadata
+            }).inserted_id
+        except DuplicateKeyError:
+            # Inserted concurrently by another ingestion
+            existing = check_existing_image(image)
+    if source_hash != image.hash_id:
+        _record_source_hashes([(existing["_id"], source_hash)])
+    return existing["_id"]
+
+def create_images_parallel(images: list[DataClass], metadata={}, workers=None, upload_threads=IMAGE_UPLOAD_THREADS, max_pending=None,
+                           compress_level=PNG_COMPRESS_LEVEL, optimize=PNG_OPTIMIZE):
+    # Same result as create_images, but decode/convert/metadata run in a process pool while
+    # GridFS uploads overlap in a thread pool. At most max_pending images are being converted
+    # and 2 * upload_threads waiting for upload at any time, so memory stays bounded.
+    for image in images:
+        if image.type not in ["image/png", "image/jpeg"]:
+            raise ValueError("Only PNG and JPEG images are supported.")
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+
+    known = find_existing_images([image.hash_id for image in images])
+    results = [known.get(image.hash_id) for image in images]
+    uploads = {}  # PNG hash -> upload future, so duplicates in the batch are stored once
+    prepare = partial(prepare_image, compress_level=compress_level, optimize=optimize)
+
+    with ProcessPoolExecutor(max_workers=workers) as procs, ThreadPoolExecutor(max_workers=upload_threads) as threads:
+        converting = deque()
+        uploading = deque()
+        submitted = {}  # original hash -> index of the image converted for it
+        merged = []  # indexes of originals converted to a PNG another original of the batch is uploading
+
+        def collect(i, future):
+            image, image_metadata, previews, phash = future.result()
+            if image.hash_id in known:
+                results[i] = known[image.hash_id]
+                if image.hash_id != images[i].hash_id:
+                    _record_source_hashes([(known[image.hash_id], images[i].hash_id)])
+                return
+            if image.hash_id not in uploads:
+                uploads[image.hash_id] = threads.submit(_insert_prepared_image, images[i].hash_id, image, {**metadata, **image_metadata}, previews, phash)
+                uploading.append(uploads[image.hash_id])
+                while len(uploading) > 2 * upload_threads:
+                    uploading.popleft().result()
+            elif image.hash_id != images[i].hash_id:
+                merged.append(i)
+            results[i] = uploads[image.hash_id]
+
+        for i, image in enumerate(images):
+            if results[i] is not None or image.hash_id in submitted:
+                continue
+            submitted[image.hash_id] = i
+            converting.append((i, procs.submit(prepare, image)))
+            if len(converting) >= max_pending:
+                collect(*converting.popleft())
+        while converting:
+            collect(*converting.popleft())
+
+    results = [r.result() if hasattr(r, "result") else r for r in results]
+    _record_source_hashes([(results[i], images[i].hash_id) for i in merged])
+    # Repeats of an original in the batch share the result of its first occurrence
+    return [results[submitted[image.hash_id]] if r is None else r for image, r in zip(images, results)]
+
+def create_image_collection(name, images: list[DataClass], metadata: dict = {}, parallel=None):
     # Create image collection even if it already exists a collection with the same name and set of images
     # The images are not going to be duplicated in the database
     # So it's acceptable to have multiple collections with the same images, but different names/metadata and
     # references to different sessions/print jobs
 
+    # parallel=None picks the process-pool ingestion for batches of PARALLEL_IMAGE_MIN_BATCH or more
+
     collection = db["image_collections"]
 
-    image_ids = [create_image(img) for img in images]
+    if parallel is None:
+        parallel = len(images) >= PARALLEL_IMAGE_MIN_BATCH
+    image_ids = create_images_parallel(images) if parallel else create_images(images)
 
     coll_id = collection.insert_one({
         "name": name,
@@ -349,6 +1473,29 @@ def create_image_collection(name, images: list[DataClass], metadata: dict = {}):
     }).inserted_id
     return coll_id
 
+def get_image_collection_image_ids(image_collection_ids: list):
+    # Image ids of the given collections, in collection order
+    colls = {c["_id"]: c["image_file_ids"] for c in db["image_collections"].find({"_id": {"$in": list(image_collection_ids)}}, {"image_file_ids": 1})}
+    return [img_id for coll_id in image_collection_ids for img_id in colls.get(coll_id, [])]
+
+def _preview_file(img, size):
+    # (GridFS id, mime type) of the rendition get_image_preview sends for the image document
+    fits = sorted((int(s), file_id) for s, file_id in img.get("previews", {}).items() if int(s) >= size)
+    if fits:
+        return fits[0][1], PREVIEW_MIME
+    return img["file_id"], "image/png"
+
+def get_image_preview(image_id, size=PREVIEW_SIZES[0]):
+    # Closest stored rendition for displaying at `size` px (longest side): the smallest preview at
+    # least that big, else the original. Images ingested before previews existed fall back to the
+    # original. Returns (bytes, mime type) or None if the image doesn't exist.
+    img = db["images"].find_one({"_id": ObjectId(image_id)}, {"file_id": 1, "previews": 1})
+    if img is None:
+        return None
+
+    file_id, media_type = _preview_file(img, size)
+    return fs.get(file_id).read(), media_type
+
 def pass_session_to_image_collections(session_id, image_collection_ids: list):
     for coll_id in image_collection_ids:
         db["image_collections"].update_one(
@@ -357,6 +1504,217 @@ def pass_session_to_image_collections(session_id, image_collection_ids: list):
         )
 
 
+##### INGESTION QUEUE #####
+
+# Staging inserts a session, object, print job or image collection right away with status
+# "queued", its raw bytes already in GridFS, and a "staged" field describing the work left
+# (parsing, image processing, timeseries). Ingest workers (scripts/ingest_worker.py) claim staged
+# documents atomically, move them to "ingesting" and then "ingested" (dropping "staged") or
+# "failed". Progress, heartbeat and errors are kept in the document's "ingest" field.
+INGEST_COLLECTIONS = ["print_jobs", "image_collections", "objects", "print_sessions"]  # claim order
+INGEST_LEASE_SECONDS = 600  # an "ingesting" document without a heartbeat for this long is claimed again
+INGEST_MAX_ATTEMPTS = 3  # claims before a document whose workers keep dying is marked failed
+
+def stage_session(file_datas: list[DataClass], metadata={}, print_job_id=None, image_collections_ids=[]):
+    # create_session, with the timeseries left to a worker: they are read from the raw .h5 files
+    collection = db["print_sessions"]
+    session_id = collection.insert_one({
+        "inserted_at": datetime.now(),
+        "status": "queued",
+        "raw_files": {"file_ids": []},
+        "metadata": metadata,
+        "print_job_id": print_job_id,
+        "timeseries": {},
+        "image_collections": image_collections_ids,
+    }).inserted_id
+
+    file_ids = put_files(file_datas, metadata={"session_id": session_id})
+    h5_ids = [fid for data, fid in zip(file_datas, file_ids) if data.name.lower().endswith(".h5")]
+    collection.update_one(
+        {"_id": session_id},
+        {"$set": {"raw_files.file_ids": file_ids, "staged": {"h5_file_ids": h5_ids}}}
+    )
+    return session_id
+
+def stage_object(file_datas: list[DataClass], extracted_data: dict = {}):
+    # create_object, with extraction from the model files left to a worker
+    collection = db["objects"]
+    handle_file_array(file_datas)
+    hash_id = generate_hash(file_datas)
+
+    existing = collection.find_one({"hash_id": hash_id})
+    if existing is not None:
+        return existing["_id"]
+
+    try:
+        object_id = collection.insert_one({
+            "status": "queued",
+            "hash_id": hash_id,
+            "inserted_at": datetime.now(),
+            "artifacts": {"file_ids": []},
+            "extracted_data": extracted_data
+        }).inserted_id
+    except DuplicateKeyError:
+        # Staged concurrently by another upload of the same files
+        return collection.find_one({"hash_id": hash_id})["_id"]
+    file_ids = put_files(file_datas, metadata={"object_id": object_id})
+    collection.update_one(
+        {"_id": object_id},
+        {"$set": {"artifacts.file_ids": file_ids, "staged": {}}}
+    )
+    return object_id
+
+def stage_print_job(file_data: DataClass, printer_id=None, object_id=None):
+    # The G-code is stored as the job's artifact; metadata, toolpath and layer index come from a worker
+    existing = check_print_job_exists(printer_id, object_id, [file_data])
+    if existing is not None:
+        return existing["_id"]
+
+    job_id = db["print_jobs"].insert_one({
+        "printer_id": printer_id,
+        "object_id": object_id,
+        "inserted_at": datetime.now(),
+        "status": "queued",
+        "artifacts": {"file_ids": [], "content_hash": generate_hash([file_data])},
+        "metadata": {},
+        "toolpath": {},
+    }).inserted_id
+    file_ids = put_files([file_data], metadata={"job_id": job_id})
+    db["print_jobs"].update_one(
+        {"_id": job_id},
+        {"$set": {"artifacts.file_ids": file_ids, "staged": {"gcode_file_id": file_ids[0]}}}
+    )
+    return job_id
+
+def stage_image_collection(name, images: list[DataClass], metadata: dict = {}):
+    # Raw images wait in the staging bucket (no dedup there); the worker converts, dedups and
+    # previews them like create_image_collection, then deletes the staged copies
+    coll_id = db["image_collections"].insert_one({
+        "name": name,
+        "inserted_at": datetime.now(),
+        "status": "queued",
+        "image_file_ids": [],
+        "metadata": metadata,
+    }).inserted_id
+    staged_ids = []
+    for image in images:
+        with image.open() as f:
+            staged_ids.append(staging_fs.put(f, filename=image.name, metadata={"image_collection_id": coll_id, "content_type": image.type}))
+    db["image_collections"].update_one({"_id": coll_id}, {"$set": {"staged": {"file_ids": staged_ids}}})
+    return coll_id
+
+def read_staged_file(file_id, staging=True):
+    # DataClass of a staged upload (staging bucket) or of a stored artifact (staging=False)
+    f = (staging_fs if staging else fs).get(ObjectId(file_id))
+    return DataClass(f, mime_type=(f.metadata or {}).get("content_type"), name=f.filename)
+
+def claim_ingest_job(worker, collections=INGEST_COLLECTIONS):
+    # (collection name, document) of the oldest staged document nobody is working on, or None.
+    # find_one_and_update makes the claim atomic: two workers never get the same document.
+    now = datetime.now()
+    for coll_name in collections:
+        while True:
+            doc = db[coll_name].find_one_and_update(
+                {"staged": {"$exists": True}, "$or": [
+                    {"status": "queued"},
+                    {"status": "ingesting", "ingest.heartbeat_at": {"$lt": now - timedelta(seconds=INGEST_LEASE_SECONDS)}},
+                ]},
+                {"$set": {"status": "ingesting", "ingest.worker": worker, "ingest.claimed_at": now, "ingest.heartbeat_at": now,
+                          "ingest.progress": None, "ingest.error": None},
+                 "$inc": {"ingest.attempts": 1}},
+                sort=[("inserted_at", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if doc is None:
+                break
+            # Whatever an earlier attempt wrote before its worker died
+            _delete_ingest_outputs(coll_name, doc, worker)
+            if doc["ingest"]["attempts"] <= INGEST_MAX_ATTEMPTS:
+                return coll_name, doc
+            fail_ingest(coll_name, doc["_id"], worker, f"Gave up after {INGEST_MAX_ATTEMPTS} attempts (worker lost)")
+    return None
+
+def _ingest_update(coll_name, doc_id, worker, update):
+    # Only the worker holding the claim may write; False once it was lost (lease expired and re-claimed)
+    result = db[coll_name].update_one({"_id": doc_id, "status": "ingesting", "ingest.worker": worker}, update)
+    return result.matched_count == 1
+
+def delete_timeseries(timeseries_ids: list):
+    # Also removes what a create_timeseries that was interrupted halfway left behind
+    db["timeseries"].delete_many({"_id": {"$in": timeseries_ids}})
+    db["timeseries_buckets"].delete_many({"timeseries_id": {"$in": timeseries_ids}})
+    db["timeseries_pyramid"].delete_many({"timeseries_id": {"$in": timeseries_ids}})
+
+def reserve_ingest_output(coll_name, doc_id, worker):
+    # _id for a timeseries the worker is about to write, recorded in ingest.outputs first: if the
+    # attempt fails or its worker dies, the next claim (or fail_ingest) deletes it instead of leaving it orphaned
+    output_id = ObjectId()
+    if not _ingest_update(coll_name, doc_id, worker, {"$push": {"ingest.outputs": output_id}}):
+        raise RuntimeError(f"Lost the claim on {coll_name} {doc_id}.")
+    return output_id
+
+def _delete_ingest_outputs(coll_name, doc, worker):
+    outputs = (doc.get("ingest") or {}).get("outputs") or []
+    if outputs:
+        delete_timeseries(outputs)
+        _ingest_update(coll_name, doc["_id"], worker, {"$pull": {"ingest.outputs": {"$in": outputs}}})
+
+def report_ingest_progress(coll_name, doc_id, worker, done, total, message=""):
+    return _ingest_update(coll_name, doc_id, worker, {"$set": {
+        "ingest.progress": {"done": done, "total": total, "message": message},
+        "ingest.heartbeat_at": datetime.now(),
+    }})
+
+def ingest_heartbeat(coll_name, doc_id, worker):
+    return _ingest_update(coll_name, doc_id, worker, {"$set": {"ingest.heartbeat_at": datetime.now()}})
+
+def complete_ingest(coll_name, doc_id, worker, fields={}):
+    # Stores the ingested fields and marks the document ingested
+    return _ingest_update(coll_name, doc_id, worker, {
+        "$set": {**fields, "status": "ingested", "ingest.finished_at": datetime.now()},
+        "$unset": {"staged": "", "ingest.outputs": ""},
+    })
+
+def fail_ingest(coll_name, doc_id, worker, error):
+    # Drops the timeseries the failed attempt already wrote
+    doc = db[coll_name].find_one({"_id": doc_id, "status": "ingesting", "ingest.worker": worker}, {"ingest.outputs": 1})
+    if doc is None:
+        return False
+    _delete_ingest_outputs(coll_name, doc, worker)
+    return _ingest_update(coll_name, doc_id, worker, {"$set": {
+        "status": "failed", "ingest.error": error, "ingest.finished_at": datetime.now(),
+    }})
+
+def release_ingest_job(coll_name, doc_id, worker):
+    # Hands a claimed document back to the queue (worker shutting down); the claim isn't counted
+    return _ingest_update(coll_name, doc_id, worker, {"$set": {"status": "queued"}, "$inc": {"ingest.attempts": -1}})
+
+def delete_staged_files(staged: dict):
+    # Staging-bucket copies of an ingested document's uploads (stored artifacts are kept)
+    for file_id in staged.get("file_ids", []):
+        staging_fs.delete(file_id)
+
+def retry_failed_ingests(collections=INGEST_COLLECTIONS):
+    # Queues failed documents again (e.g. after fixing a bug); returns how many
+    return sum(
+        db[coll_name].update_many(
+            {"staged": {"$exists": True}, "status": "failed"},
+            {"$set": {"status": "queued", "ingest.attempts": 0}}
+        ).modified_count
+        for coll_name in collections
+    )
+
+def get_ingest_overview(collections=INGEST_COLLECTIONS):
+    # {collection: {status: count}} of staged documents not ingested yet (queued, ingesting, failed)
+    return {
+        coll_name: {g["_id"]: g["n"] for g in db[coll_name].aggregate([
+            {"$match": {"staged": {"$exists": True}}},
+            {"$group": {"_id": "$status", "n": {"$sum": 1}}},
+        ])}
+        for coll_name in collections
+    }
+
+
 ######## DICTIONARIES ########
 
 def check_dictionary(printer, slicer):
@@ -368,19 +1726,14 @@ def check_dictionary(printer, slicer):
 def get_dictionary(printer, slicer):
     collection = db["dictionaries"]
 
-    existing = collection.find_one({"printer": printer, "slicer": slicer})
-    if existing is not None:
-        return existing["dict"], existing["_id"]
-    
-    # if it does not exist, create a new one
-
-    dict_id = collection.insert_one({
-        "printer": printer,
-        "slicer": slicer,
-        "dict": {},
-        "created_at": datetime.now(),
-    }).inserted_id
-    return {}, dict_id
+    # if it does not exist, create a new one (upsert: concurrent callers get the same one)
+    existing = collection.find_one_and_update(
+        {"printer": printer, "slicer": slicer},
+        {"$setOnInsert": {"dict": {}, "created_at": datetime.now()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return existing["dict"], existing["_id"]
 
 def get_all_existing_keys():
     d, _ = get_dictionary("", "")
@@ -399,19 +1752,8 @@ def update_dictionary(dict_id, new_data: dict):
     )
 
 def get_main_dictionary_id():
-    collection = db["dictionaries"]
-
-    existing = collection.find_one({"printer": "", "slicer": ""})
-    if existing is not None:
-        return existing["_id"], existing["dict"]
-    else:
-        dict_id = collection.insert_one({
-            "printer": "",
-            "slicer": "",
-            "dict": {},
-            "created_at": datetime.now(),
-        }).inserted_id
-        return collection.find_one({"_id": dict_id})
+    main_dict, dict_id = get_dictionary("", "")
+    return dict_id, main_dict
 
 
 def append_to_main_dictionary(dict_input):
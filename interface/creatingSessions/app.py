@@ -4,18 +4,25 @@ from interface.creatingSessions.printers_pipeline import printers_pipeline
 from scripts.reading_h5 import extract_h5_datasets
 import streamlit as st
 import pandas as pd
-import os, io, zipfile, uuid
+import os, zipfile, uuid
 from pathlib import Path
 from datetime import datetime
-import uuid
 from scripts.classes.dataclass import DataClass
 
 
-from database.serverHelper import append_to_main_dictionary, create_image_collection, create_session, create_timeseries, get_all_existing_keys, get_dictionary, pass_session_to_image_collections, update_dictionary
+from database.serverHelper import (
+    append_to_main_dictionary, create_image_collection, create_session, create_timeseries, ensure_indexes, get_all_existing_keys, get_dictionary,
+    pass_session_to_image_collections, stage_image_collection, stage_object, stage_print_job, stage_session, update_dictionary,
+)
 from interface.creatingSessions.object_pipeline import object_pipeline
 from interface.creatingSessions.print_job_pipeline import handle_gcode, print_job_pipeline
 
+# Finish session only stages the upload (raw bytes to GridFS, documents "queued") and
+# scripts/ingest_worker.py does the rest; BACKGROUND_INGEST=0 ingests inside the page instead
+BACKGROUND_INGEST = os.getenv("BACKGROUND_INGEST", "1") != "0"
+
 st.set_page_config(page_title="Quick Upload", layout="wide")
+ensure_indexes()
 st.title("File Upload (CSV/XLSX/zip/...)")
 
 files = None
@@ -37,6 +44,10 @@ if "print_job_buffer" not in ss:
     ss.print_job_buffer = None
 if "datasets_buffer" not in ss:
     ss.datasets_buffer = {}
+if "upload_hashes" not in ss:
+    ss.upload_hashes = {}  # uploaded file_id -> content hash
+if "processed_files" not in ss:
+    ss.processed_files = {}  # content hash -> process_file() result
 if "object_id" not in ss:
     ss.object_id = None
 if "printer_id" not in ss:
@@ -119,7 +130,7 @@ def finish_image_collections():
             st.error(f"Cannot create image collection {coll.get('name', '')!r}: invalid JSON metadata: {e}")
             continue
 
-        image_collection_id = create_image_collection(
+        image_collection_id = (stage_image_collection if BACKGROUND_INGEST else create_image_collection)(
             name=coll.get("name", f"Collection-{uuid.uuid4().hex[:6]}"),
             images=[DataClass(f) for f in coll.get("files", [])],
             metadata=metadata
@@ -133,15 +144,24 @@ def finish_session_upload():
     # if ss.cur_session is not None and printer_id is not None and printer_id.strip() != "":
     printer_id = printers_pipeline(ss.printer_id)
 
-    ss.object_id, file_ids = object_pipeline(st.session_state.file_buffer)
-
     print(printer_id)
 
-    ss.print_job_id, _ = print_job_pipeline(ss.print_job_buffer, printer_id=ss.printer_id, object_id=ss.object_id)
-    image_collections_ids = finish_image_collections()
+    if BACKGROUND_INGEST:
+        ss.object_id = stage_object(st.session_state.file_buffer)
+        ss.print_job_id = stage_print_job(ss.print_job_buffer, printer_id=ss.printer_id, object_id=ss.object_id) if ss.print_job_buffer is not None else None
+        image_collections_ids = finish_image_collections()
+        # Timeseries are made by the worker from the .h5 files among the raw files
+        session_id = stage_session(st.session_state.file_buffer, metadata=st.session_state.metadata_buffer, print_job_id=ss.print_job_id, image_collections_ids=image_collections_ids)
+        st.success(f"Session {ss.cur_session!r} with {len(st.session_state.file_buffer)} files staged; it is ingested in the background (scripts/ingest_worker.py).")
+    else:
+        ss.object_id, file_ids = object_pipeline(st.session_state.file_buffer)
+        ss.print_job_id, _ = print_job_pipeline(ss.print_job_buffer, printer_id=ss.printer_id, object_id=ss.object_id)
+        image_collections_ids = finish_image_collections()
 
-    session_id, _ = create_session(st.session_state.file_buffer, metadata=st.session_state.metadata_buffer, print_job_id=ss.print_job_id, timeseries=ss.datasets_buffer or {}, image_collections_ids=image_collections_ids)
-    st.write(f"Session {ss.cur_session!r} with {len(st.session_state.file_buffer)} files sent to server (simulated).")
+        # h5 datasets are parsed while uploading but only written here, once per session
+        timeseries = {name: create_timeseries(name, v) for name, v in ss.datasets_buffer.items()}
+        session_id, _ = create_session(st.session_state.file_buffer, metadata=st.session_state.metadata_buffer, print_job_id=ss.print_job_id, timeseries=timeseries, image_collections_ids=image_collections_ids)
+        st.write(f"Session {ss.cur_session!r} with {len(st.session_state.file_buffer)} files sent to server (simulated).")
 
     pass_session_to_image_collections(session_id, image_collections_ids)
 
@@ -151,6 +171,9 @@ def finish_session_upload():
 number_of_imagecollections = 0
 def clean_session_upload():
     ss.print_job_buffer = None
+    ss.datasets_buffer = {}
+    ss.upload_hashes = {}
+    ss.processed_files = {}
     reset_uploader()
     number_of_imagecollections = 0
 
@@ -290,12 +313,6 @@ if ss.cur_session is not None and ss.printer_id is not None and ss.printer_id.st
             if r.button("Reset uploader (clear files)", type="secondary", width='stretch'):
                 clean_session_upload()
 
-# Base save directory (optionally include session subdir)
-save_root = Path("uploads")
-# If you want to segregate by session, uncomment the next line:
-# save_root = save_root / (ss.cur_session or "default")
-save_root.mkdir(parents=True, exist_ok=True)
-
 def numeric_preview(df: pd.DataFrame):
     """Show a preview of numeric columns if any exist."""
     numeric_cols = df.select_dtypes(include="number").columns.tolist()
@@ -305,88 +322,98 @@ def numeric_preview(df: pd.DataFrame):
     else:
         st.info("No numeric columns found.")
 
-def handle_spreadsheet(file: DataClass, save_path: Path):
+def read_spreadsheet(file: DataClass):
     """
-    Read CSV/XLS(X) either from an UploadedFile or a filesystem Path.
-    Show a preview and numeric preview if applicable.
+    Read CSV/XLS(X) into a DataFrame; None for other files.
     """
     lower = file.name.lower()
 
-    df = None
+    with file.open() as f:
+        if lower.endswith(".csv"):
+            return pd.read_csv(f)
+        elif lower.endswith(".xlsx") or lower.endswith(".xls"):
+            return pd.read_excel(f)
+    return None
 
-    if lower.endswith(".csv"):
-        df = pd.read_csv(file)
-    elif lower.endswith(".xlsx") or lower.endswith(".xls"):
-        df = pd.read_excel(file)
+def show_spreadsheet(df: pd.DataFrame):
+    st.subheader("Data Preview")
+    st.dataframe(df.head(50), use_container_width=True)
+    numeric_preview(df)
 
-    if df is not None:
-        st.subheader("Data Preview")
-        st.dataframe(df.head(50), use_container_width=True)
-        numeric_preview(df)
-
-def handle_file(file: st.runtime.uploaded_file_manager.UploadedFile | Path):
+def process_file(dc: DataClass):
     """
-    Handle a single file (UploadedFile or Path).
-    For spreadsheets, show previews; for others, simply acknowledge.
+    Everything the upload needs from one file, as a list of entries (the file itself
+    and, for a zip, its members): {"file", "table", "datasets"}. Only parses, never
+    writes to the database, so it can be memoized by content hash across reruns.
     """
-    dc = DataClass(file) # dc = dataclass
-    st.success(f"File received: {dc.name}")
-
-    save_path = save_root / dc.name
-
     lower = dc.name.lower()
+    entries = []
+    table = None
+    datasets = None
     if lower.endswith((".csv", ".xlsx", ".xls")):
-        handle_spreadsheet(dc, save_path)
+        table = read_spreadsheet(dc)
     elif lower.endswith(".zip"):
-        handle_zip(dc)
-    elif lower.endswith(".gcode"):
-        ss.print_job_buffer = dc
-        st.info("G-code file received. Metadata will be extracted when finalizing the print job.")
-    elif lower.endswith(".h5"): 
-        datasets = extract_h5_datasets(dc)
-        ids = {}
-        for name, v in datasets.items():
-           if isinstance(v, np.ndarray):
-                ids[name] = create_timeseries(name, v)
-
-        # print(ids)
-        ss.datasets_buffer = ids
-
-    st.session_state.file_buffer.append(dc)
-    # try:
-    # except AttributeError:
-    #     # In case file is a Path
-    #     with open(file, "rb") as f:
-    #         # st.write(f.read())
-    #         st.session_state.file_buffer.append(f.read())
-
-    # print(len(st.session_state.file_buffer), "files in buffer")
-    # else:
-    #     st.write("No preview available for this file type.")
-
-def handle_zip(file: DataClass):
-    """
-    Extract a ZIP from an UploadedFile and call handle_file on each member.
-    """
-    if file.name.lower().endswith(".zip"):
-        with zipfile.ZipFile(io.BytesIO(file.bytes)) as zf:
-            for member in zf.infolist():
-                # Skip directories
-                if member.is_dir():
-                    continue
+        entries = process_zip(dc)
+    elif lower.endswith(".h5") and not BACKGROUND_INGEST:
+        # In the background the ingest worker reads the datasets from the stored .h5 file
+        datasets = {name: v for name, v in extract_h5_datasets(dc).items() if isinstance(v, np.ndarray)}
 
-                # Extract to a temp path preserving internal structure
-                extracted_path = Path("temp") / member.filename
-                extracted_path.parent.mkdir(parents=True, exist_ok=True)
-                with open(extracted_path, "wb") as f:
-                    f.write(zf.read(member))
+    return [{"file": dc, "table": table, "datasets": datasets}] + entries
 
-                # Process the extracted file
-                handle_file(extracted_path)
+def process_zip(file: DataClass):
+    """
+    Process each member of a ZIP, read straight from the archive (no extraction to disk).
+    """
+    entries = []
+    with file.open() as raw, zipfile.ZipFile(raw) as zf:
+        for member in zf.infolist():
+            # Skip directories
+            if member.is_dir():
+                continue
+            with zf.open(member) as src:
+                entries += process_file(DataClass(src, name=Path(member.filename).name))
+    return entries
+
+def show_entry(entry):
+    dc = entry["file"]
+    st.success(f"File received: {dc.name}")
+    if entry["table"] is not None:
+        show_spreadsheet(entry["table"])
+    elif dc.name.lower().endswith(".gcode"):
+        st.info("G-code file received. Metadata will be extracted when finalizing the print job.")
+    elif entry["datasets"] is not None:
+        st.info(f"h5 file received: {len(entry['datasets'])} datasets will be stored as timeseries when the session is ingested.")
+    elif dc.name.lower().endswith(".h5"):
+        st.info("h5 file received. Its datasets will be stored as timeseries when the session is ingested.")
 
 
 if ss.cur_session is not None and ss.printer_id is not None and ss.printer_id.strip() != "":
     with st.container():
+        # Each upload is hashed and processed once; reruns (any widget change) reuse the result.
+        # Files removed from the uploader drop out of the cache.
+        upload_hashes = {}
+        processed = {}
+        for file in files:
+            hash_id = ss.upload_hashes.get(file.file_id)
+            if hash_id is None:
+                dc = DataClass(file)
+                hash_id = dc.hash_id
+                if hash_id not in ss.processed_files:
+                    ss.processed_files[hash_id] = process_file(dc)
+            upload_hashes[file.file_id] = hash_id
+            processed[hash_id] = ss.processed_files[hash_id]
+        ss.upload_hashes = upload_hashes
+        ss.processed_files = processed
+
         st.session_state.file_buffer = []
+        ss.print_job_buffer = None
+        ss.datasets_buffer = {}
         for file in files:
-                handle_file(file)
+            for entry in processed[upload_hashes[file.file_id]]:
+                show_entry(entry)
+                dc = entry["file"]
+                if dc.name.lower().endswith(".gcode"):
+                    ss.print_job_buffer = dc
+                if entry["datasets"]:
+                    ss.datasets_buffer.update(entry["datasets"])
+                st.session_state.file_buffer.append(dc)
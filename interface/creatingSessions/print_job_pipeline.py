@@ -1,70 +1,12 @@
 from datetime import datetime
-from database.serverHelper import append_to_main_dictionary, create_print_job, check_print_job_exists, get_dictionary, update_dictionary
-import io
+from database.serverHelper import append_to_main_dictionary, create_print_job, check_print_job_exists, create_toolpath, get_dictionary, set_gcode_layer_index, update_dictionary
 from scripts.classes.dataclass import DataClass
+from scripts.gcode import iter_gcode_comment_lines
+from scripts.gcode_values import convert_value, is_time_str
+from scripts.toolpath import layer_byte_index, layer_statistics, parse_toolpath
 import streamlit as st
 import re
 
-def is_number(s):
-    try:
-        float(s)
-        return True
-    except ValueError:
-        return False
-
-def is_integer(s):
-    try:
-        int(s)
-        return True
-    except ValueError:
-        return False
-
-def is_percentage(s):
-    if s.endswith('%'):
-        try:
-            float(s[:-1])
-            return True
-        except ValueError:
-            return False
-    return False
-
-def is_json(s):
-    s = s.strip()
-    return (s.startswith('{') and s.endswith('}')) or (s.startswith('[') and s.endswith(']'))
-
-def is_time_str(v):
-    return isinstance(v, str) and re.search(r"\d+[hms]", v)
-
-def parse_time(v):
-    hours = minutes = seconds = 0
-    match_h = re.search(r"(\d+)h", v)
-    match_m = re.search(r"(\d+)m", v)
-    match_s = re.search(r"(\d+)s", v)
-    if match_h:
-        hours = int(match_h.group(1))
-    if match_m:
-        minutes = int(match_m.group(1))
-    if match_s:
-        seconds = int(match_s.group(1))
-    return hours * 3600 + minutes * 60 + seconds
-
-def convert_value(value):
-    if is_integer(value):
-        return int(value)
-    elif is_number(value):
-        return float(value)
-    elif is_percentage(value):
-        return float(value[:-1]) / 100.0
-    elif is_json(value):
-        import json
-        try:
-            return json.loads(value)
-        except json.JSONDecodeError:
-            return value
-    elif is_time_str(value):
-        return parse_time(value)
-    return value
-
 def is_prusaslicer(line):
     if line.startswith("; generated by PrusaSlicer"):
         return True
@@ -88,38 +30,40 @@ def handle_gcode(file):
     is_thumbnail = False
     first_line = True
 
-    with io.TextIOWrapper(io.BytesIO(file.bytes), encoding="ascii", errors="ignore") as f:
-        for line in f:
-            if first_line:
-                first_line = False
-                slicer = recognize_slicer(line)
-                info["Slicer"] = slicer
+    with file.open() as f:
+        lines = list(iter_gcode_comment_lines(f))
+
+    for line in lines:
+        if first_line:
+            first_line = False
+            slicer = recognize_slicer(line)
+            info["Slicer"] = slicer
 
 
-                if slicer == "PrusaSlicer":
-                    dt = get_date_from_prusaslicer(line)
-                    if dt is not None:
-                        info["Slicing Date (UTC)"] = dt.isoformat()
+            if slicer == "PrusaSlicer":
+                dt = get_date_from_prusaslicer(line)
+                if dt is not None:
+                    info["Slicing Date (UTC)"] = dt.isoformat()
 
 
-            if line.startswith("; thumbnail_QOI begin"):
-                is_thumbnail = True
-            if line.startswith("; thumbnail_QOI end"):
-                is_thumbnail = False
-            if is_thumbnail:
-                continue
+        if line.startswith("; thumbnail_QOI begin"):
+            is_thumbnail = True
+        if line.startswith("; thumbnail_QOI end"):
+            is_thumbnail = False
+        if is_thumbnail:
+            continue
 
 
-            line = line.strip()
-            if line.startswith(";") and "=" in line:
-                line = line[1:].strip()
-                key, value = line.split("=", 1)
-                key = key.strip()
-                value = value.strip()
-                if (is_time_str(value)): 
-                    key = key + " (seconds)"
-                info[key] = convert_value(value)
-                # info[key] = value
+        line = line.strip()
+        if line.startswith(";") and "=" in line:
+            line = line[1:].strip()
+            key, value = line.split("=", 1)
+            key = key.strip()
+            value = value.strip()
+            if (is_time_str(value)): 
+                key = key + " (seconds)"
+            info[key] = convert_value(value)
+            # info[key] = value
 
 
     # st.subheader("G-code Metadata")
@@ -149,11 +93,30 @@ def transform_info_keys(info, printer_name, slicer):
     print(new_info)
     return new_info
 
+def process_gcode(file_data: DataClass, printer_id=None, new_id=None):
+    # Everything a print job gets from its G-code: (extracted metadata, toolpath timeseries ids, layer byte index).
+    # Shared by print_job_pipeline and the ingest worker (scripts/ingest_worker.py); new_id, see create_toolpath
+    extracted_data = {}
+    info = handle_gcode(file_data)
+
+    printer_name = printer_id or ""
+    slicer = info.get("Slicer")
+
+    info = transform_info_keys(info, printer_name, slicer)
+
+    extracted_data.update(info)
+
+    # Keep the moves as columnar timeseries so they don't need to be re-parsed later
+    with file_data.mapped() as buf:
+        toolpath = parse_toolpath(buf)
+        layer_index = layer_byte_index(buf, toolpath)
+    extracted_data["layer_statistics"] = layer_statistics(toolpath)
+    toolpath_ids = create_toolpath(toolpath, new_id)
+    return extracted_data, toolpath_ids, layer_index
+
 def print_job_pipeline(file_data: DataClass, printer_id=None, object_id=None): 
     # file_datas is a list of file-like objects
     # At this moment, we will consider that the only file is a G-code file
-    extracted_data = {}
-
     existing = None
     if file_data is not None:
         existing = check_print_job_exists(printer_id, object_id, [file_data])
@@ -161,15 +124,11 @@ def print_job_pipeline(file_data: DataClass, printer_id=None, object_id=None):
         return existing["_id"], existing.get("artifacts", {}).get("file_ids", [])
 
     if file_data is not None:
-        info = handle_gcode(file_data)
-
-        printer_name = printer_id or ""
-        slicer = info.get("Slicer")
-
-        info = transform_info_keys(info, printer_name, slicer)
+        extracted_data, toolpath_ids, layer_index = process_gcode(file_data, printer_id)
 
-        extracted_data.update(info)
+        object_id, file_ids = create_print_job([file_data], printer_id, object_id, extracted_data, toolpath=toolpath_ids)
 
-        object_id, file_ids = create_print_job([file_data], printer_id, object_id, extracted_data)
+        # Lets single layers be fetched from GridFS without downloading the whole file
+        set_gcode_layer_index(file_ids[0], layer_index)
         return object_id, file_ids
-    return None, []
\ No newline at end of file
+    return None, []
@@ -1,16 +1,76 @@
+import os
+import requests
 import streamlit as st
 
-from database.serverHelper import download_files_zip, get_all_sessions
+from database.serverHelper import (
+    SESSION_PAGE_SIZE, download_files_zip, ensure_indexes, get_image_collection_image_ids, get_image_preview, get_ingest_overview,
+    get_session_file_ids, get_session_with_embedded_info, list_sessions,
+)
 
+ensure_indexes()
 st.title("Sessions")
 
-sessions = get_all_sessions()
+PREVIEW_COLUMNS = 6
+PREVIEW_SIZE = 160
+# ZIP downloads stream from the REST server (api/restapi/server_restapi.py) straight to the browser.
+# When this app can't reach it, the ZIP is built here instead, in memory, on request.
+RESTAPI_URL = os.getenv("RESTAPI_URL", "http://localhost:8000")
 
-for s in sessions:
-    sid = str(s.get("_id", ""))
-    n_files = len(s.get("raw_files", {}).get("file_ids", []))
-    with st.expander(f"{sid} • raw_files: {n_files}"):
-        st.json(s)
-        if st.button("Generate ZIP", key=f"zip_{sid}"):
-            zip_bytes = download_files_zip(s.get("raw_files", {}).get("file_ids", []))
-            st.download_button("Download files", data=zip_bytes, file_name="files.zip", mime="application/zip", key=f"download_{sid}")
\ No newline at end of file
+@st.cache_data(ttl=30, show_spinner=False)
+def restapi_reachable():
+    # Any HTTP answer will do; only a refused or timed out connection counts as down
+    try:
+        requests.get(RESTAPI_URL, timeout=1)
+        return True
+    except requests.RequestException:
+        return False
+
+# Keyset pagination: the "after" cursor of every page visited so far, so Previous can go back
+if "page_cursors" not in st.session_state:
+    st.session_state.page_cursors = [None]
+cursors = st.session_state.page_cursors
+
+try:
+    page = list_sessions(after=cursors[-1], limit=SESSION_PAGE_SIZE)
+except ValueError:
+    # The session the page started after was deleted: back to the first page
+    cursors[:] = [None]
+    page = list_sessions(limit=SESSION_PAGE_SIZE)
+
+# Uploads staged for scripts/ingest_worker.py that aren't ingested yet
+pending = {coll: counts for coll, counts in get_ingest_overview().items() if counts}
+if pending:
+    st.info("Background ingestion: " + "; ".join(f"{coll} " + ", ".join(f"{n} {status}" for status, n in counts.items()) for coll, counts in pending.items()))
+
+first = (len(cursors) - 1) * SESSION_PAGE_SIZE
+st.caption(f"Sessions {first + 1 if page['sessions'] else 0}–{first + len(page['sessions'])} of {page['total']}")
+prev_col, next_col = st.columns(2)
+prev_col.button("Previous", disabled=len(cursors) == 1, on_click=cursors.pop)
+next_col.button("Next", disabled=page["next"] is None, on_click=cursors.append, args=(page["next"],))
+
+for s in page["sessions"]:
+    sid = str(s["_id"])
+    n_files = s.get("n_files", 0)
+    with st.expander(f"{sid} • {s.get('status')} • raw_files: {n_files}"):
+        ingest = s.get("ingest") or {}
+        if s.get("status") == "ingesting" and ingest.get("progress"):
+            p = ingest["progress"]
+            st.progress(p["done"] / max(p["total"], 1), text=f"{p['message']} ({p['done']}/{p['total']}) on {ingest['worker']}")
+        elif s.get("status") == "failed" and ingest.get("error"):
+            st.error("Ingestion failed")
+            st.code(ingest["error"])
+        if n_files and restapi_reachable():
+            st.link_button("Download files (ZIP)", f"{RESTAPI_URL}/session_files_zip/{sid}")
+        elif n_files and st.toggle("Build files ZIP", key=f"zip_{sid}", help=f"The REST server at {RESTAPI_URL} is unreachable"):
+            st.download_button("Download files (ZIP)", download_files_zip(get_session_file_ids(sid)), file_name=f"session_{sid}.zip", mime="application/zip")
+        # Expander bodies run even when collapsed, so the full session is only fetched on request
+        if not st.toggle("Show details", key=f"details_{sid}"):
+            continue
+        st.json(get_session_with_embedded_info(sid, summary=True))
+        image_ids = get_image_collection_image_ids(s.get("image_collections", []))
+        if image_ids and st.checkbox(f"Show {len(image_ids)} image previews", key=f"previews_{sid}"):
+            cols = st.columns(PREVIEW_COLUMNS)
+            for i, image_id in enumerate(image_ids):
+                preview = get_image_preview(image_id, PREVIEW_SIZE)
+                if preview is not None:
+                    cols[i % PREVIEW_COLUMNS].image(preview[0], width=PREVIEW_SIZE)
@@ -3,12 +3,13 @@ import pandas as pd
 import os, io, zipfile, uuid
 from pathlib import Path
 from datetime import datetime
-from database.serverHelper import create_script
+from database.serverHelper import create_script, ensure_indexes
 import uuid
 
 from scripts.classes.dataclass import DataClass
 
 st.set_page_config(page_title="Quick Upload", layout="wide")
+ensure_indexes()
 st.title("Script Upload")
 
 files = None
@@ -0,0 +1,109 @@
+import json
+import math
+import re
+import sys
+import time
+from pathlib import Path
+
+from scripts.gcode import iter_gcode_comment_lines
+from scripts.gcode_values import _convert_cached, convert_value
+
+# Run from the project root:
+# PYTHONPATH=(...) python3 scripts/benchmarks/bench_convert_value.py [file.gcode ...]
+
+DEFAULT_FILES = [
+    "data/test_gcodes/Keychain_Dual_Color_QOI_0.4n_0.2mm_PLA_COREONE_9m.gcode",
+    "data/diff_slicers/slicerfiles/Korper1_0.4n_0.2mm_PLA_MK4_1h43m.gcode",
+    "data/diff_slicers/slicerfiles/Korper1_PLA_50m46s.gcode",
+]
+JOBS = 100  # simulated batch: every file's config converted this many times
+
+
+def legacy_convert_value(value):
+    # The previous converter from print_job_pipeline.py: up to five probes per value
+    def is_number(s):
+        try:
+            float(s)
+            return True
+        except ValueError:
+            return False
+    def is_integer(s):
+        try:
+            int(s)
+            return True
+        except ValueError:
+            return False
+    def is_percentage(s):
+        if s.endswith('%'):
+            try:
+                float(s[:-1])
+                return True
+            except ValueError:
+                return False
+        return False
+    def is_json(s):
+        s = s.strip()
+        return (s.startswith('{') and s.endswith('}')) or (s.startswith('[') and s.endswith(']'))
+    def parse_time(v):
+        h = re.search(r"(\d+)h", v)
+        m = re.search(r"(\d+)m", v)
+        s = re.search(r"(\d+)s", v)
+        return (int(h.group(1)) if h else 0) * 3600 + (int(m.group(1)) if m else 0) * 60 + (int(s.group(1)) if s else 0)
+
+    if is_integer(value):
+        return int(value)
+    elif is_number(value):
+        return float(value)
+    elif is_percentage(value):
+        return float(value[:-1]) / 100.0
+    elif is_json(value):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    elif isinstance(value, str) and re.search(r"\d+[hms]", value):
+        return parse_time(value)
+    return value
+
+def raw_values(path):
+    values = []
+    for line in iter_gcode_comment_lines(Path(path)):
+        line = line.strip()
+        if line.startswith(";") and "=" in line:
+            values.append(line[1:].split("=", 1)[1].strip())
+    return values
+
+def same(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return type(a) == type(b) and a == b
+
+
+if __name__ == "__main__":
+    files = sys.argv[1:] or DEFAULT_FILES
+    values = [v for path in files for v in raw_values(path)]
+    extra = ["1_000", " 7 ", "inf", "-nan", "5 %", "1e3%", ".5", "5.", "+3", "{bad}", "[1, 2]", "9m 15s", "0.4mm", "", "-", "."]
+    mismatches = [v for v in values + extra if not same(legacy_convert_value(v), convert_value(v))]
+    print(f"{len(values)} values from {len(files)} files, mismatches: {mismatches}")
+
+    batch = values * JOBS
+    t = time.perf_counter()
+    for v in batch:
+        legacy_convert_value(v)
+    t_legacy = time.perf_counter() - t
+
+    _convert_cached.cache_clear()
+    t = time.perf_counter()
+    for v in values:
+        convert_value(v)
+    t_cold = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for v in batch:
+        convert_value(v)
+    t_batch = time.perf_counter() - t
+
+    n = len(batch)
+    print(f"legacy probes:        {t_legacy / n * 1e6:6.2f} us/value")
+    print(f"dispatch, cold cache: {t_cold / len(values) * 1e6:6.2f} us/value  ({t_legacy / n / (t_cold / len(values)):.1f}x)")
+    print(f"dispatch, {JOBS} jobs:  {t_batch / n * 1e6:6.2f} us/value  ({t_legacy / t_batch:.1f}x)")
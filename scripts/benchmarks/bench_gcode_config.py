@@ -0,0 +1,68 @@
+import io
+import sys
+import time
+from pathlib import Path
+
+from scripts.gcode import convert_value, extract_gcode, read_gcode_blocks
+
+# Run from the project root:
+# PYTHONPATH=(...) python3 scripts/benchmarks/bench_gcode_config.py [file.gcode ...]
+
+DEFAULT_FILES = [
+    "data/test_gcodes/Keychain_Dual_Color_QOI_0.4n_0.2mm_PLA_COREONE_9m.gcode",
+    "data/diff_slicers/slicerfiles/Korper1_0.4n_0.2mm_PLA_MK4_1h43m.gcode",
+    "data/diff_slicers/slicerfiles/Korper1_PLA_50m46s.gcode",
+]
+REPEATS = 5
+
+
+def full_pass_extract(file_path):
+    # The previous implementation: decodes and strips every line of the file
+    info = {}
+    is_thumbnail = False
+    with open(file_path, "r", encoding="ascii", errors="ignore") as f:
+        for line in f:
+            if line.startswith("; thumbnail_QOI begin"):
+                is_thumbnail = True
+            if line.startswith("; thumbnail_QOI end"):
+                is_thumbnail = False
+            if is_thumbnail:
+                continue
+            line = line.strip()
+            if line.startswith(";") and "=" in line:
+                key, value = line[1:].strip().split("=", 1)
+                info[key.strip()] = convert_value(value.strip(), times=False)
+    return info
+
+def best_of(fn, *args):
+    best = float("inf")
+    for _ in range(REPEATS):
+        t = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+if __name__ == "__main__":
+    files = sys.argv[1:] or DEFAULT_FILES
+    for path in files:
+        path = Path(path)
+        data = path.read_bytes()
+
+        t_full = best_of(full_pass_extract, path)
+        t_seek = best_of(extract_gcode, path)
+        t_stream = best_of(lambda: read_gcode_blocks(io.BytesIO(data)))
+
+        old = full_pass_extract(path)
+        new = extract_gcode(path)
+        head, tail = read_gcode_blocks(path)
+
+        print(f"=== {path.name} ({len(data) / 1e6:.2f} MB) ===")
+        print(f"  bytes read:          {len(head) + len(tail)} of {len(data)}")
+        print(f"  full pass:           {t_full * 1000:8.2f} ms")
+        print(f"  seek-based (mmap):   {t_seek * 1000:8.2f} ms  ({t_full / t_seek:.1f}x)")
+        print(f"  blocks from stream:  {t_stream * 1000:8.2f} ms")
+        print(f"  same dict:           {old == new}")
+        missing = [k for k in old if k not in new]
+        if missing:
+            print(f"  keys only inside the motion body: {missing}")
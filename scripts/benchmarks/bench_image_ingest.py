@@ -0,0 +1,64 @@
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from scripts.classes.dataclass import DataClass
+from scripts.imageprocessing import PNG_COMPRESS_LEVEL, PNG_OPTIMIZE, prepare_image
+
+# Measures the CPU-bound half of image ingestion (JPEG -> PNG + metadata): PNG encoder
+# settings, then serial vs process pool.
+# Run from the project root:
+# PYTHONPATH=(...) python3 scripts/benchmarks/bench_image_ingest.py [n_images] [width] [height]
+
+N_IMAGES = 240
+WIDTH, HEIGHT = 1280, 960
+
+
+def synthetic_jpegs(n, width, height):
+    # Smooth gradients plus noise, so the PNG encoder has realistic work to do
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width]
+    images = []
+    for i in range(n):
+        base = ((xx * (i + 1) + yy) % 256).astype(np.uint8)
+        rgb = np.stack([base, base[::-1], base[:, ::-1]], axis=-1)
+        rgb = np.clip(rgb + rng.integers(0, 16, rgb.shape), 0, 255).astype(np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(rgb).save(buf, format="JPEG", quality=90)
+        images.append(DataClass(buf.getvalue(), mime_type="image/jpeg", name=f"frame_{i:04d}.jpg"))
+    return images
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else N_IMAGES
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else WIDTH
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else HEIGHT
+    images = synthetic_jpegs(n, width, height)
+    print(f"{n} JPEGs of {width}x{height}, {os.cpu_count()} cores")
+
+    for compress_level, optimize in [(1, False), (PNG_COMPRESS_LEVEL, PNG_OPTIMIZE), (9, True)]:
+        sample = images[:16]
+        t = time.perf_counter()
+        size = sum(png.size for png, _, _, _ in (prepare_image(image, compress_level, optimize) for image in sample))
+        t_setting = time.perf_counter() - t
+        print(f"compress_level={compress_level} optimize={optimize!s:5}: {t_setting / len(sample) * 1e3:7.1f} ms/image, {size / len(sample) / 1024:8.1f} KiB/image")
+
+    t = time.perf_counter()
+    serial = [prepare_image(image) for image in images]
+    t_serial = time.perf_counter() - t
+    print(f"serial:       {t_serial:7.2f} s")
+
+    workers = 2
+    while workers <= (os.cpu_count() or 1):
+        t = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parallel = list(pool.map(prepare_image, images, chunksize=4))
+        t_parallel = time.perf_counter() - t
+        assert [p.hash_id for p, *_ in parallel] == [p.hash_id for p, *_ in serial]
+        print(f"{workers:2d} processes: {t_parallel:7.2f} s  ({t_serial / t_parallel:.1f}x)")
+        workers *= 2
@@ -0,0 +1,81 @@
+import datetime
+import json
+import sys
+import time
+
+import numpy as np
+from bson import Binary, ObjectId, json_util
+from fastapi.responses import JSONResponse
+
+from api.restapi.bson_json import dumps, iter_dumps
+
+# Encoding cost of a /get_session response with large timeseries: the previous
+# json_util.dumps -> json.loads -> JSONResponse path against api/restapi/bson_json.py.
+# Run from the project root:
+# PYTHONPATH=(...) python3 scripts/benchmarks/bench_session_json.py [timeseries_len] [n_images]
+
+TIMESERIES_LEN = 1_000_000
+N_IMAGES = 120
+RUNS = 3
+
+
+def synthetic_session(ts_len, n_images):
+    rng = np.random.default_rng(0)
+    now = datetime.datetime(2025, 1, 1, 12, 0, 0)
+    images = [{
+        "_id": ObjectId(),
+        "name": f"layer_{i}.png",
+        "inserted_at": now,
+        "file_id": ObjectId(),
+        "hash_id": "%064x" % i,
+        "metadata": {"original_format": "PNG", "width": 1920, "height": 1080, "dpi": [72.0, 72.0], "exif": {"MakerNote": Binary(bytes(64))}},
+    } for i in range(n_images)]
+    timeseries = {}
+    for name in ["nozzle_temp", "bed_temp", "fan"]:
+        data = rng.random(ts_len) * 250
+        timeseries[name] = {"_id": ObjectId(), "name": name, "inserted_at": now, "dtype": "<f8", "shape": [ts_len], "data": data.tolist()}
+    return {
+        "_id": ObjectId(),
+        "inserted_at": now,
+        "status": "ingested",
+        "raw_files": {"file_ids": [ObjectId() for _ in range(5)]},
+        "print_job_info": {"_id": ObjectId(), "metadata": {f"key_{i}": i * 0.5 for i in range(500)}},
+        "image_collections_info": [{"_id": ObjectId(), "name": "layers", "images_info": images}],
+        "timeseries": {name: ts["_id"] for name, ts in timeseries.items()},
+        "timeseries_info": timeseries,
+    }
+
+
+def legacy_encode(doc):
+    return JSONResponse(content=json.loads(json_util.dumps(doc))).body
+
+
+def best_of(fn, doc):
+    times = []
+    for _ in range(RUNS):
+        t = time.perf_counter()
+        out = fn(doc)
+        times.append(time.perf_counter() - t)
+    return min(times), out
+
+
+if __name__ == "__main__":
+    ts_len = int(sys.argv[1]) if len(sys.argv) > 1 else TIMESERIES_LEN
+    n_images = int(sys.argv[2]) if len(sys.argv) > 2 else N_IMAGES
+    as_lists = synthetic_session(ts_len, n_images)
+    # What get_session_with_embedded_info(..., as_arrays=True) returns
+    as_arrays = {**as_lists, "timeseries_info": {
+        name: {**ts, "data": np.asarray(ts["data"])} for name, ts in as_lists["timeseries_info"].items()
+    }}
+
+    t_legacy, reference = best_of(legacy_encode, as_lists)
+    print(f"3 timeseries x {ts_len} samples, {n_images} images, {len(reference) / 1e6:.1f} MB of JSON")
+    print(f"json_util + loads + JSONResponse: {t_legacy:7.3f} s")
+    for label, fn, doc in [
+        ("bson_json.dumps, lists", dumps, as_lists),
+        ("bson_json.dumps, NumPy", dumps, as_arrays),
+        ("bson_json.iter_dumps, NumPy", lambda d: b"".join(iter_dumps(d)), as_arrays),
+    ]:
+        t, out = best_of(fn, doc)
+        assert out == reference
+        print(f"{label:32s}: {t:7.3f} s  ({t_legacy / t:.1f}x)")
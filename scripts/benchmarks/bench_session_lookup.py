@@ -0,0 +1,90 @@
+import io
+import statistics
+import sys
+import time
+
+import gridfs
+import numpy as np
+from PIL import Image
+from pymongo import MongoClient, monitoring
+
+import database.serverHelper as sh
+from scripts.classes.dataclass import DataClass
+
+# Compares get_session_with_embedded_info (one $lookup aggregation) with the previous
+# one-query-per-collection resolution: server round trips and latency per call.
+# Needs a running MongoDB (MONGODB_URI); works in a scratch database that is dropped afterwards.
+# Run from the project root:
+# PYTHONPATH=(...) python3 scripts/benchmarks/bench_session_lookup.py [n_images] [timeseries_len] [runs]
+
+BENCH_DB = "bench_session_lookup"
+N_IMAGES = 60
+TIMESERIES_LEN = 100_000
+RUNS = 50
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def seed_session(n_images, ts_len):
+    printer_id = sh.create_printer("bench-printer")
+    object_id, _ = sh.create_object([DataClass(b"solid bench", mime_type="model/stl", name="bench.stl")], {})
+    job_id, _ = sh.create_print_job([DataClass(b"G1 X1 Y1\n", mime_type="text/x-gcode", name="bench.gcode")], printer_id=printer_id, object_id=object_id)
+
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(n_images):
+        buf = io.BytesIO()
+        Image.fromarray(rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)).save(buf, format="PNG")
+        images.append(DataClass(buf.getvalue(), mime_type="image/png", name=f"layer_{i}.png"))
+    half = n_images // 2
+    collections = [sh.create_image_collection("a", images[:half], parallel=False), sh.create_image_collection("b", images[half:], parallel=False)]
+
+    timeseries = {name: sh.create_timeseries(name, rng.random(ts_len)) for name in ["nozzle_temp", "bed_temp", "fan"]}
+    session_id, _ = sh.create_session([DataClass(b"raw", name="raw.txt")], print_job_id=job_id, timeseries=timeseries, image_collections_ids=collections)
+    return session_id
+
+
+def measure(fn, session_id, counter, runs):
+    fn(session_id)  # warm up
+    counter.count = 0
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        fn(session_id)
+        times.append(time.perf_counter() - t)
+    return counter.count / runs, times
+
+
+if __name__ == "__main__":
+    n_images = int(sys.argv[1]) if len(sys.argv) > 1 else N_IMAGES
+    ts_len = int(sys.argv[2]) if len(sys.argv) > 2 else TIMESERIES_LEN
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else RUNS
+
+    counter = CommandCounter()
+    client = MongoClient(sh.MONGODB_URI, event_listeners=[counter])
+    client.drop_database(BENCH_DB)
+    sh.db = client[BENCH_DB]
+    sh.fs = gridfs.GridFS(sh.db)
+    try:
+        sh.ensure_indexes(force=True)
+        session_id = seed_session(n_images, ts_len)
+        assert sh.get_session_with_embedded_info(session_id) == sh.get_session_with_embedded_info_sequential(session_id)
+
+        print(f"session with {n_images} images, 3 timeseries of {ts_len} samples, {runs} runs")
+        for label, fn in [("sequential queries", sh.get_session_with_embedded_info_sequential), ("$lookup aggregation", sh.get_session_with_embedded_info)]:
+            round_trips, times = measure(fn, session_id, counter, runs)
+            print(f"{label:20s}: {round_trips:4.1f} round trips, mean {statistics.mean(times) * 1e3:7.2f} ms, p50 {statistics.median(times) * 1e3:7.2f} ms")
+    finally:
+        client.drop_database(BENCH_DB)
@@ -0,0 +1,82 @@
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import database.serverHelper as sh
+
+# Requests per second and latency percentiles of the REST API under concurrent clients.
+# Each client is a thread with its own keep-alive connection sending requests back to back
+# for DURATION seconds, cycling through the sessions found in the local MongoDB.
+# Start the server first (see api/restapi/server_restapi.py), then from the project root:
+# PYTHONPATH=(...) python3 scripts/benchmarks/load_test_restapi.py [base_url] [concurrency,...] [seconds] [path]
+# e.g. ... load_test_restapi.py http://localhost:8000 1,8,32,128 20 "/get_session/{session_id}?summary=true"
+
+BASE_URL = "http://localhost:8000"
+CONCURRENCY = [1, 8, 32, 128]
+DURATION = 20
+PATH = "/get_session/{session_id}?summary=true"
+MAX_SESSIONS = 1000
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def client(url_list, offset, deadline, latencies, errors, lock):
+    local, failed = [], 0
+    with requests.Session() as http:
+        i = offset
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            try:
+                r = http.get(url_list[i % len(url_list)], timeout=60)
+                r.content
+                ok = r.status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - t)
+            else:
+                failed += 1
+            i += 1
+    with lock:
+        latencies.extend(local)
+        errors[0] += failed
+
+
+def run(url_list, concurrency, duration):
+    latencies, errors, lock = [], [0], threading.Lock()
+    deadline = time.perf_counter() + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for c in range(concurrency):
+            pool.submit(client, url_list, c * 7, deadline, latencies, errors, lock)
+    return sorted(latencies), errors[0]
+
+
+if __name__ == "__main__":
+    base_url = sys.argv[1] if len(sys.argv) > 1 else BASE_URL
+    levels = [int(c) for c in sys.argv[2].split(",")] if len(sys.argv) > 2 else CONCURRENCY
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else DURATION
+    path = sys.argv[4] if len(sys.argv) > 4 else PATH
+
+    session_ids = [s["_id"] for s in sh.db["print_sessions"].find({}, {"_id": 1}).limit(MAX_SESSIONS)]
+    if not session_ids:
+        sys.exit(f"No sessions in {sh.DB_NAME} at {sh.MONGODB_URI}, upload some first.")
+    url_list = [base_url.rstrip("/") + path.format(session_id=sid) for sid in session_ids]
+    requests.get(url_list[0], timeout=60).raise_for_status()  # fail early if the server isn't up
+
+    print(f"{base_url}{path}, {len(session_ids)} sessions, {duration:.0f} s per level")
+    for concurrency in levels:
+        latencies, errors = run(url_list, concurrency, duration)
+        if not latencies:
+            print(f"{concurrency:4d} clients: no successful requests ({errors} errors)")
+            continue
+        print(
+            f"{concurrency:4d} clients: {len(latencies) / duration:8.1f} req/s, "
+            f"p50 {statistics.median(latencies) * 1e3:7.1f} ms, p99 {percentile(latencies, 0.99) * 1e3:7.1f} ms, "
+            f"max {latencies[-1] * 1e3:7.1f} ms, {errors} errors"
+        )
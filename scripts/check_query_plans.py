@@ -0,0 +1,12 @@
+from database.serverHelper import ensure_indexes, verify_query_plans
+
+# Creates the indexes and fails if a hot query still scans a whole collection.
+# PYTHONPATH=(...) python3 scripts/check_query_plans.py
+
+if __name__ == "__main__":
+    failed = ensure_indexes(force=True)
+    if failed:
+        raise SystemExit(f"Indexes that could not be created: {failed}")
+    for name, stages in verify_query_plans().items():
+        print(f"{name}: {' <- '.join(stages)}")
+    print("All hot queries use an index.")
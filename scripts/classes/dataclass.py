@@ -1,31 +1,105 @@
+import io
 import mimetypes
+import mmap
+import os
+import tempfile
+import weakref
+from contextlib import contextmanager
 from pathlib import Path
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 import hashlib
 
+CHUNK_SIZE = 1024 * 1024
+SPILL_THRESHOLD = 32 * 1024 * 1024  # streamed payloads above this go to a temp file
+
+
 class DataClass:
-    def __init__(self, data: UploadedFile | Path | bytes, mime_type: str = None, name: str = None):
+    # The payload is hashed while it streams in and is kept in one place only:
+    # the caller's bytes / UploadedFile buffer, the source Path, or a temp file
+    # for large streams. Use open() or mapped() to read it; .bytes materializes it.
+
+    def __init__(self, data: UploadedFile | Path | bytes | io.IOBase, mime_type: str = None, name: str = None, spill_threshold: int = SPILL_THRESHOLD):
+        self._data = None  # in-memory payload
+        self._path = None  # file-backed payload
+
         if type(data) == UploadedFile:
             self.name = name or data.name
             self.type = data.type
             self.size = data.size
-            self.bytes = data.read()
-            self.hash_id = hashlib.sha256(self.bytes).hexdigest()
+            # UploadedFile is already a BytesIO: share its buffer instead of copying it
+            self._data = data.getvalue()
+            self.hash_id = hashlib.sha256(self._data).hexdigest()
         elif isinstance(data, Path):
             self.name = name or data.name
             self.type = mimetypes.guess_type(data.name)[0] or "application/octet-stream"
             self.size = data.stat().st_size
+            self._path = data
             with open(data, "rb") as f:
-                self.bytes = f.read()
-
-            self.hash_id = hashlib.sha256(self.bytes).hexdigest()
+                self.hash_id = self._hash_stream(f)
         elif type(data) == bytes:
             self.name = name or "unknown"
             self.type = mime_type or "application/octet-stream"
             self.size = len(data)
-            self.bytes = data
-            self.hash_id = hashlib.sha256(self.bytes).hexdigest()
+            self._data = data
+            self.hash_id = hashlib.sha256(self._data).hexdigest()
+        elif hasattr(data, "read"):
+            # Any binary stream, e.g. a zip member or a GridFS file
+            self.name = name or getattr(data, "name", None) or getattr(data, "filename", None) or "unknown"
+            self.type = mime_type or mimetypes.guess_type(self.name)[0] or "application/octet-stream"
+            self.hash_id = self._spool(data, spill_threshold)
         else:
-            raise ValueError("Data must be an UploadedFile or Path or bytes")
+            raise ValueError("Data must be an UploadedFile or Path or bytes or a binary stream")
+
+    def _hash_stream(self, f):
+        h = hashlib.sha256()
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+        return h.hexdigest()
+
+    def _spool(self, stream, spill_threshold):
+        h = hashlib.sha256()
+        buffer = io.BytesIO()
+        spill = None
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+            if spill is None and buffer.tell() + len(chunk) > spill_threshold:
+                fd, tmp = tempfile.mkstemp(prefix="dataclass-")
+                spill = os.fdopen(fd, "wb")
+                spill.write(buffer.getbuffer())
+                buffer = None
+                self._path = Path(tmp)
+                weakref.finalize(self, os.unlink, tmp)
+            (spill or buffer).write(chunk)
+
+        if spill is not None:
+            spill.close()
+            self.size = self._path.stat().st_size
+        else:
+            self._data = buffer.getvalue()
+            self.size = len(self._data)
+        return h.hexdigest()
+
+    def open(self):
+        """Return a new binary, seekable reader positioned at the start of the payload."""
+        if self._path is not None:
+            return open(self._path, "rb")
+        return io.BytesIO(self._data)
+
+    @contextmanager
+    def mapped(self):
+        """Bytes-like view of the payload (an mmap for file-backed data), for find/slice style parsing."""
+        if self._path is None:
+            yield self._data
+            return
+        if self.size == 0:
+            yield b""
+            return
+        with open(self._path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
 
-    
\ No newline at end of file
+    @property
+    def bytes(self):
+        # Materializes file-backed payloads; prefer open()/mapped() for large files
+        if self._path is not None:
+            return self._path.read_bytes()
+        return bytes(self._data)
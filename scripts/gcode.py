@@ -1,70 +1,109 @@
+import mmap
+import os
+from pathlib import Path
 from tabulate import tabulate
-
-def is_number(s):
-    try:
-        float(s)
-        return True
-    except ValueError:
-        return False
-
-def is_integer(s):
-    try:
-        int(s)
-        return True
-    except ValueError:
-        return False
-
-def is_percentage(s):
-    if s.endswith('%'):
-        try:
-            float(s[:-1])
-            return True
-        except ValueError:
-            return False
-    return False
-
-def is_json(s):
-    s = s.strip()
-    return (s.startswith('{') and s.endswith('}')) or (s.startswith('[') and s.endswith(']'))
-
-def convert_value(value):
-    if is_integer(value):
-        return int(value)
-    elif is_number(value):
-        return float(value)
-    elif is_percentage(value):
-        return float(value[:-1]) / 100.0
-    elif is_json(value):
-        import json
-        try:
-            return json.loads(value)
-        except json.JSONDecodeError:
-            return value
-    return value
+from scripts.gcode_values import convert_value
+
+# ========= Seek-based block reading =========
+# Slicers write the metadata as "; key = value" comments before the first move
+# (header, thumbnails, Orca's CONFIG_BLOCK) and after the last move (PrusaSlicer's
+# prusaslicer_config block). The motion body in between is only ever searched
+# from its two ends, so its G0/G1 lines are never decoded.
+
+GCODE_MOTION_TOKENS = (b"\nG0 ", b"\nG1 ")
+GCODE_READ_CHUNK = 64 * 1024
+
+
+def _first_motion(buf, start=0):
+    hits = [buf.find(t, start) for t in GCODE_MOTION_TOKENS]
+    hits = [h for h in hits if h != -1]
+    return min(hits) + 1 if hits else -1
+
+def _last_motion(buf, start=0):
+    last = max(buf.rfind(t, start) for t in GCODE_MOTION_TOKENS)
+    return last + 1 if last != -1 else -1
+
+def _split_buffer(buf):
+    first = _first_motion(buf)
+    if first == -1:
+        return bytes(buf), b""
+    last = _last_motion(buf, first - 1)
+    tail_start = buf.find(b"\n", last)
+    tail_start = len(buf) if tail_start == -1 else tail_start + 1
+    return bytes(buf[:first]), bytes(buf[tail_start:])
+
+def _split_stream(f):
+    # Works on anything with seek/read, e.g. open files or GridOut
+    f.seek(0)
+    head = b""
+    first = -1
+    while first == -1:
+        chunk = f.read(GCODE_READ_CHUNK)
+        if not chunk:
+            return head, b""
+        searched = max(len(head) - 4, 0)
+        head += chunk
+        first = _first_motion(head, searched)
+    head_end = first
+    head = head[:first]
+
+    size = f.seek(0, os.SEEK_END)
+    window = GCODE_READ_CHUNK
+    while True:
+        start = max(size - window, head_end)
+        f.seek(start)
+        tail = f.read(size - start)
+        last = _last_motion(tail)
+        if last != -1 or start == head_end:
+            break
+        window *= 2
+    if last == -1:
+        # The only move is the one that ended the header
+        last = 0
+    tail_start = tail.find(b"\n", last)
+    return head, (tail[tail_start + 1:] if tail_start != -1 else b"")
+
+def read_gcode_blocks(source) -> tuple[bytes, bytes]:
+    """
+    Return the (header, trailer) bytes of a G-code file without reading the moves.
+    source can be a path, bytes/bytearray/memoryview/mmap, or a seekable binary stream.
+    """
+    if isinstance(source, (str, Path)):
+        with open(source, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b"", b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _split_buffer(mm)
+    if isinstance(source, (bytes, bytearray, mmap.mmap)):
+        return _split_buffer(source)
+    if isinstance(source, memoryview):
+        return _split_buffer(source.tobytes())
+    return _split_stream(source)
+
+def iter_gcode_comment_lines(source):
+    # Yields the header lines followed by the trailer lines, decoded like the old full pass
+    for block in read_gcode_blocks(source):
+        yield from block.decode("ascii", errors="ignore").splitlines(keepends=True)
 
 def extract_gcode(file_path: str) -> dict:
     info = {}
     is_thumbnail = False
 
-    with open(file_path, "r", encoding="ascii", errors="ignore") as f:
-        for line in f:
-            # print(line)
-            # print()
-            if line.startswith("; thumbnail_QOI begin"):
-                is_thumbnail = True
-            if line.startswith("; thumbnail_QOI end"):
-                is_thumbnail = False
-            if is_thumbnail:
-                continue
-
-            line = line.strip()
-            if line.startswith(";") and "=" in line:
-                line = line[1:].strip()
-                key, value = line.split("=", 1)
-                key = key.strip()
-                value = value.strip()
-                info[key] = convert_value(value)
-                # info[key] = value
+    for line in iter_gcode_comment_lines(Path(file_path)):
+        if line.startswith("; thumbnail_QOI begin"):
+            is_thumbnail = True
+        if line.startswith("; thumbnail_QOI end"):
+            is_thumbnail = False
+        if is_thumbnail:
+            continue
+
+        line = line.strip()
+        if line.startswith(";") and "=" in line:
+            line = line[1:].strip()
+            key, value = line.split("=", 1)
+            key = key.strip()
+            value = value.strip()
+            info[key] = convert_value(value, times=False)
 
     return info
 
@@ -0,0 +1,118 @@
+import json
+import re
+from functools import lru_cache
+
+# Shared type inference for "; key = value" G-code comments.
+# The common shapes (int, float, percentage, JSON, plain text) are told apart by
+# one precompiled match instead of a chain of try/except probes, and converted
+# scalars are memoized because most keys repeat with the same value across jobs.
+
+CONVERT_CACHE_SIZE = 16384
+
+_VALUE_RE = re.compile(r"""
+    (?P<int>[+-]?\d+)
+  | (?P<float>[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<percent>[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)%
+  | (?P<json>\{.*\}|\[.*\])
+""", re.VERBOSE | re.DOTALL)
+
+# Forms int()/float() also accept but the pattern above leaves out
+# (surrounding whitespace, "1_000", "inf", "nan"); these go through the slow probes
+_MAYBE_NUMBER_RE = re.compile(r"\s*[+-]?(?:[\d_.]+(?:[eE][+-]?[\d_]+)?|inf(?:inity)?|nan)\s*%?\s*", re.IGNORECASE)
+
+_TIME_RE = re.compile(r"\d+[hms]")
+_HOURS_RE = re.compile(r"(\d+)h")
+_MINUTES_RE = re.compile(r"(\d+)m")
+_SECONDS_RE = re.compile(r"(\d+)s")
+
+_JSON = object()  # marker: parsed per call so callers never share a mutable result
+_TIME = object()  # marker: a time string, converted to seconds only if the caller asks for it
+
+
+def is_number(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+def is_integer(s):
+    try:
+        int(s)
+        return True
+    except ValueError:
+        return False
+
+def is_percentage(s):
+    if s.endswith('%'):
+        try:
+            float(s[:-1])
+            return True
+        except ValueError:
+            return False
+    return False
+
+def is_json(s):
+    s = s.strip()
+    return (s.startswith('{') and s.endswith('}')) or (s.startswith('[') and s.endswith(']'))
+
+def is_time_str(v):
+    return isinstance(v, str) and _TIME_RE.search(v)
+
+def parse_time(v):
+    hours = minutes = seconds = 0
+    match_h = _HOURS_RE.search(v)
+    match_m = _MINUTES_RE.search(v)
+    match_s = _SECONDS_RE.search(v)
+    if match_h:
+        hours = int(match_h.group(1))
+    if match_m:
+        minutes = int(match_m.group(1))
+    if match_s:
+        seconds = int(match_s.group(1))
+    return hours * 3600 + minutes * 60 + seconds
+
+def _convert_slow(value):
+    # Original probe chain, kept for the unusual numeric spellings
+    if is_integer(value):
+        return int(value)
+    elif is_number(value):
+        return float(value)
+    elif is_percentage(value):
+        return float(value[:-1]) / 100.0
+    elif is_json(value):
+        return _JSON
+    elif is_time_str(value):
+        return _TIME
+    return value
+
+@lru_cache(maxsize=CONVERT_CACHE_SIZE)
+def _convert_cached(value):
+    m = _VALUE_RE.fullmatch(value)
+    if m is not None:
+        kind = m.lastgroup
+        if kind == "int":
+            return int(value)
+        if kind == "float":
+            return float(value)
+        if kind == "percent":
+            return float(value[:-1]) / 100.0
+        return _JSON
+    if _MAYBE_NUMBER_RE.fullmatch(value) or is_json(value):
+        return _convert_slow(value)
+    if _TIME_RE.search(value):
+        return _TIME
+    return value
+
+def convert_value(value, times=True):
+    # times=False leaves time strings ("9m 15s") as text, as scripts/gcode.py always has;
+    # print_job_pipeline converts them and marks the key with " (seconds)"
+    result = _convert_cached(value)
+    if result is _JSON:
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    if result is _TIME:
+        return parse_time(value) if times else value
+    return result
@@ -0,0 +1,238 @@
+import io
+import mmap
+import struct
+import zlib
+from pathlib import Path
+from PIL import Image, ExifTags, TiffImagePlugin
+
+# Header-only metadata for PNG and JPEG: PNG chunks and JPEG markers are walked and the
+# image data (IDAT payloads, the JPEG scan) is seeked past, so only a few kilobytes are read.
+# Works on paths, bytes/mmap buffers, DataClass payloads and seekable streams (GridFS files).
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_METADATA_CHUNKS = {b"IHDR", b"pHYs", b"eXIf", b"tEXt", b"zTXt", b"iTXt"}
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+RAW_EXIF_KEY = "Raw profile type exif"  # ImageMagick stores PNG EXIF as hex text under this key
+# (bit depth, color type) of the IHDR chunk -> the mode Pillow opens the PNG in
+PNG_MODES = {
+    (1, 0): "1", (2, 0): "L", (4, 0): "L", (8, 0): "L", (16, 0): "I;16",
+    (8, 2): "RGB", (16, 2): "RGB",
+    (1, 3): "P", (2, 3): "P", (4, 3): "P", (8, 3): "P",
+    (8, 4): "LA", (16, 4): "RGBA",
+    (8, 6): "RGBA", (16, 6): "RGBA",
+}
+
+
+class _BufferReader:
+    # read/seek over a bytes-like object without copying it (BytesIO would copy an mmap)
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def read(self, n=-1):
+        end = len(self._view) if n is None or n < 0 else min(self._pos + n, len(self._view))
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(base + offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def _open_source(source):
+    # (reader, must_close)
+    if isinstance(source, (str, Path)):
+        return open(source, "rb"), True
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return _BufferReader(source), False
+    if hasattr(source, "hash_id") and hasattr(source, "open"):  # DataClass
+        return source.open(), True
+    if hasattr(source, "read") and hasattr(source, "seek"):
+        return source, False
+    raise ValueError("Source must be a path, a bytes-like object, a DataClass or a seekable binary stream")
+
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        raise ValueError("Truncated image header")
+    return data
+
+
+def iter_png_chunks(f, payload_types=PNG_METADATA_CHUNKS):
+    # Yields (type, length, offset, payload); payload is None for chunk types not in payload_types,
+    # whose data is skipped with a seek. Stops after IEND or at the end of the stream.
+    if f.read(8) != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+    offset = 8
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            return
+        length, ctype = struct.unpack(">I4s", head)
+        if ctype in payload_types:
+            payload = _read_exact(f, length)
+            f.seek(4, io.SEEK_CUR)  # CRC
+        else:
+            payload = None
+            f.seek(length + 4, io.SEEK_CUR)
+        yield ctype, length, offset, payload
+        offset += length + 12
+        if ctype == b"IEND":
+            return
+
+
+def iter_jpeg_segments(f, payload_markers=None):
+    # Yields (marker, length, offset, payload) for every segment up to and including SOS,
+    # where the entropy-coded scan starts. By default APPn, COM and SOFn payloads are read
+    # and everything else (tables) is skipped with a seek.
+    if f.read(2) != b"\xff\xd8":
+        raise ValueError("Not a JPEG file")
+    offset = 2
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return
+        if byte != b"\xff":
+            raise ValueError(f"Corrupt JPEG marker at offset {offset}")
+        marker = 0xFF
+        while marker == 0xFF:  # fill bytes
+            byte = f.read(1)
+            if not byte:
+                return
+            marker = byte[0]
+            offset += 1
+        if marker in JPEG_STANDALONE_MARKERS:
+            offset += 1
+            continue
+        if marker == 0xD9:  # EOI
+            return
+        length = struct.unpack(">H", _read_exact(f, 2))[0]
+        wanted = (0xE0 <= marker <= 0xEF or marker == 0xFE or marker in JPEG_SOF_MARKERS) if payload_markers is None else marker in payload_markers
+        if wanted:
+            payload = _read_exact(f, length - 2)
+        else:
+            payload = None
+            f.seek(length - 2, io.SEEK_CUR)
+        yield marker, length, offset - 1, payload
+        offset += 1 + length
+        if marker == 0xDA:  # SOS
+            return
+
+
+def _bson_safe(value):
+    # EXIF carries rationals, int-keyed sub-IFDs (GPSInfo) and tuples, which BSON can't store as-is
+    if isinstance(value, TiffImagePlugin.IFDRational):
+        return float(value) if value.denominator else None
+    if isinstance(value, dict):
+        return {str(ExifTags.GPSTAGS.get(k, k)): _bson_safe(v) for k, v in value.items()}
+    if isinstance(value, (tuple, list)):
+        return [_bson_safe(v) for v in value]
+    return value
+
+
+def _decode_exif(raw):
+    # Same tag set as Image._getexif(): base IFD merged with the Exif IFD, GPSInfo as a dict
+    if not raw:
+        return {}, None
+    exif = Image.Exif()
+    try:
+        exif.load(raw)
+        merged = exif._get_merged_dict()
+    except (SyntaxError, ValueError, struct.error):
+        return {}, None
+    return {str(ExifTags.TAGS.get(k, k)): _bson_safe(v) for k, v in merged.items()}, exif
+
+
+def _png_text(ctype, payload):
+    # (key, text) of a tEXt/zTXt/iTXt chunk, or None if it can't be decoded
+    try:
+        key, rest = payload.split(b"\x00", 1)
+        if ctype == b"tEXt":
+            return key.decode("latin-1"), rest.decode("latin-1", errors="replace")
+        if ctype == b"zTXt":
+            return key.decode("latin-1"), zlib.decompress(rest[1:]).decode("latin-1", errors="replace")
+        compressed = rest[0] == 1
+        _, _, text = rest[2:].split(b"\x00", 2)
+        return key.decode("latin-1"), (zlib.decompress(text) if compressed else text).decode("utf-8", errors="replace")
+    except (ValueError, IndexError, zlib.error):
+        return None
+
+
+def _png_header(f):
+    data = {"original_format": "PNG", "dpi": None, "bit_depth": None, "exif": {}}
+    raw_exif = None
+    for ctype, _, _, payload in iter_png_chunks(f):
+        if ctype == b"IHDR":
+            width, height, bits, color_type = struct.unpack(">IIBB", payload[:10])
+            data.update({"mode": PNG_MODES.get((bits, color_type)), "width": width, "height": height})
+        elif ctype == b"pHYs" and len(payload) >= 9 and payload[8] == 1:
+            px, py = struct.unpack(">II", payload[:8])
+            data["dpi"] = [px * 0.0254, py * 0.0254]
+        elif ctype == b"eXIf":
+            raw_exif = b"Exif\x00\x00" + payload
+        elif ctype in (b"tEXt", b"zTXt", b"iTXt") and raw_exif is None:
+            text = _png_text(ctype, payload)
+            if text is not None and text[0] == RAW_EXIF_KEY:
+                try:
+                    raw_exif = bytes.fromhex("".join(text[1].split("\n")[3:]))
+                except ValueError:
+                    pass
+    data["exif"] = _decode_exif(raw_exif)[0]
+    return data
+
+
+def _jpeg_header(f):
+    data = {"original_format": "JPEG", "dpi": None, "exif": {}}
+    raw_exif = None
+    for marker, _, _, payload in iter_jpeg_segments(f):
+        if marker in JPEG_SOF_MARKERS:
+            bits, height, width, layers = struct.unpack(">BHHB", payload[:6])
+            data.update({"mode": {1: "L", 3: "RGB", 4: "CMYK"}.get(layers), "width": width, "height": height, "bit_depth": bits})
+        elif marker == 0xE0 and payload.startswith(b"JFIF") and len(payload) >= 12:
+            unit, xd, yd = payload[7], *struct.unpack(">HH", payload[8:12])
+            if unit == 1:
+                data["dpi"] = [xd, yd]
+            elif unit == 2:
+                data["dpi"] = [xd * 2.54, yd * 2.54]
+        elif marker == 0xE1 and payload.startswith(b"Exif\x00\x00"):
+            raw_exif = payload if raw_exif is None else raw_exif + payload[6:]
+
+    data["exif"], exif = _decode_exif(raw_exif)
+    if data["dpi"] is None and exif is not None:
+        # Like Pillow: fall back to the EXIF resolution, 72 dpi if it is unusable
+        try:
+            dpi = float(exif[0x011A])
+            if dpi != dpi:
+                raise ValueError("DPI is not a number")
+            dpi *= 2.54 if exif.get(0x0128) == 3 else 1
+            data["dpi"] = [dpi, dpi]
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            data["dpi"] = [72, 72]
+    return data
+
+
+def read_image_header(source):
+    """Metadata of a PNG or JPEG in the structure of imageprocessing.extract_image_data, without reading pixel data."""
+    f, close = _open_source(source)
+    try:
+        start = f.tell()
+        signature = f.read(8)
+        f.seek(start)
+        if signature.startswith(PNG_SIGNATURE):
+            data = _png_header(f)
+        elif signature.startswith(b"\xff\xd8"):
+            data = _jpeg_header(f)
+        else:
+            raise ValueError("Only PNG and JPEG images are supported.")
+    finally:
+        if close:
+            f.close()
+    return {k: data.get(k) for k in ("original_format", "mode", "width", "height", "dpi", "bit_depth", "exif")}
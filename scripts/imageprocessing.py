@@ -1,31 +1,91 @@
-from PIL import Image, ExifTags
+import numpy as np
+from PIL import Image
 from io import BytesIO
 from scripts.classes.dataclass import DataClass
+from scripts.image_headers import read_image_header
 
+# PNG encoder settings for JPEG conversion: trade CPU for size
+PNG_COMPRESS_LEVEL = 6  # zlib level 0-9 (Pillow default); 1 is much faster, 9 slightly smaller
+PNG_OPTIMIZE = False  # extra encoder pass for the smallest file, several times slower
 
-# Works (at least) for JPG and PNG formats
-def extract_image_data(file_data):
-    image = Image.open(BytesIO(file_data.bytes))
-    width, height = image.size
-    info = image.info
-    exif = {}
-    if hasattr(image, "_getexif") and image._getexif():
-        exif = {ExifTags.TAGS.get(k, k): v for k, v in image._getexif().items()}
-    return {
-        "original_format": image.format,
-        "mode": image.mode,
-        "width": width,
-        "height": height,
-        "dpi": info.get("dpi"),
-        "bit_depth": image.bits if hasattr(image, "bits") else None,
-        "exif": exif,
-    }
-
-
-def convert_to_png(file_data):
-    image = Image.open(BytesIO(file_data.bytes))
+# Downscaled previews made at ingest, by longest side in px; sizes not smaller than the image are skipped
+PREVIEW_SIZES = (160, 640, 1280)
+PREVIEW_FORMAT, PREVIEW_MIME = "WEBP", "image/webp"
+PREVIEW_QUALITY = 80
+
+# 64-bit DCT perceptual hash: robust to re-encoding and rescaling, compared by hamming distance
+PHASH_INPUT_SIZE = 32
+PHASH_LOW_FREQ = 8
+
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II basis, so the 2-D DCT of x is D @ x @ D.T
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    d[0] /= np.sqrt(2.0)
+    return d
+
+_DCT = _dct_matrix(PHASH_INPUT_SIZE)
+
+
+def _encode_png(image, name, compress_level, optimize):
     output = BytesIO()
-    image.save(output, format="PNG")
-    output.seek(0)
+    image.save(output, format="PNG", compress_level=compress_level, optimize=optimize)
+    return DataClass(data=output.getvalue(), mime_type="image/png", name=name.split(".")[0] + ".png")
+
+
+def make_previews(image, name, sizes=PREVIEW_SIZES):
+    # {size: DataClass} for a decoded image; largest first, so each one is resized from the previous
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    current = image
+    previews = {}
+    for size in sorted(sizes, reverse=True):
+        if size >= max(image.size):
+            continue
+        current = current.copy()
+        current.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if current.mode not in ("RGB", "RGBA"):
+            current = current.convert("RGBA" if has_alpha else "RGB")
+        output = BytesIO()
+        current.save(output, format=PREVIEW_FORMAT, quality=PREVIEW_QUALITY)
+        previews[size] = DataClass(data=output.getvalue(), mime_type=PREVIEW_MIME, name=f"{name.split('.')[0]}_{size}.{PREVIEW_FORMAT.lower()}")
+    return previews
+
+
+def perceptual_hash(image):
+    # pHash of a decoded image as 16 hex chars: low 8x8 DCT frequencies of a 32x32 grayscale
+    # thumbnail, each bit set when above their median (DC term left out of the median)
+    small = image.convert("L").resize((PHASH_INPUT_SIZE, PHASH_INPUT_SIZE), Image.Resampling.LANCZOS)
+    low = (_DCT @ np.asarray(small, dtype=np.float64) @ _DCT.T)[:PHASH_LOW_FREQ, :PHASH_LOW_FREQ].ravel()
+    bits = low > np.median(low[1:])
+    return np.packbits(bits).tobytes().hex()
+
+
+def file_perceptual_hash(f):
+    # perceptual_hash of an encoded image given as a binary stream (e.g. a GridFS file)
+    return perceptual_hash(Image.open(f))
+
+
+# Works for JPG and PNG formats; reads only the header (see scripts/image_headers.py)
+def extract_image_data(file_data):
+    return read_image_header(file_data)
+
+
+def convert_to_png(file_data, compress_level=PNG_COMPRESS_LEVEL, optimize=PNG_OPTIMIZE):
+    with file_data.open() as f:
+        return _encode_png(Image.open(f), file_data.name, compress_level, optimize)
+
 
-    return DataClass(data=output.getvalue(), mime_type="image/png", name=file_data.name.split(".")[0] + ".png")
+def prepare_image(file_data, compress_level=PNG_COMPRESS_LEVEL, optimize=PNG_OPTIMIZE, preview_sizes=PREVIEW_SIZES):
+    # CPU-bound part of image ingestion, kept top-level so a process pool can run it.
+    # Returns (png, metadata, previews, phash). The file is opened once: metadata (and EXIF) is
+    # read from the original header, and the pixels are decoded once for the PNG encode (JPEGs
+    # only, PNGs are stored as they are), the previews and the perceptual hash.
+    with file_data.open() as f:
+        metadata = read_image_header(f)
+        f.seek(0)
+        image = Image.open(f)
+        image.load()
+        png = _encode_png(image, file_data.name, compress_level, optimize) if file_data.type == "image/jpeg" else file_data
+        return png, metadata, make_previews(image, file_data.name, preview_sizes), perceptual_hash(image)
@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import database.serverHelper as sh
+from interface.creatingSessions.print_job_pipeline import process_gcode
+from scripts.reading_h5 import extract_h5_datasets
+
+# Ingests staged uploads in the background (see INGESTION QUEUE in database/serverHelper.py).
+# Starts a pool of worker processes; each one claims a staged session, object, print job or
+# image collection, ingests it, reports progress on the document and claims the next one.
+# Several workers (also on several machines) can share one database.
+# PYTHONPATH=(...) python3 scripts/ingest_worker.py [workers] [--drain]
+# --drain exits once nothing is left to claim instead of waiting for new uploads.
+
+WORKERS = os.cpu_count() or 1
+POLL_INTERVAL = 2.0  # seconds between claims while nothing is queued
+HEARTBEAT_INTERVAL = sh.INGEST_LEASE_SECONDS / 4
+IMAGE_BATCH = 16  # images ingested between progress reports
+
+
+# Handlers get the claimed document, progress(done, total, message) and new_id(), which gives the _id
+# for each timeseries they write (recorded first, so a failed attempt's timeseries are deleted)
+
+def ingest_print_session(doc, progress, new_id):
+    # The timeseries of every numeric dataset in the session's .h5 files
+    h5_ids = doc["staged"].get("h5_file_ids", [])
+    timeseries = {}
+    for i, file_id in enumerate(h5_ids):
+        progress(i, len(h5_ids), "timeseries from .h5 files")
+        datasets = extract_h5_datasets(sh.read_staged_file(file_id, staging=False))
+        timeseries.update({name: sh.create_timeseries(name, v, timeseries_id=new_id()) for name, v in datasets.items() if isinstance(v, np.ndarray)})
+    return {"timeseries": timeseries}
+
+
+def ingest_object(doc, progress, new_id):
+    # Nothing is extracted from model files yet (see interface/creatingSessions/object_pipeline.py)
+    return {}
+
+
+def ingest_print_job(doc, progress, new_id):
+    progress(0, 1, "parsing G-code")
+    file_id = doc["staged"]["gcode_file_id"]
+    gcode = sh.read_staged_file(file_id, staging=False)
+    metadata, toolpath_ids, layer_index = process_gcode(gcode, doc.get("printer_id"), new_id)
+    sh.set_gcode_layer_index(file_id, layer_index)
+    return {"metadata": metadata, "toolpath": toolpath_ids, "artifacts.hash_id": sh.print_job_hash([gcode], metadata)}
+
+
+def ingest_image_collection(doc, progress, new_id):
+    # Serial per collection: the parallelism comes from running several workers. A retry redoes
+    # the images already stored by the failed attempt at no cost, create_images dedups them.
+    staged = doc["staged"]["file_ids"]
+    image_ids = []
+    for start in range(0, len(staged), IMAGE_BATCH):
+        progress(start, len(staged), "processing images")
+        image_ids += sh.create_images([sh.read_staged_file(file_id) for file_id in staged[start:start + IMAGE_BATCH]])
+    return {"image_file_ids": image_ids}
+
+
+HANDLERS = {
+    "print_sessions": ingest_print_session,
+    "objects": ingest_object,
+    "print_jobs": ingest_print_job,
+    "image_collections": ingest_image_collection,
+}
+
+
+def _heartbeat(coll_name, doc_id, worker, stop):
+    # Keeps the claim alive during long steps that don't report progress
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        sh.ingest_heartbeat(coll_name, doc_id, worker)
+
+
+def ingest(coll_name, doc, worker):
+    doc_id = doc["_id"]
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(coll_name, doc_id, worker, stop), daemon=True)
+    beat.start()
+    try:
+        fields = HANDLERS[coll_name](
+            doc,
+            lambda done, total, message="": sh.report_ingest_progress(coll_name, doc_id, worker, done, total, message),
+            lambda: sh.reserve_ingest_output(coll_name, doc_id, worker),
+        )
+    except KeyboardInterrupt:
+        sh.release_ingest_job(coll_name, doc_id, worker)
+        raise
+    except Exception as e:
+        print(f"[{worker}] {coll_name} {doc_id} failed: {e!r}", file=sys.stderr)
+        sh.fail_ingest(coll_name, doc_id, worker, "".join(traceback.format_exception(e, limit=-5)))
+        return False
+    finally:
+        stop.set()
+        beat.join()
+
+    if not sh.complete_ingest(coll_name, doc_id, worker, fields):
+        print(f"[{worker}] {coll_name} {doc_id}: claim lost before finishing, result dropped", file=sys.stderr)
+        return False
+    sh.delete_staged_files(doc["staged"])
+    print(f"[{worker}] ingested {coll_name} {doc_id}")
+    return True
+
+
+def run_worker(worker, drain=False):
+    # Claims and ingests until interrupted (or, with drain, until the queue is empty); returns how many were ingested
+    ingested = 0
+    try:
+        while True:
+            job = sh.claim_ingest_job(worker)
+            if job is None:
+                if drain:
+                    return ingested
+                time.sleep(POLL_INTERVAL)
+                continue
+            ingested += ingest(*job, worker)
+    except KeyboardInterrupt:
+        return ingested
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    workers = int(args[0]) if args else WORKERS
+    drain = "--drain" in sys.argv
+
+    sh.ensure_indexes()
+    names = [f"{socket.gethostname()}:{os.getpid()}:{i}" for i in range(workers)]
+    print(f"{workers} ingest workers, pending: {sh.get_ingest_overview()}")
+    # spawn: every worker process opens its own MongoClient
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        total = sum(pool.map(run_worker, names, [drain] * workers))
+    print(f"{total} documents ingested, pending: {sh.get_ingest_overview()}")
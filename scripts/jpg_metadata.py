@@ -1,6 +1,6 @@
-import struct
 import zlib
 from PIL import Image, ExifTags, JpegImagePlugin, PngImagePlugin
+from scripts.image_headers import iter_jpeg_segments, iter_png_chunks
 
 # ========= Utilidades comuns =========
 
@@ -45,22 +45,13 @@ def list_png_chunks(path):
     exif_bytes = None
 
     with open(path, "rb") as f:
-        sig = f.read(8)
-        if sig != b"\x89PNG\r\n\x1a\n":
+        if f.read(8) != b"\x89PNG\r\n\x1a\n":
             raise ValueError("Arquivo não parece ser PNG válido.")
+        f.seek(0)
 
-        while True:
-            len_bytes = f.read(4)
-            if len(len_bytes) < 4:
-                break
-            length = struct.unpack(">I", len_bytes)[0]
-            ctype = f.read(4)
-            if len(ctype) < 4:
-                break
-            cdata = f.read(length)
-            crc = f.read(4)
+        # Só os payloads de texto/EXIF são lidos; IDAT e afins são pulados com seek
+        for ctype, length, offset, cdata in iter_png_chunks(f, payload_types={b"tEXt", b"zTXt", b"iTXt", b"eXIf"}):
             ctype_str = ctype.decode("ascii", errors="replace")
-            offset = f.tell() - (length + 12)  # posição do início do chunk
             chunks.append((ctype_str, length, offset))
 
             # Textual data
@@ -212,10 +203,14 @@ def _extract_gps_from_exif(tagmap):
     return {"lat": lat, "lon": lon, **gpstags}
 
 def _extract_xmp_from_jpeg(path):
-    # Lê APP1/APP13 e tenta achar XMP XML
+    # Lê só os segmentos APP1/APP13 (até o SOS) e tenta achar XMP XML
     with open(path, "rb") as f:
-        data = f.read()
-    return _extract_xmp_from_bytes(data)
+        for _, _, _, payload in iter_jpeg_segments(f, payload_markers={0xE1, 0xED}):
+            if payload is not None:
+                xmp = _extract_xmp_from_bytes(payload)
+                if xmp:
+                    return xmp
+    return None
 
 def _extract_iptc_with_pillow(img):
     try:
@@ -5,7 +5,7 @@ from scripts.classes.dataclass import DataClass
 
 def extract_h5_datasets(data: DataClass):
     out = {}
-    with h5py.File(io.BytesIO(data.bytes), "r") as f:
+    with data.open() as raw, h5py.File(raw, "r") as f:
         def cb(name, obj):
             if isinstance(obj, h5py.Dataset):
                 x = obj[()]
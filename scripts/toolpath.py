@@ -0,0 +1,311 @@
+import mmap
+from pathlib import Path
+import numpy as np
+
+# Columnar G-code toolpath parsing.
+# Every step works on the whole file as a uint8 array (line table, command
+# detection, axis words, number parsing, modal state), so the number of passes
+# does not depend on the number of moves.
+
+TOOLPATH_AXES = b"XYZEF"
+TOOLPATH_COLUMNS = ("x", "y", "z", "e", "f", "g", "layer", "line")
+LAYER_MARKERS = (b";LAYER_CHANGE", b"; CHANGE_LAYER")  # PrusaSlicer, OrcaSlicer
+TOKEN_WIDTH = 12
+
+_SPACE, _TAB, _CR, _LF, _SEMI = b" \t\r\n;"
+_G, _M = b"GM"
+_0, _1, _2, _3, _8, _9 = b"012389"
+
+
+def _load_buffer(source) -> np.ndarray:
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (str, Path)):
+        with open(source, "rb") as f:
+            return np.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), dtype=np.uint8)
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return np.frombuffer(source, dtype=np.uint8)
+    return np.frombuffer(source.read(), dtype=np.uint8)
+
+def _byte_at(buf, pos, limit):
+    # buf[pos] where pos < limit, 0 otherwise
+    out = np.zeros(pos.shape, dtype=np.uint8)
+    ok = pos < limit
+    out[ok] = buf[pos[ok]]
+    return out
+
+def _is_digit(b):
+    return (b >= _0) & (b <= _9)
+
+def _is_blank(b):
+    return (b == _SPACE) | (b == _TAB)
+
+def _line_table(buf):
+    newlines = np.flatnonzero(buf == _LF)
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [buf.size]))
+    has_cr = (ends > starts) & (_byte_at(buf, np.maximum(ends - 1, 0), buf.size) == _CR)
+    ends = ends - has_cr
+    return starts, ends
+
+def _skip_indent(buf, starts, ends):
+    # Some start/end G-code templates indent their commands
+    cur = starts.copy()
+    active = np.flatnonzero((cur < ends) & _is_blank(_byte_at(buf, cur, buf.size)))
+    while active.size:
+        cur[active] += 1
+        active = active[(cur[active] < ends[active]) & _is_blank(buf[np.minimum(cur[active], buf.size - 1)])]
+    return cur
+
+def _lines_starting_with(buf, starts, ends, prefix: bytes):
+    k = len(prefix)
+    cand = np.flatnonzero((ends - starts >= k) & (_byte_at(buf, starts, buf.size) == prefix[0]))
+    if cand.size == 0:
+        return cand
+    window = buf[starts[cand, None] + np.arange(k)]
+    return cand[(window == np.frombuffer(prefix, dtype=np.uint8)).all(axis=1)]
+
+def _parse_tokens(buf, pos, limit):
+    # Number that follows each axis letter, up to the next blank/';'/end of code
+    idx = pos[:, None] + 1 + np.arange(TOKEN_WIDTH)
+    inside = idx < limit[:, None]
+    chars = buf[np.minimum(idx, buf.size - 1)]
+    stop = np.logical_or.accumulate(~inside | _is_blank(chars) | (chars == _SEMI), axis=1)
+    chars = np.where(stop, np.uint8(0), chars)
+    tokens = chars.view(f"S{TOKEN_WIDTH}").ravel()
+    tokens[tokens == b""] = b"nan"
+    try:
+        values = tokens.astype(np.float64)
+    except ValueError:
+        values = np.array([_to_float(t) for t in tokens], dtype=np.float64)
+    # Rare words longer than the window are parsed one by one
+    for i in np.flatnonzero(~stop[:, -1]):
+        end = int(limit[i])
+        word = bytes(buf[pos[i] + 1:end]).split(None, 1)[0].split(b";", 1)[0]
+        values[i] = _to_float(word)
+    return values
+
+def _to_float(token):
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+def _last_event(event_lines, event_values, lines, default):
+    # Value of the last modal event strictly before each line
+    if event_lines.size == 0:
+        return np.full(lines.shape, default)
+    order = np.argsort(event_lines, kind="stable")
+    event_lines, event_values = event_lines[order], event_values[order]
+    i = np.searchsorted(event_lines, lines, side="left") - 1
+    return np.where(i >= 0, event_values[np.maximum(i, 0)], default)
+
+def _absolute(values, relative, anchor_rows, start=np.nan):
+    # Turn modal axis words into positions: absolute words (and G92) anchor the
+    # position, relative words add to the last anchor, missing words keep it.
+    defined = ~np.isnan(values)
+    anchor = defined & (~relative | anchor_rows)
+    delta = np.where(defined & relative & ~anchor_rows, values, 0.0)
+    moved = np.cumsum(delta)
+    last = np.maximum.accumulate(np.where(anchor, np.arange(values.size), -1))
+    safe = np.maximum(last, 0)
+    return np.where(last >= 0, values[safe] + moved - moved[safe], start + moved)
+
+def parse_toolpath(source) -> dict:
+    """
+    Parse every G0/G1 (and G2/G3 arc endpoint) move into columnar arrays.
+    x/y/z/f are absolute modal values, e is the extrusion of the move itself,
+    g is the motion command, layer is 0-based (-1 before the first layer) and
+    line is the 1-based line number in the file.
+    """
+    buf = _load_buffer(source)
+    if buf.size == 0:
+        return _empty_toolpath()
+    starts, ends = _line_table(buf)
+    code = _skip_indent(buf, starts, ends)
+
+    b0 = _byte_at(buf, code, ends)
+    b1 = _byte_at(buf, code + 1, ends)
+    b2 = _byte_at(buf, code + 2, ends)
+    b3 = _byte_at(buf, code + 3, ends)
+
+    is_g = b0 == _G
+    is_move = is_g & (b1 >= _0) & (b1 <= _3) & _is_blank(b2)
+    is_g92 = is_g & (b1 == _9) & (b2 == _2) & _is_blank(b3)
+    is_g90 = is_g & (b1 == _9) & (b2 == _0) & ~_is_digit(b3)
+    is_g91 = is_g & (b1 == _9) & (b2 == _1) & ~_is_digit(b3)
+    is_m82 = (b0 == _M) & (b1 == _8) & (b2 == _2) & ~_is_digit(b3)
+    is_m83 = (b0 == _M) & (b1 == _8) & (b2 == _3) & ~_is_digit(b3)
+
+    cmd_lines = np.flatnonzero(is_move | is_g92)
+    if cmd_lines.size == 0:
+        return _empty_toolpath()
+    row_of_line = np.full(starts.size, -1)
+    row_of_line[cmd_lines] = np.arange(cmd_lines.size)
+
+    # Code ends at the first ';' of the line
+    code_end = ends.copy()
+    semis = np.flatnonzero(buf == _SEMI)
+    semi_lines = np.searchsorted(starts, semis, side="right") - 1
+    first_lines, first_idx = np.unique(semi_lines, return_index=True)
+    code_end[first_lines] = np.minimum(code_end[first_lines], semis[first_idx])
+
+    # Axis words: a letter preceded by a blank inside the code part of a command line
+    letter_table = np.zeros(256, dtype=bool)
+    letter_table[np.frombuffer(TOOLPATH_AXES, dtype=np.uint8)] = True
+    pos = np.flatnonzero(letter_table[buf[1:]]) + 1
+    pos = pos[_is_blank(buf[pos - 1])]
+    word_lines = np.searchsorted(starts, pos, side="right") - 1
+    keep = (row_of_line[word_lines] >= 0) & (pos < code_end[word_lines])
+    pos, word_lines = pos[keep], word_lines[keep]
+    values = _parse_tokens(buf, pos, code_end[word_lines])
+
+    words = np.full((cmd_lines.size, len(TOOLPATH_AXES)), np.nan)
+    axis_of_letter = np.zeros(256, dtype=np.intp)
+    axis_of_letter[np.frombuffer(TOOLPATH_AXES, dtype=np.uint8)] = np.arange(len(TOOLPATH_AXES))
+    words[row_of_line[word_lines], axis_of_letter[buf[pos]]] = values
+
+    # Modal state: G90/G91 for XYZ, G90/G91/M82/M83 for E
+    pos_events = np.flatnonzero(is_g90 | is_g91)
+    xyz_relative = _last_event(pos_events, is_g91[pos_events], cmd_lines, False)
+    e_events = np.flatnonzero(is_g90 | is_g91 | is_m82 | is_m83)
+    e_relative = _last_event(e_events, (is_g91 | is_m83)[e_events], cmd_lines, False)
+    g92 = is_g92[cmd_lines]
+
+    x = _absolute(words[:, 0], xyz_relative, g92)
+    y = _absolute(words[:, 1], xyz_relative, g92)
+    z = _absolute(words[:, 2], xyz_relative, g92)
+    e_position = _absolute(words[:, 3], e_relative, g92, start=0.0)
+    e = np.diff(e_position, prepend=0.0)
+    f = _absolute(words[:, 4], np.zeros(cmd_lines.size, dtype=bool), np.zeros(cmd_lines.size, dtype=bool))
+
+    moves = ~g92
+    move_lines = cmd_lines[moves]
+    if move_lines.size == 0:
+        return _empty_toolpath()
+    markers = np.sort(np.concatenate([_lines_starting_with(buf, starts, ends, m) for m in LAYER_MARKERS]))
+    if markers.size:
+        layer = np.searchsorted(markers, move_lines, side="right") - 1
+    else:
+        # No slicer markers: a new layer starts whenever Z rises above its previous maximum
+        top = np.fmax.accumulate(np.where(np.isnan(z[moves]), -np.inf, z[moves]))
+        layer = np.concatenate(([0], np.cumsum(top[1:] > top[:-1])))
+
+    return {
+        "x": x[moves],
+        "y": y[moves],
+        "z": z[moves],
+        "e": e[moves],
+        "f": f[moves],
+        "g": (b1[move_lines] - _0).astype(np.int8),
+        "layer": layer.astype(np.int32),
+        "line": (move_lines + 1).astype(np.int64),
+    }
+
+def _empty_toolpath():
+    dtypes = {"g": np.int8, "layer": np.int32, "line": np.int64}
+    return {name: np.empty(0, dtype=dtypes.get(name, np.float64)) for name in TOOLPATH_COLUMNS}
+
+
+def layer_byte_index(source, toolpath: dict = None) -> list[list[int]]:
+    """
+    [start, end) byte offsets of every layer, so a single layer can be read by seeking.
+    A layer starts at its marker line (or at its first move when the file has no markers)
+    and ends where the next one starts; the last one ends after its last move.
+    """
+    buf = _load_buffer(source)
+    if toolpath is None:
+        toolpath = parse_toolpath(buf)
+    if buf.size == 0 or toolpath["line"].size == 0:
+        return []
+    starts, ends = _line_table(buf)
+
+    markers = np.sort(np.concatenate([_lines_starting_with(buf, starts, ends, m) for m in LAYER_MARKERS]))
+    if markers.size:
+        layer_lines = markers
+    else:
+        layer = toolpath["layer"]
+        _, first = np.unique(layer, return_index=True)
+        layer_lines = toolpath["line"][first] - 1
+
+    offsets = starts[layer_lines]
+    last_move = toolpath["line"][-1] - 1
+    last_end = min(int(ends[last_move]) + 1, buf.size)
+    bounds = np.append(offsets, max(last_end, int(offsets[-1])))
+    return np.stack([bounds[:-1], bounds[1:]], axis=1).tolist()
+
+# ========= Per-layer statistics =========
+
+def _clean(values):
+    # Plain Python numbers for BSON/JSON, NaN -> None
+    return [None if v != v else v for v in values.tolist()]
+
+def layer_statistics(toolpath: dict) -> list[dict]:
+    """
+    Aggregate a parsed toolpath per layer (moves before the first layer are skipped).
+    A move extrudes when e > 0; every other move counts as travel. The time estimate
+    is length / feedrate per move, without acceleration.
+    """
+    x, y, z = toolpath["x"], toolpath["y"], toolpath["z"]
+    e, f, g, layer = toolpath["e"], toolpath["f"], toolpath["g"], toolpath["layer"]
+    if x.size == 0:
+        return []
+
+    position = np.stack([x, y, z], axis=1)
+    step = np.diff(position, axis=0, prepend=position[:1])
+    length = np.sqrt(np.nansum(step * step, axis=1))
+    extruding = (e > 0) & (g != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        duration = np.where(f > 0, np.maximum(length, np.abs(e)) / (f / 60.0), 0.0)
+
+    order = np.flatnonzero(layer >= 0)
+    order = order[np.argsort(layer[order], kind="stable")]
+    if order.size == 0:
+        return []
+    layer = layer[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(layer)) + 1))
+
+    def per_layer(reduce, values):
+        return reduce.reduceat(values[order], starts)
+
+    bbox = {}
+    for axis, values in (("x", x), ("y", y), ("z", z)):
+        values = np.where(extruding, values, np.nan)
+        bbox[axis] = (per_layer(np.fmin, values), per_layer(np.fmax, values))
+
+    columns = {
+        "layer": layer[starts],
+        "moves": np.diff(np.append(starts, order.size)),
+        "extrusion_length_mm": per_layer(np.add, np.where(extruding, e, 0.0)),
+        "print_distance_mm": per_layer(np.add, np.where(extruding, length, 0.0)),
+        "travel_distance_mm": per_layer(np.add, np.where(extruding, 0.0, length)),
+        "min_feedrate_mm_min": per_layer(np.fmin, f),
+        "max_feedrate_mm_min": per_layer(np.fmax, f),
+        "estimated_time_s": per_layer(np.add, np.nan_to_num(duration)),
+        "z": bbox["z"][1],
+    }
+    columns = {k: _clean(v) for k, v in columns.items()}
+    bbox = {axis: (_clean(lo), _clean(hi)) for axis, (lo, hi) in bbox.items()}
+
+    stats = []
+    for i in range(starts.size):
+        row = {k: v[i] for k, v in columns.items()}
+        row["bbox"] = {
+            "min": [bbox[a][0][i] for a in "xyz"],
+            "max": [bbox[a][1][i] for a in "xyz"],
+        }
+        stats.append(row)
+    return stats
+
+
+if __name__ == "__main__":
+    import sys, time
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/test_gcodes/Keychain_Dual_Color_QOI_0.4n_0.2mm_PLA_COREONE_9m.gcode"
+    t = time.perf_counter()
+    tp = parse_toolpath(Path(path))
+    print(f"{len(tp['x'])} moves, {tp['layer'].max() + 1} layers in {(time.perf_counter() - t) * 1000:.1f} ms")
+    for name in TOOLPATH_COLUMNS:
+        print(name, tp[name][:8])
+    for row in layer_statistics(tp)[:3]:
+        print(row)
@@ -0,0 +1,20 @@
+import mongomock
+import mongomock.gridfs
+import pymongo
+import pytest
+
+# The tests run against mongomock instead of a mongod: the clients are swapped before
+# database.serverHelper creates its own.
+# pip install -r requirements-dev.txt && python -m pytest tests
+mongomock.gridfs.enable_gridfs_integration()
+pymongo.MongoClient = mongomock.MongoClient
+
+import database.serverHelper as sh
+
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    for name in sh.db.list_collection_names():
+        sh.db.drop_collection(name)
+    sh._upload_hashes.clear()
+    yield
@@ -0,0 +1,55 @@
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import UUID
+
+import numpy as np
+import pytest
+from bson import Binary, Decimal128, Int64, ObjectId, json_util
+
+from api.restapi import bson_json
+
+DOC = {
+    "_id": ObjectId("652f1a2b3c4d5e6f70819203"),
+    "inserted_at": datetime(2026, 10, 18, 12, 30, 5, 123000),
+    "aware": datetime(2026, 10, 18, 12, 30, tzinfo=timezone.utc),
+    "before_epoch": datetime(1960, 1, 1),
+    "blob": Binary(b"\x00\x01gcode\xff"),
+    "bytes": b"\x89PNG",
+    "uuid": Binary.from_uuid(UUID("12345678-1234-5678-1234-567812345678")),
+    "decimal": Decimal128(Decimal("1.10")),
+    "long": Int64(2 ** 40),
+    "nan": float("nan"),
+    "inf": [float("inf"), float("-inf"), 1.5, -0.0],
+    "nested": [[1, 2.5, None], [ObjectId("652f1a2b3c4d5e6f70819204"), {"t": datetime(2026, 1, 1)}], [], "ü€"],
+    "tuple": (1, "two", float("nan")),
+    "flags": [True, False],
+}
+
+
+def expected(doc):
+    return json.loads(json_util.dumps(doc))
+
+
+def test_dumps_matches_json_util():
+    assert json.loads(bson_json.dumps(DOC)) == expected(DOC)
+
+
+def test_iter_dumps_matches_dumps():
+    doc = {**DOC, "long_list": [float(i) for i in range(3 * bson_json.STREAM_LIST_SLICE)] + [float("nan"), ObjectId()]}
+    for chunk_size in (1, 100, bson_json.STREAM_CHUNK_SIZE):
+        assert b"".join(bson_json.iter_dumps(doc, chunk_size)) == bson_json.dumps(doc)
+    assert json.loads(bson_json.dumps(doc)) == expected(doc)
+
+
+@pytest.mark.parametrize("arr", [
+    np.arange(20000, dtype=np.int64),
+    np.linspace(0, 1, 20000),
+    np.array([1.0, np.nan, np.inf, -np.inf]),
+    np.array([True, False]),
+])
+def test_numpy_arrays_match_their_lists(arr):
+    doc = {"values": arr, "scalar": arr[0]}
+    as_lists = {"values": arr.tolist(), "scalar": arr[0].item()}
+    assert json.loads(bson_json.dumps(doc)) == expected(as_lists)
+    assert b"".join(bson_json.iter_dumps(doc, 1000)) == bson_json.dumps(doc)
@@ -0,0 +1,39 @@
+import os
+import zipfile
+from io import BytesIO
+
+from bson import ObjectId
+
+import database.serverHelper as sh
+
+FILES = {
+    "print.gcode": b"G1 X10 Y10 E0.5\n" * 5000,
+    "photo.JPG": os.urandom(50000),
+    "preview.png": os.urandom(1000),
+    "notes.txt": b"",
+    "model.3mf": os.urandom(3000),
+}
+
+
+def put_files():
+    return [sh.fs.put(data, filename=name, chunk_size=4096) for name, data in FILES.items()]
+
+
+def test_streamed_zip_reads_back():
+    file_ids = put_files()
+    pieces = list(sh.iter_files_zip([str(file_ids[0]), ObjectId(), *file_ids[1:]]))  # a deleted file is left out
+    assert len(pieces) > len(FILES)  # streamed while the chunks are read, not built at once
+
+    with zipfile.ZipFile(BytesIO(b"".join(pieces))) as z:
+        assert z.testzip() is None
+        assert z.namelist() == list(FILES)
+        for info in z.infolist():
+            assert z.read(info) == FILES[info.filename]
+            stored = os.path.splitext(info.filename)[1].lower() in sh.ZIP_STORED_EXTENSIONS
+            assert info.compress_type == (zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+    assert b"".join(pieces) == sh.download_files_zip([str(file_ids[0]), ObjectId(), *file_ids[1:]])
+
+
+def test_empty_zip():
+    with zipfile.ZipFile(BytesIO(sh.download_files_zip([ObjectId()]))) as z:
+        assert z.namelist() == []
@@ -0,0 +1,17 @@
+from scripts.gcode import extract_gcode
+from scripts.gcode_values import convert_value
+
+GCODE = "data/test_gcodes/Keychain_Dual_Color_QOI_0.4n_0.2mm_PLA_COREONE_9m_small.gcode"
+
+
+def test_time_strings():
+    assert convert_value("9m 15s") == 555
+    assert convert_value("9m 15s", times=False) == "9m 15s"
+    assert convert_value("12", times=False) == 12
+
+
+def test_extract_gcode_keeps_time_strings():
+    info = extract_gcode(GCODE)
+    assert info["estimated printing time (normal mode)"] == "9m 15s"
+    assert info["print_settings_id"] == "(vip) 0.20mm SPEED @COREONE HF0.4"
+    assert not any(key.endswith(" (seconds)") for key in info)
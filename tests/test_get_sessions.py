@@ -0,0 +1,32 @@
+import json
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import api.restapi.server_restapi as srv
+
+
+def test_sessions_are_resolved_one_chunk_at_a_time(monkeypatch):
+    ids = [ObjectId() for _ in range(2 * srv.SESSION_STREAM_CHUNK + 3)]
+    stored = set(ids[::2])
+    chunks = []
+
+    async def get_sessions(oids, summary, include, image_fields, as_arrays):
+        chunks.append(len(oids))
+        if include == ["nope"]:
+            raise ValueError("unknown field")
+        return {oid: {"_id": oid, "summary": summary} for oid in oids if oid in stored}
+
+    monkeypatch.setattr(srv, "get_sessions_with_embedded_info", get_sessions)
+    client = TestClient(srv.app)
+
+    response = client.post("/get_sessions", json={"session_ids": [str(oid) for oid in ids], "summary": True})
+    assert response.status_code == 200
+    assert chunks == [srv.SESSION_STREAM_CHUNK, srv.SESSION_STREAM_CHUNK, 3]
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["_id"]["$oid"] for line in lines] == [str(oid) for oid in ids]
+    for oid, line in zip(ids, lines):
+        assert line == ({"_id": {"$oid": str(oid)}, "summary": True} if oid in stored else {"_id": {"$oid": str(oid)}, "error": "not found"})
+
+    assert client.post("/get_sessions", json={"session_ids": ["zz"]}).status_code == 400
+    assert client.post("/get_sessions", json={"session_ids": [str(ids[0])], "include": ["nope"]}).status_code == 400
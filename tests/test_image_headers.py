@@ -0,0 +1,67 @@
+from io import BytesIO
+
+import pytest
+from PIL import ExifTags, Image
+
+from scripts.image_headers import read_image_header
+
+
+def pillow_header(data):
+    # What decoding with Pillow reports, as extract_image_data did before the header reader
+    image = Image.open(BytesIO(data))
+    exif = image._getexif() if hasattr(image, "_getexif") else image.getexif()._get_merged_dict()
+    return {
+        "original_format": image.format,
+        "mode": image.mode,
+        "width": image.size[0],
+        "height": image.size[1],
+        "dpi": list(image.info["dpi"]) if "dpi" in image.info else None,
+        "exif": {str(ExifTags.TAGS.get(k, k)) for k in (exif or {})},
+    }
+
+
+def encode(fmt, mode, **kwargs):
+    exif = Image.Exif()
+    exif[0x010F] = "Prusa"  # Make
+    exif[0x0110] = "MK4 camera"  # Model
+    exif[0x0132] = "2026:10:18 12:00:00"  # DateTime
+    output = BytesIO()
+    Image.new(mode, (321, 123)).save(output, format=fmt, exif=exif.tobytes(), **kwargs)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("data", [
+    encode("PNG", "RGB", dpi=(300, 300)),
+    encode("PNG", "RGBA"),
+    encode("PNG", "L", dpi=(72, 96)),
+    encode("JPEG", "RGB", dpi=(300, 300)),
+    encode("JPEG", "L"),
+    encode("JPEG", "CMYK", dpi=(150, 150)),
+], ids=["png-rgb", "png-rgba", "png-l", "jpeg-rgb", "jpeg-l", "jpeg-cmyk"])
+def test_header_matches_pillow(data):
+    header = read_image_header(data)
+    expected = pillow_header(data)
+
+    assert {k: header[k] for k in ("original_format", "mode", "width", "height")} == {k: expected[k] for k in ("original_format", "mode", "width", "height")}
+    if expected["dpi"] is None:
+        assert header["dpi"] is None
+    else:
+        assert header["dpi"] == pytest.approx(expected["dpi"], abs=0.01)
+    assert set(header["exif"]) == expected["exif"]
+    assert header["exif"]["Make"] == "Prusa" and header["exif"]["Model"] == "MK4 camera"
+    if header["original_format"] == "JPEG":
+        assert header["bit_depth"] == 8
+
+
+def test_header_reads_streams_from_their_position():
+    data = encode("JPEG", "RGB")
+    f = BytesIO(b"prefix" + data)
+    f.seek(6)
+    assert read_image_header(f)["width"] == 321
+
+
+def test_unsupported_format():
+    output = BytesIO()
+    Image.new("RGB", (4, 4)).save(output, format="GIF")
+    with pytest.raises(ValueError):
+        read_image_header(output.getvalue())
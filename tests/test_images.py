@@ -0,0 +1,89 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import database.serverHelper as sh
+from scripts.classes.dataclass import DataClass
+
+
+def jpeg(color, comment=b""):
+    output = BytesIO()
+    Image.new("RGB", (200, 100), color).save(output, format="JPEG")
+    data = output.getvalue()
+    if comment:
+        # A COM segment changes the file hash but not the decoded pixels, so both convert to one PNG
+        data = data[:2] + b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + data[2:]
+    return DataClass(data, mime_type="image/jpeg", name="img.jpg")
+
+
+def png(color, size=(100, 50)):
+    output = BytesIO()
+    Image.new("RGB", size, color).save(output, format="PNG")
+    return DataClass(output.getvalue(), mime_type="image/png", name="img.png")
+
+
+def batch():
+    a, b = jpeg((10, 120, 200)), jpeg((200, 30, 30))
+    return [a, png((0, 255, 0)), a, jpeg((10, 120, 200), b"re-saved"), b, png((0, 255, 0)), jpeg((10, 120, 200), b"again")]
+
+
+def snapshot(ids):
+    # Ids differ between runs: compare which positions share an image and what each stored image records
+    docs = {img["_id"]: img for img in sh.db["images"].find()}
+    return (
+        [ids.index(img_id) for img_id in ids],
+        sorted((doc["hash_id"], sorted(doc["source_hash_ids"])) for doc in docs.values()),
+        [docs[img_id]["hash_id"] for img_id in ids],
+    )
+
+
+@pytest.mark.parametrize("stored", [False, True])
+def test_parallel_matches_sequential(stored):
+    images = batch()
+    if stored:
+        sh.create_images([images[1]])  # an image of the batch is already in the database
+    expected = snapshot(sh.create_images(images))
+
+    for name in sh.db.list_collection_names():
+        sh.db.drop_collection(name)
+    if stored:
+        sh.create_images([images[1]])
+    assert snapshot(sh.create_images_parallel(images, workers=2, upload_threads=2, max_pending=2)) == expected
+
+
+def test_every_original_is_recorded_on_the_shared_image():
+    images = batch()
+    ids = sh.create_images_parallel(images, workers=2)
+
+    assert sh.db["images"].count_documents({}) == 3
+    sources = sh.db["images"].find_one({"_id": ids[0]})["source_hash_ids"]
+    assert sorted(sources) == sorted({images[i].hash_id for i in (0, 3, 6)})
+    # The next upload of any of them is resolved without decoding
+    known = sh.find_existing_images([images[3].hash_id, images[6].hash_id])
+    assert known[images[3].hash_id] == known[images[6].hash_id] == ids[0]
+
+
+def test_preview_selection():
+    img = {"file_id": "original", "previews": {"160": "p160", "640": "p640", "1280": "p1280"}}
+    assert sh._preview_file(img, 100) == ("p160", sh.PREVIEW_MIME)
+    assert sh._preview_file(img, 160) == ("p160", sh.PREVIEW_MIME)
+    assert sh._preview_file(img, 161) == ("p640", sh.PREVIEW_MIME)
+    assert sh._preview_file(img, 1280) == ("p1280", sh.PREVIEW_MIME)
+    assert sh._preview_file(img, 1281) == ("original", "image/png")
+    # Images ingested before previews existed
+    assert sh._preview_file({"file_id": "original"}, 160) == ("original", "image/png")
+
+
+def test_previews_stored_at_ingest():
+    large, small = png((0, 0, 255), (800, 400)), png((255, 0, 0))
+    large_id, small_id = sh.create_images([large, small])
+
+    previews = sh.db["images"].find_one({"_id": large_id})["previews"]
+    assert sorted(previews, key=int) == ["160", "640"]  # 1280 is not smaller than the image
+    data, media_type = sh.get_image_preview(large_id, 200)
+    assert media_type == sh.PREVIEW_MIME and Image.open(BytesIO(data)).size == (640, 320)
+    assert sh.get_image_preview(large_id, 1000) == (large.bytes, "image/png")
+    assert sh.db["images"].find_one({"_id": small_id})["previews"] == {}
+    assert sh.get_image_preview(small_id, 160) == (small.bytes, "image/png")
+
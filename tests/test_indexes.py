@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import database.serverHelper as sh
+
+
+def test_duplicates_are_reported_not_raised():
+    sh.db["printers"].insert_many([{"printer_id": "p1"}, {"printer_id": "p1"}, {"printer_id": "p2"}])
+    failed = sh.ensure_indexes(force=True)
+
+    assert list(failed) == [("printers", ("printer_id",))]
+    assert "'printer_id': 'p1'" in failed[("printers", ("printer_id",))]
+    assert "hash_id_1" in sh.db["images"].index_information()  # the other indexes were still built
+
+
+def test_concurrent_writers_share_one_document():
+    sh.ensure_indexes(force=True)
+    with ThreadPoolExecutor(8) as pool:
+        printers = set(pool.map(lambda _: sh.create_printer("p1"), range(16)))
+        dictionaries = set(pool.map(lambda _: sh.get_dictionary("p1", "PrusaSlicer")[1], range(16)))
+    assert len(printers) == 1 and sh.db["printers"].count_documents({}) == 1
+    assert len(dictionaries) == 1 and sh.db["dictionaries"].count_documents({}) == 1
+
+
+def test_main_dictionary():
+    dict_id, main_dict = sh.get_main_dictionary_id()
+    assert main_dict == {} and sh.get_main_dictionary_id() == (dict_id, {})
+    sh.append_to_main_dictionary({"Slicer": "slicer"})
+    assert sh.get_main_dictionary_id()[1] == {"slicer": "slicer"}
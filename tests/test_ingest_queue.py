@@ -0,0 +1,130 @@
+import io
+from datetime import datetime, timedelta
+
+import h5py
+import numpy as np
+import pytest
+from PIL import Image
+
+import database.serverHelper as sh
+import scripts.ingest_worker as worker
+from scripts.classes.dataclass import DataClass
+
+GCODE = "data/test_gcodes/Keychain_Dual_Color_QOI_0.4n_0.2mm_PLA_COREONE_9m_small.gcode"
+
+
+def h5_file(name="p.h5"):
+    buf = io.BytesIO()
+    with h5py.File(buf, "w") as f:
+        f["power"] = np.arange(1000, dtype=float)
+        f["current"] = np.ones(50)
+    return DataClass(buf.getvalue(), name=name)
+
+
+def jpeg(color):
+    buf = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(buf, "JPEG")
+    return DataClass(buf.getvalue(), mime_type="image/jpeg", name=f"{color}.jpg")
+
+
+def expire(coll_name, doc_id):
+    sh.db[coll_name].update_one({"_id": doc_id}, {"$set": {"ingest.heartbeat_at": datetime.now() - timedelta(hours=1)}})
+
+
+def test_staged_upload_is_ingested():
+    object_id = sh.stage_object([h5_file()])
+    with open(GCODE, "rb") as f:
+        job_id = sh.stage_print_job(DataClass(f.read(), name="k.gcode"), printer_id="P1", object_id=object_id)
+    coll_id = sh.stage_image_collection("c", [jpeg("red"), jpeg("blue"), jpeg("red")])
+    session_id = sh.stage_session([h5_file()], {"m": 1}, job_id, [coll_id])
+
+    assert worker.run_worker("w1", drain=True) == 4
+    assert sh.get_ingest_overview() == {coll_name: {} for coll_name in sh.INGEST_COLLECTIONS}
+
+    session = sh.db["print_sessions"].find_one({"_id": session_id})
+    assert session["status"] == "ingested" and "staged" not in session
+    assert sorted(session["timeseries"]) == ["current", "power"]
+    job = sh.db["print_jobs"].find_one({"_id": job_id})
+    assert job["metadata"]["Slicer"] == "PrusaSlicer" and set(job["toolpath"]) >= {"x", "y", "z"}
+    assert len(sh.db["image_collections"].find_one({"_id": coll_id})["image_file_ids"]) == 3
+    assert sh.db["staging.files"].count_documents({}) == 0
+    # Only the ingested timeseries exist
+    assert sh.db["timeseries"].count_documents({}) == 2 + len(job["toolpath"])
+
+
+def test_staging_dedups_before_ingestion(monkeypatch):
+    with open(GCODE, "rb") as f:
+        gcode = f.read()
+    first = sh.stage_print_job(DataClass(gcode, name="k.gcode"), printer_id="P1")
+    assert sh.stage_print_job(DataClass(gcode, name="again.gcode"), printer_id="P1") == first
+    assert sh.stage_print_job(DataClass(gcode, name="k.gcode"), printer_id="P2") != first
+
+    sh.ensure_indexes(force=True)
+    object_id = sh.stage_object([h5_file()])
+    # Another upload staged the same object between the lookup and the insert
+    real_find_one = type(sh.db["objects"]).find_one
+    calls = []
+    def find_one(self, *args, **kwargs):
+        if self.name == "objects" and not calls:
+            calls.append(1)
+            return None
+        return real_find_one(self, *args, **kwargs)
+    monkeypatch.setattr(type(sh.db["objects"]), "find_one", find_one)
+    assert sh.stage_object([h5_file()]) == object_id
+
+
+def test_claims_are_exclusive():
+    session_id = sh.stage_session([h5_file()])
+    coll_name, doc = sh.claim_ingest_job("w1")
+    assert (coll_name, doc["_id"], doc["ingest"]["attempts"]) == ("print_sessions", session_id, 1)
+    assert sh.claim_ingest_job("w2") is None
+    assert not sh.complete_ingest(coll_name, session_id, "w2")
+
+
+def test_lease_expiry_reclaims_and_drops_the_dead_attempt():
+    session_id = sh.stage_session([h5_file()])
+    coll_name, doc = sh.claim_ingest_job("w1")
+    # w1 wrote a timeseries, then died
+    orphan = sh.create_timeseries("power", np.arange(10), timeseries_id=sh.reserve_ingest_output(coll_name, session_id, "w1"))
+
+    expire(coll_name, session_id)
+    coll_name, doc = sh.claim_ingest_job("w2")
+    assert doc["ingest"]["worker"] == "w2" and doc["ingest"]["attempts"] == 2
+    assert sh.db["timeseries"].count_documents({"_id": orphan}) == 0
+    assert sh.db["timeseries_buckets"].count_documents({"timeseries_id": orphan}) == 0
+    assert not sh.report_ingest_progress(coll_name, session_id, "w1", 1, 2)  # w1 lost its claim
+
+    assert worker.ingest(coll_name, doc, "w2")
+    assert sh.db["timeseries"].count_documents({}) == 2
+
+
+def test_failure_drops_written_timeseries_and_can_be_retried(monkeypatch):
+    session_id = sh.stage_session([h5_file(), h5_file("broken.h5")])
+    broken = sh.db["print_sessions"].find_one({"_id": session_id})["staged"]["h5_file_ids"][1]
+    sh.fs.delete(broken)  # the second file can't be read: the first one's timeseries are already written
+
+    assert worker.run_worker("w1", drain=True) == 0
+    session = sh.db["print_sessions"].find_one({"_id": session_id})
+    assert session["status"] == "failed" and "NoFile" in session["ingest"]["error"]
+    assert sh.db["timeseries"].count_documents({}) == 0
+    assert sh.db["timeseries_buckets"].count_documents({}) == 0
+
+    assert sh.retry_failed_ingests() == 1
+    assert sh.get_ingest_overview()["print_sessions"] == {"queued": 1}
+
+
+def test_gives_up_after_max_attempts():
+    session_id = sh.stage_session([h5_file()])
+    for _ in range(sh.INGEST_MAX_ATTEMPTS):
+        assert sh.claim_ingest_job("w")[1]["_id"] == session_id
+        expire("print_sessions", session_id)
+    assert sh.claim_ingest_job("w") is None
+    session = sh.db["print_sessions"].find_one({"_id": session_id})
+    assert session["status"] == "failed" and "Gave up" in session["ingest"]["error"]
+
+
+def test_release_does_not_count_the_attempt():
+    session_id = sh.stage_session([h5_file()])
+    coll_name, _ = sh.claim_ingest_job("w1")
+    assert sh.release_ingest_job(coll_name, session_id, "w1")
+    assert sh.claim_ingest_job("w2")[1]["ingest"]["attempts"] == 1
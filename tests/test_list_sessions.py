@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+import database.serverHelper as sh
+from scripts.classes.dataclass import DataClass
+
+
+def create_sessions(n):
+    ids = []
+    for i in range(n):
+        files = [DataClass(f"G1 X{i}\n".encode(), name=f"{i}.gcode")] * (i % 3)
+        ids.append(sh.create_session(files, {"n": i})[0])
+    return ids
+
+
+def all_pages(limit, **kwargs):
+    pages, after = [], None
+    while True:
+        page = sh.list_sessions(after=after, limit=limit, **kwargs)
+        pages.append(page)
+        after = page["next"]
+        if after is None:
+            return pages
+
+
+def expected_order(sort, descending):
+    key = (lambda s: s["_id"]) if sort == "_id" else (lambda s: (s["inserted_at"], s["_id"]))
+    return [s["_id"] for s in sorted(sh.db["print_sessions"].find(), key=key, reverse=descending)]
+
+
+@pytest.mark.parametrize("sort", sh.SESSION_SORT_FIELDS)
+@pytest.mark.parametrize("descending", [True, False])
+@pytest.mark.parametrize("limit", [1, 3, 7, 10])
+def test_pages_cover_every_session_once(sort, descending, limit):
+    create_sessions(7)
+    pages = all_pages(limit, sort=sort, descending=descending)
+
+    listed = [s["_id"] for page in pages for s in page["sessions"]]
+    assert listed == expected_order(sort, descending)
+    assert all(len(page["sessions"]) == limit for page in pages[:-1]) and 1 <= len(pages[-1]["sessions"]) <= limit
+    assert all(page["total"] == 7 for page in pages)
+
+
+def test_inserted_at_ties_are_broken_by_id():
+    ids = create_sessions(9)
+    # Sessions created in the same instant, and one pair out of _id order
+    tie = datetime(2026, 10, 18, 12, 0)
+    sh.db["print_sessions"].update_many({"_id": {"$in": ids[2:7]}}, {"$set": {"inserted_at": tie}})
+    sh.db["print_sessions"].update_one({"_id": ids[0]}, {"$set": {"inserted_at": tie + timedelta(hours=1)}})
+
+    for descending in (True, False):
+        for limit in (1, 2, 4):
+            pages = all_pages(limit, sort="inserted_at", descending=descending)
+            listed = [s["_id"] for page in pages for s in page["sessions"]]
+            assert len(listed) == len(set(listed)) == 9
+            assert listed == expected_order("inserted_at", descending)
+
+
+def test_summary_fields():
+    create_sessions(3)
+    page = sh.list_sessions(sort="_id", descending=False)
+    assert [s["n_files"] for s in page["sessions"]] == [0, 1, 2]
+    assert set(page["sessions"][0]) <= {"_id", *sh.SESSION_SUMMARY_PROJECTION}
+    assert "metadata" not in page["sessions"][0] and "raw_files" not in page["sessions"][0]
+    assert page["next"] is None
+
+
+def test_empty():
+    assert sh.list_sessions() == {"sessions": [], "next": None, "total": 0}
+
+
+def test_after_unknown_session():
+    create_sessions(2)
+    missing = ObjectId()
+    with pytest.raises(ValueError, match=f"Session {missing} not found."):
+        sh.list_sessions(after=missing)
+
+
+@pytest.mark.parametrize("kwargs", [{"limit": 0}, {"limit": sh.SESSION_MAX_PAGE_SIZE + 1}, {"sort": "status"}])
+def test_bad_arguments(kwargs):
+    with pytest.raises(ValueError):
+        sh.list_sessions(**kwargs)
@@ -0,0 +1,52 @@
+import pytest
+
+import database.serverHelper as sh
+
+BASE = 0x0123456789abcdef
+
+
+def flip(h, flips_per_band):
+    # Flip the lowest bits of each 16-bit band, flips_per_band[band] of them
+    for band, flips in enumerate(flips_per_band):
+        for b in range(flips):
+            h ^= 1 << (16 * (sh.PHASH_BANDS - 1 - band) + b)
+    return f"{h:016x}"
+
+
+def store(phash):
+    return sh.db["images"].insert_one({"hash_id": phash, **sh._phash_fields(phash)}).inserted_id
+
+
+def test_search_distance_matches_band_flips():
+    assert sh.PHASH_MAX_SEARCH_DISTANCE // sh.PHASH_BANDS == sh.PHASH_MAX_BAND_FLIPS
+    assert (sh.PHASH_MAX_SEARCH_DISTANCE + 1) // sh.PHASH_BANDS > sh.PHASH_MAX_BAND_FLIPS
+
+
+@pytest.mark.parametrize("flips, max_distance", [
+    ((2, 2, 2, 2), 8),
+    ((1, 3, 2, 2), 8),
+    ((4, 4, 4, 3), 15),
+    ((0, 0, 0, 0), 0),
+])
+def test_within_distance_is_found(flips, max_distance):
+    near = store(flip(BASE, flips))
+    store(flip(BASE, (5, 5, 5, 5)))
+    assert sh.find_similar_images_by_hash(f"{BASE:016x}", max_distance) == [(near, sum(flips))]
+
+
+def test_beyond_distance_is_skipped():
+    store(flip(BASE, (3, 2, 2, 2)))  # 9 bits, shares a band with 2 flips
+    assert sh.find_similar_images_by_hash(f"{BASE:016x}", 8) == []
+    assert len(sh.find_similar_images_by_hash(f"{BASE:016x}", 9)) == 1
+
+
+def test_closest_first_and_self_excluded():
+    base = store(f"{BASE:016x}")
+    far = store(flip(BASE, (2, 1, 0, 0)))
+    near = store(flip(BASE, (1, 0, 0, 0)))
+    assert sh.find_similar_images(base) == [(near, 1), (far, 3)]
+
+
+def test_distance_out_of_range():
+    with pytest.raises(ValueError):
+        sh.find_similar_images_by_hash(f"{BASE:016x}", sh.PHASH_MAX_SEARCH_DISTANCE + 1)
@@ -0,0 +1,31 @@
+import os
+
+import database.serverHelper as sh
+from scripts.classes.dataclass import DataClass
+
+
+def test_dedup_by_hash():
+    data = os.urandom(1000)
+    first = sh.put_files([DataClass(data, name="a"), DataClass(data, name="b")])
+    assert first[0] == first[1] == sh.put_file(DataClass(data, name="c"))
+    assert sh.db["fs.files"].count_documents({}) == 1
+
+
+def test_lost_race_drops_its_chunks(monkeypatch):
+    sh.ensure_indexes(force=True)
+    data = os.urandom(300 * 1024)  # two GridFS chunks
+    stored = sh.put_file(DataClass(data, name="a"))
+
+    # The other writer stored the file between the hash lookup and fs.put
+    collection = type(sh.db["fs.files"])
+    real_find = collection.find
+    def find(self, query=None, *args, **kwargs):
+        if self.name == "fs.files" and "$in" in str(query):
+            return iter([])
+        return real_find(self, query, *args, **kwargs)
+    monkeypatch.setattr(collection, "find", find)
+    assert sh.put_file(DataClass(data, name="b")) == stored
+    monkeypatch.undo()
+
+    assert sh.db["fs.files"].count_documents({}) == 1
+    assert sh.db["fs.chunks"].count_documents({}) == sh.db["fs.chunks"].count_documents({"files_id": stored}) == 2
@@ -0,0 +1,25 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api.restapi.server_restapi as srv
+
+client = TestClient(srv.app)
+
+
+@pytest.mark.parametrize("method, url, body", [
+    ("get", "/sessions?after=nope", None),
+    ("get", "/get_session/nope", None),
+    ("post", "/get_sessions", {"session_ids": ["nope"]}),
+    ("get", "/session_files_zip/nope", None),
+    ("get", "/gcode_layer/nope/0", None),
+    ("get", "/image_preview/nope", None),
+    ("get", "/similar_images/nope", None),
+    ("get", "/timeseries/nope", None),
+    ("get", "/uploads/nope", None),
+    ("put", "/uploads/nope/chunks/0", None),
+    ("post", "/uploads/nope/finish", None),
+    ("delete", "/uploads/nope", None),
+])
+def test_malformed_ids_are_rejected(method, url, body):
+    response = client.request(method, url, json=body)
+    assert response.status_code == 400, response.text
@@ -0,0 +1,55 @@
+import asyncio
+
+import numpy as np
+import pytest
+from pymongo.errors import OperationFailure
+
+import database.asyncServerHelper as ash
+import database.serverHelper as sh
+from scripts.classes.dataclass import DataClass
+
+
+@pytest.fixture
+def session_id():
+    ts = sh.create_timeseries("power", np.arange(100, dtype=float))
+    session_id, _ = sh.create_session([DataClass(b"a,b\n1,2\n", name="t.csv")], {"operator": "x"}, timeseries={"power": ts})
+    return session_id
+
+
+def too_large(code):
+    def aggregate(*args, **kwargs):
+        raise OperationFailure("Total size of documents in images matching pipeline's $lookup stage exceeds 16793600 bytes", code=code)
+    return aggregate
+
+
+@pytest.mark.parametrize("code", sh.DOCUMENT_TOO_LARGE_CODES)
+def test_falls_back_to_sequential(monkeypatch, session_id, code):
+    monkeypatch.setattr(type(sh.db["print_sessions"]), "aggregate", too_large(code))
+
+    session = sh.get_session_with_embedded_info(session_id)
+    assert session["_id"] == session_id and session["metadata"] == {"operator": "x"}
+    assert list(session["timeseries_info"]["power"]["data"]) == list(range(100))
+
+    batch = sh.get_sessions_with_embedded_info([session_id, sh.ObjectId()])
+    assert list(batch) == [session_id]
+    assert list(batch[session_id]["timeseries_info"]["power"]["data"]) == list(range(100))
+
+
+def test_other_errors_are_raised(monkeypatch, session_id):
+    monkeypatch.setattr(type(sh.db["print_sessions"]), "aggregate", too_large(2))
+    with pytest.raises(OperationFailure):
+        sh.get_session_with_embedded_info(session_id)
+
+
+@pytest.mark.parametrize("code", sh.DOCUMENT_TOO_LARGE_CODES)
+def test_async_falls_back_to_sequential(monkeypatch, code):
+    async def aggregate(*args, **kwargs):
+        too_large(code)()
+    async def sequential(session_id, *args):
+        return {"_id": session_id, "sequential": True}
+    monkeypatch.setattr(type(ash.db["print_sessions"]), "aggregate", aggregate)
+    monkeypatch.setattr(ash, "get_session_with_embedded_info_sequential", sequential)
+
+    session_id = sh.ObjectId()
+    assert asyncio.run(ash.get_session_with_embedded_info(session_id))["sequential"]
+    assert asyncio.run(ash.get_sessions_with_embedded_info([session_id]))[session_id]["sequential"]
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import database.serverHelper as sh
+
+
+@pytest.fixture
+def series():
+    return sh.create_timeseries("power", np.arange(1000, dtype=float), bucket_size=64, sample_rate=10.0, start_time=5.0)
+
+
+def test_sample_bounds(series):
+    result = sh.read_timeseries_range(series, start=1, stop=5)
+    assert (result["start"], result["stop"]) == (1, 5)
+    assert result["data"].tolist() == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_float_sample_bounds(series):
+    # e.g. /timeseries/<id>?start=1&stop=5 parses them as floats
+    assert sh.read_timeseries_range(series, start=1.0, stop=5.0)["data"].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert sh.read_timeseries_range(series, start=1.5, stop=4.2)["data"].tolist() == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_time_bounds(series):
+    result = sh.read_timeseries_range(series, start=5.25, stop=5.45, unit="time")
+    assert (result["start"], result["stop"]) == (2, 5)
+    assert np.allclose(result["time"], [5.2, 5.3, 5.4])
+
+
+def test_bounds_are_clipped(series):
+    result = sh.read_timeseries_range(series, start=-10.0, stop=1e9)
+    assert (result["start"], result["stop"]) == (0, 1000)
+
+
+def test_downsampled_with_float_bounds(series):
+    result = sh.read_timeseries_range(series, start=0.0, stop=1000.0, resolution=100)
+    assert len(result["mean"]) <= 100
+
+
+def test_unaligned_ranges_stay_within_resolution():
+    data = np.arange(20000, dtype=float)
+    series = sh.create_timeseries("long", data, bucket_size=512)
+    rng = np.random.default_rng(0)
+    # 160 samples are 10 blocks of 16, but 8..167 touches 11 of them
+    cases = [(8, 168, 10), (8, 168 + 16 * 16 * 9, 10)]
+    cases += [(*sorted(rng.integers(0, len(data), 2)), int(rng.integers(1, 300))) for _ in range(200)]
+    for start, stop, resolution in cases:
+        result = sh.read_timeseries_range(series, start=start, stop=stop, resolution=resolution)
+        values = result["data"] if result["level"] == 0 else result["mean"]
+        assert len(values) <= resolution and len(values) == len(result["index"])
+        if result["level"] == 0:
+            assert values.tolist() == data[start:stop].tolist()
+
+
+@pytest.mark.parametrize("kwargs", [{"unit": "minutes"}, {"start": float("nan")}, {"stop": float("inf")}, {"resolution": 0}, {"resolution": -3}])
+def test_bad_bounds(series, kwargs):
+    with pytest.raises(ValueError):
+        sh.read_timeseries_range(series, **kwargs)
+
+
+def test_time_needs_sample_rate():
+    series = sh.create_timeseries("x", np.arange(10))
+    with pytest.raises(ValueError):
+        sh.read_timeseries_range(series, start=0.0, stop=1.0, unit="time")
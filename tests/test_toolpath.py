@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+import database.serverHelper as sh
+from scripts.toolpath import TOOLPATH_COLUMNS, layer_byte_index, layer_statistics, parse_toolpath
+
+GCODE = b"""; generated by hand
+G90
+M83
+G28 ; home
+G1 Z0.2 F600
+;LAYER_CHANGE
+;Z:0.2
+G1 X10 Y0 E1.5 F1200
+G1 X10 Y10 E1.5
+G0 X0 Y10 F6000 ; travel
+G1 E-0.8 F2100 ; retract
+;LAYER_CHANGE
+;Z:0.4
+G1 Z0.4 F600
+G1 X0 Y0 E2 F1200
+  G1 X5 Y0 E1 ; indented
+M82
+G92 E0
+G1 X5 Y5 E3
+G1 X0 Y5 E4
+"""
+
+
+@pytest.fixture
+def toolpath():
+    return parse_toolpath(GCODE)
+
+
+def test_columns(toolpath):
+    assert set(toolpath) == set(TOOLPATH_COLUMNS)
+    assert toolpath["line"].tolist() == [5, 8, 9, 10, 11, 14, 15, 16, 19, 20]
+    assert np.allclose(toolpath["x"], [np.nan, 10, 10, 0, 0, 0, 0, 5, 5, 0], equal_nan=True)
+    assert np.allclose(toolpath["y"], [np.nan, 0, 10, 10, 10, 10, 0, 0, 5, 5], equal_nan=True)
+    assert np.allclose(toolpath["z"], [0.2] * 5 + [0.4] * 5)
+    assert toolpath["f"].tolist() == [600, 1200, 1200, 6000, 2100, 600, 1200, 1200, 1200, 1200]
+    assert toolpath["g"].tolist() == [1, 1, 1, 0, 1, 1, 1, 1, 1, 1]
+    assert toolpath["layer"].tolist() == [-1, 0, 0, 0, 0, 1, 1, 1, 1, 1]
+
+
+def test_extrusion_per_move(toolpath):
+    # M83: E is the move's own extrusion; after M82 + G92 E0 it is the difference of positions
+    assert np.allclose(toolpath["e"], [0, 1.5, 1.5, 0, -0.8, 0, 2, 1, 3, 1])
+
+
+def test_g90_after_m83_makes_e_absolute():
+    toolpath = parse_toolpath(b"M83\nG90\nG1 X1 E1\nG1 X2 E1.5\n")
+    assert np.allclose(toolpath["e"], [1, 0.5])
+
+
+def test_layers_without_markers_follow_z():
+    toolpath = parse_toolpath(b"G1 Z0.2\nG1 X1 E1\nG1 Z0.4\nG1 X2 E1\nG1 Z0.3\nG1 Z0.6\n")
+    assert toolpath["layer"].tolist() == [0, 0, 1, 1, 1, 2]
+
+
+@pytest.mark.parametrize("gcode", [b"", b"; only comments\nM104 S200\n", b"G92 E0\n"])
+def test_no_moves(gcode):
+    toolpath = parse_toolpath(gcode)
+    assert all(toolpath[name].size == 0 for name in TOOLPATH_COLUMNS)
+
+
+def test_layer_statistics(toolpath):
+    stats = layer_statistics(toolpath)
+    assert [row["layer"] for row in stats] == [0, 1]  # the move before the first marker is left out
+
+    first, second = stats
+    assert first["moves"] == 4 and second["moves"] == 5
+    assert first["extrusion_length_mm"] == pytest.approx(3.0)
+    assert first["print_distance_mm"] == pytest.approx(10.0)
+    assert first["travel_distance_mm"] == pytest.approx(10.0)  # the G0 move; the retraction moves nothing
+    assert (first["min_feedrate_mm_min"], first["max_feedrate_mm_min"]) == (1200, 6000)
+    # length (or |e| when only the filament moves) / feedrate: 1.5/20 + 10/20 + 10/100 + 0.8/35
+    assert first["estimated_time_s"] == pytest.approx(0.075 + 0.5 + 0.1 + 0.8 / 35)
+    assert first["bbox"] == {"min": [10.0, 0.0, 0.2], "max": [10.0, 10.0, 0.2]}
+
+    assert second["extrusion_length_mm"] == pytest.approx(7.0)
+    assert second["print_distance_mm"] == pytest.approx(25.0)
+    assert second["travel_distance_mm"] == pytest.approx(0.2)
+    assert second["z"] == pytest.approx(0.4)
+    assert second["bbox"] == {"min": [0.0, 0.0, 0.4], "max": [5.0, 5.0, 0.4]}
+
+
+def test_layer_statistics_without_moves():
+    assert layer_statistics(parse_toolpath(b"")) == []
+
+
+def test_layer_byte_index_starts_at_markers(toolpath):
+    index = layer_byte_index(GCODE, toolpath)
+    assert len(index) == 2
+    assert index[0][1] == index[1][0] and index[1][1] == len(GCODE)
+    first, second = (GCODE[start:end] for start, end in index)
+    assert first.startswith(b";LAYER_CHANGE\n;Z:0.2\n") and first.endswith(b"G1 E-0.8 F2100 ; retract\n")
+    assert second.startswith(b";LAYER_CHANGE\n;Z:0.4\n") and second.endswith(b"G1 X0 Y5 E4\n")
+    assert layer_byte_index(GCODE) == index  # parses the toolpath itself
+
+
+def test_layer_byte_index_without_markers():
+    gcode = b"M83\nG1 Z0.2\nG1 X1 E1\nG1 Z0.4\nG1 X2 E1\n; end\n"
+    index = layer_byte_index(gcode)
+    assert [gcode[start:end] for start, end in index] == [b"G1 Z0.2\nG1 X1 E1\n", b"G1 Z0.4\nG1 X2 E1\n"]
+
+
+def test_single_layer_from_gridfs():
+    file_id = sh.fs.put(GCODE, filename="hand.gcode", chunk_size=64)  # layers span several chunks
+    index = layer_byte_index(GCODE)
+    sh.set_gcode_layer_index(file_id, index)
+    for layer, (start, end) in enumerate(index):
+        assert sh.get_gcode_layer(file_id, layer) == GCODE[start:end]
+    assert sh.get_gcode_layer(file_id, 2) is None
+    assert sh.get_gcode_layer(sh.ObjectId(), 0) is None
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import database.serverHelper as sh
+from scripts.classes.dataclass import DataClass
+
+CHUNK = 1000
+
+
+def start(data, name="f.bin"):
+    return sh.start_upload(name, len(data), {"kind": "test"}, chunk_size=CHUNK)["_id"]
+
+
+def send(upload_id, data, order, threads=1):
+    def write(n):
+        return sh.write_upload_chunk(upload_id, n, data[n * CHUNK:(n + 1) * CHUNK])
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(write, order))
+
+
+def stored(file_id):
+    return sh.fs.get(file_id).read()
+
+
+@pytest.mark.parametrize("buffered", [16, 2])  # 2: most chunks don't fit in memory and are read back
+def test_out_of_order_chunks_hash_incrementally(monkeypatch, buffered):
+    monkeypatch.setattr(sh, "UPLOAD_HASH_MEMORY", buffered * CHUNK * sh.UPLOAD_HASH_STATES)
+    data = os.urandom(25 * CHUNK + 17)
+    upload_id = start(data)
+    order = list(range(26))
+    random.Random(buffered).shuffle(order)
+    send(upload_id, data, order, threads=4)
+
+    state = sh._upload_hashes[upload_id]
+    assert state.hashed == 26 and not state.ahead and state.ahead_bytes == 0
+    upload = sh.finish_upload(upload_id)
+    assert upload["hash_id"] == hashlib.sha256(data).hexdigest() == DataClass(data).hash_id
+    assert stored(upload["file_id"]) == data
+
+
+def test_late_first_chunk_reads_each_chunk_back_once(monkeypatch):
+    monkeypatch.setattr(sh, "UPLOAD_HASH_MEMORY", 2 * CHUNK * sh.UPLOAD_HASH_STATES)
+    reads = []
+    real_find_one = type(sh.db["fs.chunks"]).find_one
+    def find_one(self, *args, **kwargs):
+        doc = real_find_one(self, *args, **kwargs)
+        if self.name == "fs.chunks" and doc is not None and "data" in doc:
+            reads.append(doc["n"] if "n" in doc else None)
+        return doc
+    monkeypatch.setattr(type(sh.db["fs.chunks"]), "find_one", find_one)
+
+    data = os.urandom(40 * CHUNK)
+    upload_id = start(data)
+    send(upload_id, data, list(range(1, 40)) + [0])
+    assert len(reads) == 40 - 3  # chunks 3..39 didn't fit in memory: each is read back once
+    assert sh.finish_upload(upload_id)["hash_id"] == hashlib.sha256(data).hexdigest()
+
+
+def test_resume_after_dropped_chunks_and_lost_state():
+    data = os.urandom(7 * CHUNK + 300)
+    upload_id = start(data)
+    send(upload_id, data, [0, 2, 5])
+    assert sh.get_upload(upload_id)["missing"] == [1, 3, 4, 6, 7]
+    with pytest.raises(ValueError):
+        sh.finish_upload(upload_id)
+
+    sh._upload_hashes.clear()  # server restarted
+    send(upload_id, data, sh.get_upload(upload_id)["missing"])
+    send(upload_id, data, [0, 1])  # retries are no-ops
+    upload = sh.finish_upload(upload_id)
+    assert upload["hash_id"] == hashlib.sha256(data).hexdigest()
+    assert stored(upload["file_id"]) == data
+
+
+def test_finish_dedups_against_put_file():
+    data = os.urandom(3 * CHUNK)
+    file_id = sh.put_file(DataClass(data, name="x"))
+    upload_id = start(data)
+    send(upload_id, data, [2, 1, 0])
+
+    upload = sh.finish_upload(upload_id)
+    assert upload["file_id"] == file_id
+    assert sh.db["fs.chunks"].count_documents({"files_id": upload_id}) == 0
+    assert sh.finish_upload(upload_id)["file_id"] == file_id  # finishing again
+
+
+def test_finish_twice_keeps_the_file():
+    data = os.urandom(3 * CHUNK)
+    upload_id = start(data)
+    send(upload_id, data, [0, 1, 2])
+
+    first, second = sh.finish_upload(upload_id), sh.finish_upload(upload_id)
+    assert first["file_id"] == second["file_id"] == upload_id
+    assert sh.db["fs.chunks"].count_documents({"files_id": upload_id}) == 3
+    assert stored(upload_id) == data
+
+
+def test_concurrent_finish_keeps_the_file():
+    data = os.urandom(3 * CHUNK)
+    upload_id = start(data)
+    send(upload_id, data, [0, 1, 2])
+
+    barrier = threading.Barrier(4)
+    def finish():
+        barrier.wait()
+        try:
+            return sh.finish_upload(upload_id)["file_id"]
+        except ValueError:
+            return None  # "being finished by another request"
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: finish(), range(4)))
+
+    assert upload_id in results and set(results) <= {upload_id, None}
+    assert sh.db["fs.chunks"].count_documents({"files_id": upload_id}) == 3
+    assert stored(upload_id) == data
+    assert sh.finish_upload(upload_id)["file_id"] == upload_id
+
+
+@pytest.mark.parametrize("duplicate", [False, True])
+def test_crashed_finish_is_redone(monkeypatch, duplicate):
+    data = os.urandom(3 * CHUNK)
+    if duplicate:
+        file_id = sh.put_file(DataClass(data, name="x"))
+    upload_id = start(data)
+    send(upload_id, data, [0, 1, 2])
+
+    # The process dies right after dropping the chunks of a duplicate (or after storing the file)
+    real_update_one = type(sh.db["uploads"]).update_one
+    def update_one(self, query, update, *args, **kwargs):
+        if self.name == "uploads" and update.get("$set", {}).get("status") == "done":
+            raise SystemExit("crash")
+        return real_update_one(self, query, update, *args, **kwargs)
+    monkeypatch.setattr(type(sh.db["uploads"]), "update_one", update_one)
+    with pytest.raises(SystemExit):
+        sh.finish_upload(upload_id)
+    monkeypatch.undo()
+
+    sh.db["uploads"].update_one({"_id": upload_id}, {"$set": {"updated_at": sh.datetime.now() - 2 * sh.UPLOAD_FINISH_LEASE}})
+    upload = sh.finish_upload(upload_id)
+    assert upload["status"] == "done" and upload["hash_id"] == hashlib.sha256(data).hexdigest()
+    assert upload["file_id"] == (file_id if duplicate else upload_id)
+    assert stored(upload["file_id"]) == data
+    assert sh.db["fs.files"].count_documents({}) == 1
+
+
+def test_chunk_validation_and_abort():
+    upload_id = sh.start_upload("r", 2500, chunk_size=CHUNK)["_id"]
+    for n, size in [(3, 1000), (2, 1000), (0, 999)]:
+        with pytest.raises(ValueError):
+            sh.write_upload_chunk(upload_id, n, b"x" * size)
+    assert sh.write_upload_chunk(sh.ObjectId(), 0, b"") is None
+
+    sh.write_upload_chunk(upload_id, 0, b"x" * 1000)
+    assert sh.abort_upload(upload_id) and not sh.abort_upload(upload_id)
+    assert sh.db["fs.chunks"].count_documents({"files_id": upload_id}) == 0
+
+
+def test_hash_states_are_bounded(monkeypatch):
+    monkeypatch.setattr(sh, "UPLOAD_HASH_STATES", 2)
+    data = os.urandom(2 * CHUNK)
+    ids = [start(data, f"{i}.bin") for i in range(4)]
+    for upload_id in ids:
+        send(upload_id, data, [1])
+    assert list(sh._upload_hashes) == ids[2:]
+
+    send(ids[0], data, [0])  # its state was dropped: finish hashes it from GridFS
+    assert sh.finish_upload(ids[0])["hash_id"] == hashlib.sha256(data).hexdigest()
+    assert list(sh._upload_hashes) == [ids[3]]
+
+    # Finished by another server process: only that process dropped its state
+    sh.db["uploads"].update_one({"_id": ids[3]}, {"$set": {"status": "done"}})
+    sh.delete_stale_uploads()
+    assert not sh._upload_hashes